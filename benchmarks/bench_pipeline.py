@@ -0,0 +1,234 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.feed_recorder as feed_recorder
+import src.arrival_index as arrival_index
+from tests.feeds import make_subway_feed
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# BASELINES_PATH -- Where stage results are saved with --save-baseline and compared against on later runs
+BASELINES_PATH = 'benchmarks/baselines.json'
+
+# REGRESSION_THRESHOLD -- The fraction a stage's p50 latency may grow over its baseline before it is flagged as a regression
+REGRESSION_THRESHOLD = 0.2
+
+# SYNTHETIC_FRAMES -- The number of generated feeds, 30 seconds apart, used when there are no recordings or --synthetic is given
+SYNTHETIC_FRAMES = 20
+
+# SYNTHETIC_TRIPS_PER_ROUTE -- The trips per route of each generated feed, about as many as the numbered lines' feed carries at rush hour
+SYNTHETIC_TRIPS_PER_ROUTE = 100
+
+# FEED_SIZE_CHANGE_THRESHOLD -- The fraction the fixture feed may grow or shrink over the baseline's before results are also compared per trip
+FEED_SIZE_CHANGE_THRESHOLD = 0.1
+
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    """
+    Return the sample at a fraction (0 to 1) of an already sorted list, using the nearest-rank method.
+    """
+    rank = max(int(round(fraction * len(sorted_samples) + 0.5)) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+def synthetic_frames(route_id: str, frame_count: int=SYNTHETIC_FRAMES, trips_per_route: int=SYNTHETIC_TRIPS_PER_ROUTE) -> list[tuple[int, bytes]]:
+    """
+    Generate feeds shaped like the numbered lines' feed with 'tests.feeds.make_subway_feed', for runs without recordings (e.g., in CI).
+    Their stops are '101' to '142', so the queried station must be one of them.
+
+    Args:
+        route_id: The route ID of the queried line, generated along with the 1, 2 and 3
+        frame_count: The number of feeds, 30 seconds apart, each with different trip times
+        trips_per_route: The trips per route of each feed
+
+    Returns:
+        A list of (header_timestamp, data), like a feed group's list from 'feed_recorder.load_recordings'
+    """
+    routes = tuple(dict.fromkeys((route_id, '1', '2', '3')))
+    started = int(time.time()) - 30 * frame_count
+    return [(started + 30 * i, make_subway_feed(started + 30 * i, routes, trips_per_route, seed=i)) for i in range(frame_count)]
+
+def run_stage(name: str, func, min_seconds: float, min_iterations: int) -> dict:
+    """
+    Time a pipeline stage until both min_seconds and min_iterations are reached, then measure its peak memory in one more traced call.
+
+    Args:
+        name: The stage name used in the report and baselines
+        func: A callable taking the iteration number, running the stage once
+        min_seconds: The minimum total time to spend timing the stage
+        min_iterations: The minimum number of timed calls
+
+    Returns:
+        result: A dict with the stage 'name', 'iterations', 'throughput' (calls per second), 'p50_ms', 'p99_ms' and 'peak_kib'
+    """
+    func(0)  # Warm up caches and lazy imports
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_iterations or time.perf_counter() - started < min_seconds:
+        call_started = time.perf_counter()
+        func(len(samples))
+        samples.append(time.perf_counter() - call_started)
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    func(len(samples))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples.sort()
+    result = {
+        'name': name,
+        'iterations': len(samples),
+        'throughput': len(samples) / total,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'peak_kib': peak / 1024,
+    }
+    return result
+
+def build_stages(frames: list[tuple[int, bytes]], feed_group: str, subway_line: str, station_id: str, direction: str, count: int) -> list[tuple[str, object]]:
+    """
+    Build the callables for each pipeline stage, all driven by the same recorded feeds.
+
+    Args:
+        frames: Recorded (header_timestamp, data) feeds of one feed group
+        feed_group: The feed group the frames were recorded for
+        subway_line, station_id, direction, count: The arrivals query used by the lookup, format and request stages
+
+    Returns:
+        A list of (stage name, callable) in pipeline order
+    """
+    import local_wip
+    import local_app
+
+    payloads = [data for _, data in frames]
+    snapshot = mta_subway_fetcher.bin_to_snapshot(payloads[-1], feed_group)
+    arrival_index.get_arrival_index(snapshot)
+    current_time = snapshot.timestamp
+    next_train_times = local_wip.find_next_arrival_times(snapshot, subway_line, direction, station_id, count, current_time)
+    station_name = local_wip.static_index.get_static_index().stop_name(station_id)
+
+    # Serve the request stage from the fixture: publish it and mark the group as polled so no request fetches
+    mta_subway_fetcher.publish_snapshot(feed_group, snapshot)
+    mta_subway_fetcher.set_polled(feed_group, True)
+    client = local_app.app.test_client()
+    query = f"/arrivals?line={subway_line}&station={station_id}&direction={direction}&count={count}"
+
+    def format_output(i):
+        # format_arrivals prints each arrival, which would dominate the measurement
+        with contextlib.redirect_stdout(io.StringIO()):
+            local_wip.format_arrivals(subway_line, direction, station_name, count, next_train_times, current_time)
+
+    def flask_request(i):
+        response = client.get(query)
+        if response.status_code != 200:
+            raise RuntimeError(f"{query} returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    def flask_request_uncached(i):
+        # Every request renders its response, as on a new snapshot or when a minute count drops
+        local_app.RESPONSE_CACHE.clear()
+        flask_request(i)
+
+    return [
+        ('bin_to_feedmessage', lambda i: mta_subway_fetcher.bin_to_feedmessage(payloads[i % len(payloads)])),
+        ('bin_to_snapshot', lambda i: mta_subway_fetcher.bin_to_snapshot(payloads[i % len(payloads)], feed_group)),
+        ('extract_subway_line', lambda i: local_wip.extract_subway_line(subway_line, snapshot)),
+        ('build_arrival_index', lambda i: arrival_index.build_arrival_index(snapshot)),
+        ('find_next_arrival_times', lambda i: local_wip.find_next_arrival_times(snapshot, subway_line, direction, station_id, count, current_time)),
+        ('format_arrivals', format_output),
+        ('flask_request', flask_request),
+        ('flask_request_uncached', flask_request_uncached),
+    ]
+
+def compare_to_baseline(results: list[dict], feed_info: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare stage results against a saved baseline.
+
+    Args:
+        results: The outputs of 'run_stage'
+        feed_info: The 'source', 'bytes' and 'trips' of the fixture feed used for the results
+        baseline: A saved report with 'feed' and 'stages' keys
+        threshold: The fraction a stage's p50 may grow before it is flagged
+
+    Returns:
+        regressions: A message for every stage slower than its baseline by more than the threshold
+    """
+    regressions = []
+    baseline_stages = {stage['name']: stage for stage in baseline.get('stages', [])}
+    baseline_trips = baseline.get('feed', {}).get('trips') or 0
+    baseline_source = baseline.get('feed', {}).get('source')
+    if baseline_source and baseline_source != feed_info['source']:
+        print(f"Note: the baseline was run on feeds from {baseline_source}, not {feed_info['source']}")
+    size_changed = baseline_trips and abs(feed_info['trips'] - baseline_trips) > FEED_SIZE_CHANGE_THRESHOLD * baseline_trips
+    if size_changed:
+        print(f"Note: the fixture feed has {feed_info['trips']} trips against {baseline_trips} in the baseline; stages are also compared per trip")
+    for result in results:
+        previous = baseline_stages.get(result['name'])
+        if previous is None:
+            continue
+        ratio = result['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] else 1.0
+        if ratio > 1 + threshold:
+            message = f"{result['name']}: p50 {result['p50_ms']:.3f} ms vs baseline {previous['p50_ms']:.3f} ms ({ratio - 1:+.0%})"
+            if size_changed:
+                per_trip_ratio = ratio * baseline_trips / feed_info['trips']
+                message += f", {per_trip_ratio - 1:+.0%} per trip"
+            regressions.append(message)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the fetch, decode, extract, lookup and render pipeline against recorded feeds (see src/feed_recorder.py), or generated ones.")
+    parser.add_argument('--recordings', default=feed_recorder.RECORDINGS_PATH, help="The directory written by FeedRecorder")
+    parser.add_argument('--synthetic', action='store_true', help="Benchmark generated feeds instead of recordings, as is done when there are none")
+    parser.add_argument('--line', default='1', help="The subway line to query, which also selects the feed group")
+    parser.add_argument('--station', default='127', help="The station ID to query")
+    parser.add_argument('--direction', default='S')
+    parser.add_argument('--count', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=2.0, help="Minimum seconds spent timing each stage")
+    parser.add_argument('--iterations', type=int, default=20, help="Minimum timed calls per stage")
+    parser.add_argument('--baseline', default=BASELINES_PATH, help="The baseline file to compare against or save to")
+    parser.add_argument('--save-baseline', action='store_true', help="Save this run as the new baseline")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="Allowed p50 growth over the baseline before a stage is flagged")
+    args = parser.parse_args()
+
+    feed_group = mta_subway_fetcher.get_feed_group(args.line)
+    frames = None if args.synthetic else feed_recorder.load_recordings(args.recordings).get(feed_group)
+    source = args.recordings
+    if not frames:
+        if not args.synthetic:
+            print(f"No recordings for feed group '{mta_subway_fetcher.feed_group_name(feed_group)}' in {args.recordings}, generating feeds instead")
+        frames = synthetic_frames(mta_subway_fetcher.get_route_id(args.line))
+        source = 'synthetic'
+
+    stages = build_stages(frames, feed_group, args.line, args.station, args.direction, args.count)
+    last_snapshot = mta_subway_fetcher.get_cached_snapshot(feed_group)
+    feed_info = {'group': mta_subway_fetcher.feed_group_name(feed_group), 'source': source, 'frames': len(frames), 'bytes': len(frames[-1][1]), 'trips': len(last_snapshot.trips)}
+    print(f"Feed group '{feed_info['group']}': {feed_info['frames']} feeds from {source}, latest {feed_info['bytes']} bytes with {feed_info['trips']} trips")
+    print(f"{'stage':<24}{'calls':>8}{'calls/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>10}")
+    results = []
+    for name, func in stages:
+        result = run_stage(name, func, args.seconds, args.iterations)
+        results.append(result)
+        print(f"{name:<24}{result['iterations']:>8}{result['throughput']:>12.1f}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['peak_kib']:>10.1f}")
+
+    report = {'feed': feed_info, 'stages': results}
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, feed_info, baseline, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
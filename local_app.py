@@ -1,11 +1,302 @@
-from flask import Flask
+from flask import Flask, Response, g, jsonify, request
 import local_wip
+import src.metrics as metrics
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.feed_poller as feed_poller
+import src.feed_recorder as feed_recorder
+import src.arrival_stream as arrival_stream
+import src.shared_snapshot as shared_snapshot
+import src.arrival_history as arrival_history
+import src.response_cache as response_cache
+import src.mta_bus_fetcher as mta_bus_fetcher
+
+import os
+import time
 
 app = Flask(__name__)
 
+# NEARBY_DEFAULT_RADIUS_METERS, NEARBY_MAX_RADIUS_METERS -- The default and largest search radius of /nearby, in meters
+NEARBY_DEFAULT_RADIUS_METERS = 800
+NEARBY_MAX_RADIUS_METERS = 5000
+
+# NEARBY_DEFAULT_STATIONS, NEARBY_MAX_STATIONS -- The default and largest number of stations returned by /nearby
+NEARBY_DEFAULT_STATIONS = 3
+NEARBY_MAX_STATIONS = 10
+
+# Serve the arrivals published by a separate 'python -m src.shared_snapshot' process when CATCH_A_RIDE_SHARED_SNAPSHOTS is set to its directory.
+# This is read at import so every WSGI worker process (e.g., gunicorn -w 4 local_app:app) attaches to the same snapshots without fetching feeds.
+if os.environ.get("CATCH_A_RIDE_SHARED_SNAPSHOTS"):
+    mta_subway_fetcher.set_snapshot_source(shared_snapshot.SharedSnapshotReader(os.environ["CATCH_A_RIDE_SHARED_SNAPSHOTS"]))
+
+# REQUEST_SECONDS -- Time to answer each HTTP request, by endpoint and status code, exposed at /metrics
+REQUEST_SECONDS = metrics.register(metrics.Histogram('catch_a_ride_request_seconds', 'Time to answer HTTP requests.', ('endpoint', 'status')))
+
+# RESPONSE_CACHE -- Rendered responses of / and /arrivals, reused until the snapshot or the alerts change or a minute count in them drops
+RESPONSE_CACHE = response_cache.ResponseCache()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    if hasattr(g, 'request_started'):
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+def parse_query_params(items: list[str]) -> tuple[list[tuple[str, str, str, int]], str]:
+    """
+    Parse repeated 'q' parameters in the form line:station:direction:count.
+
+    Returns:
+        (queries, error): The parsed queries, and an error message for the first malformed parameter or None
+    """
+    queries = []
+    for item in items:
+        fields = item.split(":")
+        if len(fields) != 4 or not fields[3].isdigit():
+            return [], f"Query '{item}' is not in the form line:station:direction:count."
+        queries.append((fields[0], fields[1], fields[2], int(fields[3])))
+    return queries, None
+
+def parse_number_param(name: str, default, type=int):
+    """
+    Read a numeric query parameter, e.g. 'count'.
+
+    Returns:
+        The parsed value, the default if the parameter is missing, or None if it is given but cannot be parsed
+    """
+    if name not in request.args:
+        return default
+    return request.args.get(name, type=type)
+
+def coerce_count(value):
+    """
+    Convert a count given as a string in a JSON body to an integer, the same way a 'count' query parameter is parsed.
+
+    Returns:
+        The integer, or the value unchanged if it is not a string of a whole number, for 'validate_arrivals_query' to reject
+    """
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
+
+def cached_response(endpoint: str, query: tuple, subway_line: str, render, mimetype: str="application/json") -> Response:
+    """
+    Answer a request from RESPONSE_CACHE, with an ETag and Cache-Control max-age so clients can revalidate and get a 304 Not Modified.
+
+    Args:
+        endpoint: The name of the endpoint
+        query: A hashable tuple of the validated query options
+        subway_line: The line whose latest snapshot the response is answered from
+        render: A callable taking the snapshot and the current epoch time and returning the response body, or a (body, expires) tuple
+            (see 'ResponseCache.get_or_render'), called on a cache miss
+        mimetype: The mimetype of the body
+
+    Returns:
+        The Flask response, or a 304 response if the request's If-None-Match matches
+    """
+    current_time = int(time.time())
+    snapshot = mta_subway_fetcher.get_realtime_data(subway_line)
+    cached = RESPONSE_CACHE.get_or_render(endpoint, query, snapshot, current_time, lambda: render(snapshot, current_time), mimetype)
+    response = Response(cached.body, mimetype=cached.mimetype)
+    response.set_etag(cached.etag)
+    response.cache_control.max_age = cached.max_age(current_time)
+    return response.make_conditional(request)
+
+def render_arrivals(arrivals: dict, body: str, current_time: int) -> tuple[str, int]:
+    """
+    Pair a rendered response with when the minute counts of its arrivals next change, for RESPONSE_CACHE.
+    """
+    return body, response_cache.next_minute_change(arrivals['arrivals'] or [], current_time)
+
 @app.route("/")
 def index():
-    text = local_wip.catch_a_ride()
-    return text
+    def render(snapshot, current_time):
+        # The same query catch_a_ride answers, for when its minute counts change
+        arrivals = local_wip.get_arrivals("1", "127", "S", 3, current_time, snapshot)
+        return render_arrivals(arrivals, local_wip.catch_a_ride(False, snapshot, current_time), current_time)
+    return cached_response("index", (), "1", render, "text/html")
+
+@app.route("/arrivals")
+def arrivals():
+    """
+    Return the next arrivals for one line, station and direction as JSON, e.g. /arrivals?line=1&station=127&direction=S&count=3
+    Add assigned=1 to leave out trips that do not have a train assigned yet.
+    """
+    subway_line = request.args.get("line", "")
+    station_id = request.args.get("station", "")
+    direction = request.args.get("direction", "")
+    if not direction and station_id[-1:] in ["N", "S"]:
+        direction = station_id[-1]
+    count = parse_number_param("count", 3)
+    assigned_only = request.args.get("assigned", "0") == "1"
+
+    if count is None:
+        error = f"Count '{request.args.get('count')}' is not valid, please select a whole number between 1 and 5."
+    else:
+        error = local_wip.validate_arrivals_query(subway_line, station_id, direction, count)
+    if error:
+        return jsonify({'error': error}), 400
+    def render(snapshot, current_time):
+        arrivals = local_wip.get_arrivals(subway_line, station_id, direction, count, current_time, snapshot, assigned_only)
+        return render_arrivals(arrivals, app.json.dumps(arrivals), current_time)
+    return cached_response("arrivals", (subway_line, station_id, direction, count, assigned_only), subway_line, render)
+
+@app.route("/arrivals/batch", methods=["GET", "POST"])
+def batch_arrivals():
+    """
+    Return the next arrivals for several queries at once as JSON, answering every query on a feed group from one snapshot.
+    Queries are either repeated 'q' parameters as line:station:direction:count (e.g. /arrivals/batch?q=1:127:S:3&q=7:725:N:2),
+    or a POSTed JSON list of objects with the same keys as /arrivals.
+    """
+    queries = []
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        if not isinstance(body, list):
+            return jsonify({'error': "Expected a JSON list of queries."}), 400
+        for item in body:
+            if not isinstance(item, dict):
+                return jsonify({'error': "Each query must be a JSON object."}), 400
+            station_id = str(item.get("station", ""))
+            queries.append((str(item.get("line", "")), station_id, str(item.get("direction", "") or station_id[-1:]), coerce_count(item.get("count", 3))))
+    else:
+        queries, error = parse_query_params(request.args.getlist("q"))
+        if error:
+            return jsonify({'error': error}), 400
+    if not queries:
+        return jsonify({'error': "No queries given."}), 400
+    return jsonify({'results': local_wip.get_batch_arrivals(queries)})
+
+@app.route("/arrivals/stream")
+def stream_arrivals():
+    """
+    Stream the next arrivals of one or more stations as Server-Sent Events, e.g. /arrivals/stream?q=1:127:S:3&q=7:725:N:2
+    Each station is sent once on connect, then again only when its next arrivals change. Streams are fed by the background poller started with the app,
+    so they are unavailable when it is disabled.
+    """
+    queries, error = parse_query_params(request.args.getlist("q"))
+    if not error and not queries:
+        error = "No queries given."
+    for subway_line, station_id, direction, count in queries:
+        error = error or local_wip.validate_arrivals_query(subway_line, station_id, direction, count)
+    if error:
+        return jsonify({'error': error}), 400
+    poller = feed_poller.get_poller()
+    if poller is None or not poller.is_running():
+        return jsonify({'error': "Arrival streams need the background poller, which is not running."}), 503
+    subscription = arrival_stream.subscribe(queries)
+    return Response(arrival_stream.event_stream(subscription), mimetype="text/event-stream", headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route("/train")
+def train():
+    """
+    Return where a train is and its upcoming stops with track assignments as JSON, either by NYCT train ID (e.g. /train?line=1&id=01 0123+ 242/SFT)
+    or for the train arriving next at a station (e.g. /train?line=1&station=127&direction=S). Add assigned=1 to skip trips that do not have a train assigned yet.
+    """
+    subway_line = request.args.get("line", "")
+    train_id = request.args.get("id")
+    station_id = request.args.get("station", "")
+    direction = request.args.get("direction", "")
+    if not direction and station_id[-1:] in ["N", "S"]:
+        direction = station_id[-1]
+    assigned_only = request.args.get("assigned", "0") == "1"
+
+    if train_id is None:
+        error = local_wip.validate_arrivals_query(subway_line, station_id, direction, 1)
+    elif subway_line not in mta_subway_fetcher.SUBWAY_LINE_LIST:
+        error = f"Line '{subway_line}' is not valid, please select one of {mta_subway_fetcher.SUBWAY_LINE_LIST}."
+    else:
+        error = None
+    if error:
+        return jsonify({'error': error}), 400
+    result = local_wip.get_train(subway_line, train_id, station_id, direction, assigned_only=assigned_only)
+    if result is None:
+        return jsonify({'error': "No matching train in the real-time data."}), 404
+    return jsonify(result)
+
+@app.route("/board")
+def board():
+    """
+    Return the next arrivals of every route at every stop as JSON, for one line's feed group or the whole network, e.g. /board?line=1&count=3
+    """
+    subway_line = request.args.get("line")
+    count = parse_number_param("count", 3)
+    if subway_line is not None and subway_line not in mta_subway_fetcher.SUBWAY_LINE_LIST:
+        return jsonify({'error': f"Line '{subway_line}' is not valid, please select one of {mta_subway_fetcher.SUBWAY_LINE_LIST}."}), 400
+    if count is None or not 0 < count < 6:
+        return jsonify({'error': f"Count '{request.args.get('count')}' is not valid, please select a whole number between 1 and 5."}), 400
+    return jsonify({'feed_groups': local_wip.get_departure_boards(subway_line, count)})
+
+@app.route("/nearby")
+def nearby_arrivals():
+    """
+    Return the next arrivals of every line at the stations closest to a point as JSON, e.g. /nearby?lat=40.7557&lon=-73.9871&radius=800&stations=3&count=2
+    """
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    radius = parse_number_param("radius", NEARBY_DEFAULT_RADIUS_METERS, float)
+    max_stations = parse_number_param("stations", NEARBY_DEFAULT_STATIONS)
+    count = parse_number_param("count", 2)
+    direction = request.args.get("direction", "")
+
+    if lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        return jsonify({'error': "Parameters 'lat' and 'lon' must be a valid latitude and longitude."}), 400
+    if radius is None or not 0 < radius <= NEARBY_MAX_RADIUS_METERS:
+        return jsonify({'error': f"Radius must be between 0 and {NEARBY_MAX_RADIUS_METERS} meters."}), 400
+    if max_stations is None or not 0 < max_stations <= NEARBY_MAX_STATIONS:
+        return jsonify({'error': f"Stations must be a whole number between 1 and {NEARBY_MAX_STATIONS}."}), 400
+    if direction not in ["", "N", "S"]:
+        return jsonify({'error': f"Direction '{direction}' is not valid, please select N or S."}), 400
+    if count is None or not 0 < count < 6:
+        return jsonify({'error': f"Count '{request.args.get('count')}' is not valid, please select a whole number between 1 and 5."}), 400
+    return jsonify({'stations': local_wip.get_nearby_arrivals(lat, lon, radius, max_stations, count, direction or None)})
+
+@app.route("/bus/arrivals")
+def bus_arrivals():
+    """
+    Return the next bus arrivals at a stop as JSON, for one route or every route at the stop, e.g. /bus/arrivals?stop=308209&route=B63&count=3
+    """
+    stop_id = request.args.get("stop", "")
+    route_id = request.args.get("route", "")
+    count = parse_number_param("count", 3)
+    if not stop_id.isalnum():
+        return jsonify({'error': f"Stop '{stop_id}' is not a valid bus stop ID."}), 400
+    if route_id and not route_id.replace("+", "").replace("-", "").isalnum():
+        return jsonify({'error': f"Route '{route_id}' is not a valid bus route ID."}), 400
+    if count is None or not 0 < count < 6:
+        return jsonify({'error': f"Count '{request.args.get('count')}' is not valid, please select a whole number between 1 and 5."}), 400
+    arrivals = mta_bus_fetcher.get_bus_arrivals(stop_id, route_id, count)
+    if arrivals is None:
+        return jsonify({'error': "Too many new bus stops were queried, please try again in a minute."}), 429
+    return jsonify(arrivals)
+
+@app.route("/status")
+def status():
+    snapshot_ages = mta_subway_fetcher.get_snapshot_ages()
+    poller = feed_poller.get_poller()
+    return jsonify({
+        'polling': poller is not None and poller.is_running(),
+        'snapshot_age_seconds': {mta_subway_fetcher.feed_group_name(feed_group): round(age, 1) for feed_group, age in snapshot_ages.items()},
+    })
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-app.run(host="127.0.0.1", port=8080)
\ No newline at end of file
+if __name__ == "__main__":
+    # Save every fetched feed for offline replay when CATCH_A_RIDE_RECORDINGS is set to a directory
+    if os.environ.get("CATCH_A_RIDE_RECORDINGS"):
+        recorder = feed_recorder.FeedRecorder(os.environ["CATCH_A_RIDE_RECORDINGS"])
+        mta_subway_fetcher.set_feed_recorder(recorder)
+        mta_bus_fetcher.set_feed_recorder(recorder)
+    # Record every change of prediction and every resolved arrival for reliability queries when CATCH_A_RIDE_HISTORY is set to a directory
+    if os.environ.get("CATCH_A_RIDE_HISTORY"):
+        mta_subway_fetcher.add_snapshot_listener(arrival_history.ArrivalHistoryRecorder(os.environ["CATCH_A_RIDE_HISTORY"]).record)
+    # Keep every feed group refreshed in the background unless disabled with CATCH_A_RIDE_POLLER=0, or served from shared snapshots
+    if os.environ.get("CATCH_A_RIDE_POLLER", "1") != "0" and not os.environ.get("CATCH_A_RIDE_SHARED_SNAPSHOTS"):
+        feed_poller.start_poller()
+    app.run(host="127.0.0.1", port=8080)
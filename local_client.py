@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import sys
+
+# DAEMON_SOCKET_PATH -- The Unix socket local_daemon.py listens on and this client connects to. Set CATCH_A_RIDE_SOCKET to use another path.
+DAEMON_SOCKET_PATH = os.environ.get("CATCH_A_RIDE_SOCKET", "/tmp/catch-a-ride.sock")
+
+# DAEMON_TIMEOUT_SECONDS -- How long to wait for the daemon to answer, which may include a feed fetch if no snapshot is cached yet
+DAEMON_TIMEOUT_SECONDS = 15
+
+# USAGE -- The command line help, printed for unknown commands
+USAGE = """Usage: python local_client.py [--json] COMMAND [ARGS]
+
+Commands:
+  arrivals LINE STATION [DIRECTION] [COUNT]  The next arrivals (e.g., 'arrivals 1 127 S 3' or 'arrivals 1 127S')
+  stations LINE DIRECTION                    The stations of a line in travel order
+  status                                     The age of each feed group's snapshot in the daemon
+
+Answers come from a running 'python local_daemon.py'."""
+
+
+def send_request(message: dict, socket_path: str=DAEMON_SOCKET_PATH, timeout: float=DAEMON_TIMEOUT_SECONDS) -> dict:
+    """
+    Send one request to the daemon and wait for its answer. Requests and answers are single lines of JSON.
+
+    Args:
+        message: A dict with the 'command' and its options, as handled by 'local_daemon.handle_request'
+        socket_path: The path of the daemon's Unix socket
+        timeout: The number of seconds to wait for the answer
+
+    Returns:
+        response: A dict with the 'result', or an 'error' message
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if chunk.endswith(b'\n'):
+                break
+    return json.loads(b''.join(chunks))
+
+def parse_args(args: list[str]) -> dict:
+    """
+    Convert command line arguments to a daemon request.
+
+    Returns:
+        message: The request dict, or None if the arguments are not a known command
+    """
+    if not args:
+        return None
+    command, options = args[0], args[1:]
+    if command == "arrivals" and 2 <= len(options) <= 4:
+        subway_line, station_id = options[0], options[1]
+        direction = options[2] if len(options) > 2 else station_id[-1:]
+        count = options[3] if len(options) > 3 else "3"
+        if not count.isdigit():
+            return None
+        return {'command': command, 'line': subway_line, 'station': station_id, 'direction': direction, 'count': int(count)}
+    if command == "stations" and len(options) == 2:
+        return {'command': command, 'line': options[0], 'direction': options[1]}
+    if command == "status" and not options:
+        return {'command': command}
+    return None
+
+def format_response(message: dict, result) -> str:
+    """
+    Write a daemon result as text for the terminal.
+    """
+    if message['command'] == "arrivals":
+        return result['text']
+    if message['command'] == "stations":
+        return "\n".join(f"{station['station_id']}\t{station['station_name']}" for station in result)
+    return "\n".join(f"{feed_group}\t{age}s" for feed_group, age in result['snapshot_age_seconds'].items())
+
+def main() -> int:
+    args = sys.argv[1:]
+    as_json = "--json" in args
+    if as_json:
+        args.remove("--json")
+    message = parse_args(args)
+    if message is None:
+        print(USAGE, file=sys.stderr)
+        return 2
+    try:
+        response = send_request(message)
+    except OSError as e:
+        print(f"Could not reach the daemon at {DAEMON_SOCKET_PATH} ({e}). Start it with 'python local_daemon.py'.", file=sys.stderr)
+        return 1
+    if 'error' in response:
+        print(response['error'], file=sys.stderr)
+        return 1
+    print(json.dumps(response['result'], indent=2) if as_json else format_response(message, response['result']))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import local_wip
+import local_client
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.mta_stops_to_stations as mta_stops_to_stations
+import src.static_index as static_index
+import src.static_timetable as static_timetable
+import src.feed_poller as feed_poller
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+
+
+def handle_request(message: dict) -> dict:
+    """
+    Answer one client request from the daemon's warm snapshots and indexes.
+
+    Args:
+        message: A dict with the 'command' ('arrivals', 'stations' or 'status') and its options, as built by 'local_client.parse_args'
+
+    Returns:
+        response: A dict with the 'result', or an 'error' message
+    """
+    command = message.get('command')
+    if command == "arrivals":
+        subway_line = str(message.get('line', ''))
+        station_id = str(message.get('station', ''))
+        direction = str(message.get('direction', '') or station_id[-1:])
+        count = message.get('count', 3)
+        error = local_wip.validate_arrivals_query(subway_line, station_id, direction, count)
+        if error:
+            return {'error': error}
+        return {'result': local_wip.get_arrivals(subway_line, station_id, direction, count)}
+    if command == "stations":
+        subway_line = str(message.get('line', ''))
+        direction = str(message.get('direction', ''))
+        if subway_line not in mta_subway_fetcher.SUBWAY_LINE_LIST:
+            return {'error': f"Line '{subway_line}' is not valid, please select one of {mta_subway_fetcher.SUBWAY_LINE_LIST}."}
+        if direction not in ["N", "S"]:
+            return {'error': f"Direction '{direction}' is not valid, please select N or S."}
+        static_stops = static_index.get_static_index()
+        return {'result': [{'station_id': station_id, 'station_name': static_stops.stop_name(station_id)}
+                           for station_id in mta_stops_to_stations.get_station_list(subway_line, direction)]}
+    if command == "status":
+        return {'result': {'snapshot_age_seconds': {mta_subway_fetcher.feed_group_name(feed_group): round(age, 1)
+                                                    for feed_group, age in mta_subway_fetcher.get_snapshot_ages().items()}}}
+    return {'error': f"Unknown command '{command}'."}
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answer each line of JSON sent on a connection with one line of JSON, until the client closes it.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                response = handle_request(message) if isinstance(message, dict) else {'error': "Expected a JSON object."}
+            except ValueError as e:
+                response = {'error': f"Invalid request: {e}"}
+            except Exception as e:
+                print(f"Error answering {line!r}: {e}")
+                response = {'error': "Internal error."}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def warm_up() -> None:
+    """
+    Load the static indexes and start polling every feed group, so the first query does not pay for any of it.
+    """
+    static_index.get_static_index()
+    mta_stops_to_stations.load_static_stations()
+    static_timetable.get_static_timetable()
+    feed_poller.start_poller()
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep snapshots and indexes warm and answer queries from local_client.py over a Unix socket.")
+    parser.add_argument('--socket', default=local_client.DAEMON_SOCKET_PATH, help="The path of the Unix socket to listen on")
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        try:
+            local_client.send_request({'command': "status"}, args.socket, timeout=1)
+            parser.error(f"A daemon is already answering on {args.socket}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            # A socket file left by a daemon that did not shut down cleanly would make binding fail
+            os.remove(args.socket)
+        except (OSError, ValueError):
+            # A daemon that accepts the connection but answers late (or not at all) may still be running, so its socket is left alone
+            parser.error(f"A daemon may be running but busy on {args.socket}; remove the socket if it is not")
+    warm_up()
+    server = DaemonServer(args.socket, DaemonRequestHandler)
+    os.chmod(args.socket, 0o600)
+    print(f"Answering queries on {args.socket}")
+    # Stopping the daemon (e.g., from systemd) removes the socket like Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        feed_poller.stop_poller()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.feed_recorder as feed_recorder
+import src.mta_bus_fetcher as mta_bus_fetcher
+from src.gtfsproto import nyct_subway_pb2
+
+import argparse
+import gzip
+import random
+import time
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# REPLAY_PATH_PREFIX -- The decoded path of SUBWAY_BASE_URL on the MTA API, followed by the feed group suffix
+REPLAY_PATH_PREFIX = '/Dataservice/mtagtfsfeeds/nyct/gtfs'
+
+
+def shift_feed_times(data: bytes, offset: int) -> bytes:
+    """
+    Move every time in a recorded feed by the same number of seconds: the header, trip update and vehicle timestamps, predicted arrivals and departures,
+    and alert active periods. Times left unset (0) stay unset.
+
+    Args:
+        data: A protobuf-encoded FeedMessage
+        offset: The number of seconds to add
+
+    Returns:
+        The re-encoded FeedMessage
+    """
+    feed = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    feed.ParseFromString(data)
+    feed.header.timestamp += offset
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            trip_update = entity.trip_update
+            if trip_update.timestamp:
+                trip_update.timestamp += offset
+            for update in trip_update.stop_time_update:
+                if update.arrival.time:
+                    update.arrival.time += offset
+                if update.departure.time:
+                    update.departure.time += offset
+        if entity.HasField('vehicle') and entity.vehicle.timestamp:
+            entity.vehicle.timestamp += offset
+        if entity.HasField('alert'):
+            for period in entity.alert.active_period:
+                if period.start:
+                    period.start += offset
+                if period.end:
+                    period.end += offset
+    return feed.SerializeToString()
+
+
+class FeedReplay:
+    """
+    Play back recorded feeds on a shared timeline, so every feed group advances together like the live API.
+
+    Args:
+        recordings: The output of 'feed_recorder.load_recordings'
+        speed: How many seconds of recording pass per second of wall-clock time
+        loop: Whether to start over once the end of the recording is reached (True) or keep serving the last feed (False)
+        rebase_times: Whether to shift the times in each served feed by the playback offset, so the feed reads as generated now and its arrivals lie ahead
+            of the wall clock (True), or to serve the recorded bytes unchanged (False)
+    """
+
+    def __init__(self, recordings: dict[str, list[tuple[int, bytes]]], speed: float=1.0, loop: bool=True, rebase_times: bool=True):
+        self.recordings = recordings
+        self.timestamps = {feed_group: [frame[0] for frame in frames] for feed_group, frames in recordings.items()}
+        self.first_timestamp = min(timestamps[0] for timestamps in self.timestamps.values())
+        self.last_timestamp = max(timestamps[-1] for timestamps in self.timestamps.values())
+        self.speed = speed
+        self.loop = loop
+        self.rebase_times = rebase_times
+        self.started = time.monotonic()
+        # The last shifted frame per feed group, as ((position, offset), data), so a frame is re-encoded only when it or the offset changes
+        self._shifted = {}
+
+    def current_frame(self, feed_group: str) -> bytes:
+        """
+        Return the recorded feed of a group that was the latest at the current playback time, or None for a group with no recording.
+        """
+        if feed_group not in self.recordings:
+            return None
+        elapsed = (time.monotonic() - self.started) * self.speed
+        span = self.last_timestamp - self.first_timestamp
+        if self.loop and span > 0:
+            elapsed %= span + 1
+        playback_timestamp = self.first_timestamp + elapsed
+        position = max(bisect_right(self.timestamps[feed_group], playback_timestamp) - 1, 0)
+        data = self.recordings[feed_group][position][1]
+        if not self.rebase_times:
+            return data
+        key = (position, int(time.time() - playback_timestamp))
+        shifted = self._shifted.get(feed_group)
+        if shifted is None or shifted[0] != key:
+            shifted = (key, shift_feed_times(data, key[1]))
+            self._shifted[feed_group] = shifted
+        return shifted[1]
+
+
+def make_handler(replay: FeedReplay, latency: float, error_rate: float):
+    """
+    Build a request handler class serving the replay on the same paths as the MTA API.
+
+    Args:
+        replay: The FeedReplay to serve
+        latency: The mean added delay per response, in seconds (exponentially distributed)
+        error_rate: The fraction of requests answered with a 503 error, between 0 and 1
+    """
+    feed_groups = {feed_group: feed_group for feed_group in mta_subway_fetcher.FEED_GROUPS}
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if latency > 0:
+                time.sleep(random.expovariate(1 / latency))
+            path = unquote(urlsplit(self.path).path)
+            if path == mta_bus_fetcher.BUS_TRIP_UPDATES_PATH:
+                feed_group = mta_bus_fetcher.BUS_FEED_GROUP
+            else:
+                feed_group = feed_groups.get(path[len(REPLAY_PATH_PREFIX):]) if path.startswith(REPLAY_PATH_PREFIX) else None
+            data = replay.current_frame(feed_group) if feed_group is not None else None
+            if data is None:
+                self.send_error(404, f"No recording for {path}")
+                return
+            if random.random() < error_rate:
+                self.send_error(503, "Injected error")
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data, compresslevel=1)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded MTA feeds on the same paths as the real-time API. Point the fetchers at it with MTA_SUBWAY_BASE_URL=http://HOST:PORT/Dataservice/mtagtfsfeeds/nyct%%2Fgtfs "
+                                                 "and MTA_BUS_BASE_URL=http://HOST:PORT")
+    parser.add_argument('--recordings', default=feed_recorder.RECORDINGS_PATH, help="The directory written by FeedRecorder")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean added delay per response, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 503 error")
+    parser.add_argument('--speed', type=float, default=1.0, help="Seconds of recording played per second")
+    parser.add_argument('--no-loop', action='store_true', help="Keep serving the last feed instead of starting over")
+    parser.add_argument('--original-times', action='store_true', help="Serve the recorded times unchanged instead of shifting them to the wall clock")
+    args = parser.parse_args()
+
+    recordings = feed_recorder.load_recordings(args.recordings, mta_subway_fetcher.FEED_GROUPS + [mta_bus_fetcher.BUS_FEED_GROUP])
+    if not recordings:
+        parser.error(f"No recordings found in {args.recordings}")
+    replay = FeedReplay(recordings, args.speed, not args.no_loop, not args.original_times)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(replay, args.latency, args.error_rate))
+    print(f"Replaying {sum(len(frames) for frames in recordings.values())} feeds for {len(recordings)} feed groups on http://{args.host}:{args.port}{REPLAY_PATH_PREFIX}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,31 @@
 import src.mta_subway_fetcher as mta_subway_fetcher
 import src.mta_stops_to_stations as mta_stops_to_stations
+import src.arrival_index as arrival_index
+import src.static_index as static_index
+import src.metrics as metrics
+import src.alert_store as alert_store
+import src.station_locator as station_locator
+import src.departure_board as departure_board
+import src.static_timetable as static_timetable
+import src.train_tracker as train_tracker
+from src.feed_records import FeedSnapshot, TripRecord
 
 from datetime import datetime
 from collections import defaultdict
 import json
 
+# SCHEDULE_FALLBACK_AGE_SECONDS -- How old a stale real-time snapshot may get before scheduled arrivals are answered instead
+SCHEDULE_FALLBACK_AGE_SECONDS = 300
+
+# STAGE_SECONDS -- Time spent in each request stage of this module ('extract', 'lookup', 'format') per feed group, exposed at /metrics
+STAGE_SECONDS = metrics.register(metrics.Histogram('catch_a_ride_stage_seconds', 'Time spent in each arrivals stage.', ('stage', 'feed_group')))
+
+def _group_name(subway_line: str) -> str:
+    """
+    Return the readable feed group name of a line, for the STAGE_SECONDS labels.
+    """
+    return mta_subway_fetcher.feed_group_name(mta_subway_fetcher.get_feed_group(subway_line))
+
 def get_subway_selection(realtime_stations: bool=True) -> tuple[str, str, str, str, int]:
     """
     Prompt the user to select a subway line, station, and direction
@@ -39,23 +60,17 @@ def get_subway_selection(realtime_stations: bool=True) -> tuple[str, str, str, s
 
     # Create the list of available subway stations IDs, either from real-time data or cached standard weekday service stops
     if realtime_stations:
-        realtime_stops_for_lines = mta_stops_to_stations.get_stops_for_lines([input_line])
-        selected_line_station_ids_north, selected_line_station_ids_south = mta_stops_to_stations.split_directionality_and_dedupe(realtime_stops_for_lines)
-        if input_direction == "N":
-            selected_line_station_ids = selected_line_station_ids_north[f"{input_line}N"]
-        elif input_direction == "S":
-            selected_line_station_ids = selected_line_station_ids_south[f"{input_line}S"]
+        selected_line_station_ids = mta_stops_to_stations.get_station_list(input_line, input_direction)
     else:
         with open('data/stations_per_line.json', 'r') as f:
             all_stations = json.load(f)
         selected_line_station_ids = all_stations[input_line]
 
     # Convert stop IDs to human-readable station names
-    with open('data/id_to_name.json', 'r') as f:
-        all_station_names = json.load(f)
+    static_stops = static_index.get_static_index()
     selected_line_stations = defaultdict(str)
     for id in selected_line_station_ids:
-        selected_line_stations[all_station_names[id]] = id
+        selected_line_stations[static_stops.stop_name(id)] = id
 
     input_validator = True
     while input_validator:
@@ -78,106 +93,133 @@ def get_subway_selection(realtime_stations: bool=True) -> tuple[str, str, str, s
         
     return input_line, input_direction, input_station_id, input_station_name, input_count
 
-def fetch_data_from_input(subway_line: str) -> dict:
+def fetch_data_from_input(subway_line: str, debug_dump: bool=False) -> FeedSnapshot:
     """
     Collect input from the user to fetch real-time data for the selected subway line.
 
     Args:
         subway_line: A string representing the chosen subway line
+        debug_dump: Whether to also fetch the full dict version of the feed and save it to 'tmp/' for debugging (False, default)
 
     Returns:
-        subway_data: A dict of MTA real-time data for the subway line group of the desired line (e.g., 1/2/3/4/5/6/7/S for input '1')
+        subway_data: A FeedSnapshot of MTA real-time data for the subway line group of the desired line (e.g., 1/2/3/4/5/6/7/S for input '1')
     """
     subway_data = mta_subway_fetcher.get_realtime_data(subway_line)
-    output_filepath = f'tmp/{subway_line}_group-data.json'
-    with open(output_filepath, 'w') as f:
-        json.dump(subway_data, f, indent=2)
+    if debug_dump:
+        output_filepath = f'tmp/{subway_line}_group-data.json'
+        with open(output_filepath, 'w') as f:
+            json.dump(mta_subway_fetcher.get_realtime_data(subway_line, as_dict=True), f, indent=2)
     return subway_data
 
-def extract_subway_line(subway_line: str, subway_group_dict: dict) -> dict:
+def extract_subway_line(subway_line: str, subway_group_data: FeedSnapshot) -> list[TripRecord]:
     """
     For real-time data on a given group of subway lines, extract only the desired subway line.
     
     Args:
         subway_line: A string representing the chosen subway line
-        subway_group_dict: A dict of MTA real-time data for the subway line group of the desired line (e.g., 1/2/3/4/5/6/7/S for input '1')
+        subway_group_data: A FeedSnapshot of MTA real-time data for the subway line group of the desired line (e.g., 1/2/3/4/5/6/7/S for input '1')
     
     Returns:
-        line_stats: The input dict 'subway_group_dict' with the value in 'entity' filtered down to only the chosen subway line. Note that the 'header' values still contain Route IDs for the entire group, although these values are unused.
-    """
-    line_stats = {'header': None, 'entity': []}
-    line_stats['header'] = subway_group_dict['header']
-    for e in subway_group_dict['entity']:
-        if e.get('tripUpdate') and e['tripUpdate'].get('stopTimeUpdate') and e['tripUpdate']['trip']['routeId'] == subway_line:
-            line_stats['entity'].append(e)
-    output_filepath = f'tmp/{subway_line}.json'
-    with open(output_filepath, 'w') as f:
-        json.dump(line_stats, f, indent=2)
+        line_stats: A list of the trips in 'subway_group_data' for only the chosen subway line that have upcoming stops
+    """
+    route_id = mta_subway_fetcher.get_route_id(subway_line)
+    with STAGE_SECONDS.time(stage='extract', feed_group=_group_name(subway_line)):
+        line_stats = [trip for trip in subway_group_data.trips.values() if trip.route_id == route_id and trip.stop_times]
     return line_stats
 
-def find_next_arrival_times(subway_lines_stats: dict, direction: str, station_name: str, next_x_trains: int, current_time: int) -> list[int]:
+def find_next_arrival_times(subway_group_data: FeedSnapshot, subway_line: str, direction: str, station_name: str, next_x_trains: int, current_time: int, assigned_only: bool=False) -> list[int]:
     """
     For a given subway line's data, a direction, and a station stop, find the next X arrival times.
     
     Args:
-        subway_lines_stats: A dict of MTA real-time data for the chosen subway line
+        subway_group_data: A FeedSnapshot of MTA real-time data for the subway line group of the desired line
+        subway_line: A string representing the chosen subway line
         direction: A string representing the chosen direction (uptown/northbound or downtown/southbound)
         station_name: A string representing the chosen subway station
         next_x_trains: An integer representing the count of upcoming subway lines to return
         current_time: An integer representing the current epoch time (converted from float to match MTA output)
+        assigned_only: Whether to skip trips that do not have a train assigned yet, whose predictions are less reliable (False, default)
     
     Returns:
-        arrival_times: A list of integers representing arrival times of upcoming trains, in Epoch time
+        arrival_times: A list of integers representing arrival times of upcoming trains, in Epoch time, earliest first
     """
     if station_name[-1] == "S" or station_name[-1] == "N":
         full_station_name = station_name
     else:
         full_station_name = station_name + direction
-    inc = 0
-    arrival_times = []
-    for e in subway_lines_stats['entity']:
-        if inc >= next_x_trains:
-            break
-        for i in e['tripUpdate']['stopTimeUpdate']:
-            if i['stopId'] == full_station_name and int(i['arrival']['time']) > current_time:
-                arrival_times.append(int(i['arrival']['time']))
-                inc += 1
+    route_id = mta_subway_fetcher.get_route_id(subway_line)
+    with STAGE_SECONDS.time(stage='lookup', feed_group=_group_name(subway_line)):
+        if assigned_only:
+            station_index = train_tracker.get_assigned_arrival_index(subway_group_data)
+        else:
+            station_index = arrival_index.get_arrival_index(subway_group_data)
+        arrival_times = arrival_index.next_arrivals(station_index, route_id, full_station_name, current_time, next_x_trains)
     return arrival_times
 
-def catch_a_ride(get_user_input: bool=False):
+def validate_arrivals_query(subway_line: str, station_id: str, direction: str, count: int) -> str:
     """
-    Primary function to collect subway station arrival data.
-    
+    Check the options of an arrivals query, the same way 'get_subway_selection' validates user input.
+
     Args:
-        get_user_input: Whether to fetch real-time station data (True, if run directly) or use default options of three downtown 1 trains at Times Square (False, default)
-    
+        subway_line: A string representing the chosen subway line
+        station_id: A string representing the chosen subway station ID, with or without direction suffix
+        direction: A string representing the chosen direction, 'N' or 'S'
+        count: An integer representing the count of upcoming subway lines to return
+
     Returns:
-        output: HTML formatted text for displaying the train arrival data.
-        *Also prints data to stdout
+        An error message describing the first invalid option, or None if the query is valid
+    """
+    if subway_line not in mta_subway_fetcher.SUBWAY_LINE_LIST:
+        return f"Line '{subway_line}' is not valid, please select one of {mta_subway_fetcher.SUBWAY_LINE_LIST}."
+    if direction not in ["N", "S"]:
+        return f"Direction '{direction}' is not valid, please select N or S."
+    if not station_id or station_id not in static_index.get_static_index():
+        return f"Station '{station_id}' is not a known station ID."
+    if not mta_stops_to_stations.is_station_on_line(subway_line, station_id):
+        return f"Station '{station_id}' is not on the {subway_line} line."
+    if station_id[-1] in ["N", "S"] and station_id[-1] != direction:
+        return f"Station '{station_id}' does not match direction '{direction}'."
+    # JSON true and false are ints in Python, but not counts
+    if not isinstance(count, int) or isinstance(count, bool) or not 0 < count < 6:
+        return f"Count '{count}' is not valid, please select a whole number between 1 and 5."
+    return None
 
+def format_arrivals(subway_line: str, direction: str, station_name: str, count: int, next_train_times: list[int], current_time: int, html: bool=True) -> str:
     """
-    if get_user_input:
-        subway_line, direction, station_id, station_name, count = get_subway_selection()
-    else:
-        subway_line = "1"
-        direction = "S"
-        station_id = "127"
-        station_name = "Times Sq-42 St"
-        count = 3
-    subway_group_stats = fetch_data_from_input(subway_line)
-    subway_line_stats = extract_subway_line(subway_line, subway_group_stats)
-    
-    current_time = int(datetime.now().timestamp())
-    next_train_times = find_next_arrival_times(subway_line_stats, direction, station_id, count, current_time)
+    Write the arrival times of upcoming trains as text for displaying or speaking.
+
+    Args:
+        subway_line: A string representing the chosen subway line
+        direction: A string representing the chosen direction (uptown/northbound or downtown/southbound)
+        station_name: A string representing the chosen subway station
+        count: An integer representing the count of upcoming subway lines requested
+        next_train_times: A list of integers representing arrival times of upcoming trains, in Epoch time
+        current_time: An integer representing the current epoch time
+        html: Whether to return one arrival per line of HTML (True, default) or a single conversational sentence (False)
 
+    Returns:
+        output: The formatted text
+    """
     if direction == "S":
         direction_long = "southbound"
     else:
         direction_long = "northbound"
+    next_times = [int((i-current_time) / 60.0) for i in next_train_times]
+
+    if not html:
+        if not next_times:
+            return f"There are no upcoming {direction_long} {subway_line} trains at {station_name}."
+        if len(next_times) == 1:
+            minutes = f"{next_times[0]}"
+        elif len(next_times) == 2:
+            minutes = f"{next_times[0]} and {next_times[1]}"
+        else:
+            minutes = ", ".join(str(i) for i in next_times[:-1]) + f", and {next_times[-1]}"
+        unit = "minute" if next_times == [1] else "minutes"
+        return f"The next {count} {direction_long} {subway_line} trains at {station_name} are arriving in {minutes} {unit}."
 
     output = f"The next {count} {direction_long} {subway_line} trains at {station_name} are arriving in:<br>"
-    for i in next_train_times:
-        next_time = int((i-current_time) / 60.0)
+    for next_time in next_times:
         print(f"Train arriving in {next_time} minutes")
         if next_time == 1:
             output += f"{next_time} minute<br>"
@@ -187,5 +229,255 @@ def catch_a_ride(get_user_input: bool=False):
     output = output[:-4]
     return output
 
+def needs_schedule_fallback(subway_group_stats: FeedSnapshot, current_time: int) -> bool:
+    """
+    Check whether arrivals should be taken from the static timetable: when real-time data is unavailable, or stale for over SCHEDULE_FALLBACK_AGE_SECONDS.
+    """
+    return subway_group_stats is None or (subway_group_stats.stale and current_time - subway_group_stats.timestamp > SCHEDULE_FALLBACK_AGE_SECONDS)
+
+def get_scheduled_arrival_times(subway_line: str, station_id: str, direction: str, count: int, current_time: int) -> list[int]:
+    """
+    Find the next scheduled arrivals at a station from the static timetable, for when real-time data cannot be used.
+
+    Args:
+        subway_line, station_id, direction, count, current_time: As for 'get_arrivals'
+
+    Returns:
+        next_train_times: A list of up to 'count' scheduled arrival epoch times, or None if the timetable is unavailable
+    """
+    timetable = static_timetable.get_static_timetable()
+    if timetable is None:
+        return None
+    stop_id = station_id if station_id[-1] in ["N", "S"] else station_id + direction
+    return timetable.next_arrivals(mta_subway_fetcher.get_route_id(subway_line), stop_id, current_time, count)
+
+def get_arrivals(subway_line: str, station_id: str, direction: str, count: int, current_time: int=None, subway_group_stats: FeedSnapshot=None, assigned_only: bool=False) -> dict:
+    """
+    Find the next arrivals for a validated query, without any file I/O.
+
+    Args:
+        subway_line: A string representing the chosen subway line
+        station_id: A string representing the chosen subway station ID, with or without direction suffix
+        direction: A string representing the chosen direction, 'N' or 'S'
+        count: An integer representing the count of upcoming subway lines to return
+        current_time: An integer representing the current epoch time. Defaults to now.
+        subway_group_stats: The FeedSnapshot to answer from. Defaults to the latest snapshot of the line's feed group.
+        assigned_only: Whether to skip real-time trips that do not have a train assigned yet (False, default)
+
+    Returns:
+        arrivals: A dict with the query, the arrival epoch times, the minutes until each arrival, the conversational 'text',
+            the feed header 'timestamp', whether the data is 'stale', and the active 'alerts' for the line at the station (see 'alert_store.get_alert_summaries').
+            When real-time data is unavailable, or stale for over SCHEDULE_FALLBACK_AGE_SECONDS, the arrivals are taken from the static timetable and 'scheduled' is True.
+            'arrivals' is None when neither is available.
+    """
+    if current_time is None:
+        current_time = int(datetime.now().timestamp())
+    station_name = static_index.get_static_index().stop_name(station_id)
+    arrivals = {
+        'line': subway_line,
+        'station_id': station_id,
+        'station_name': station_name,
+        'direction': direction,
+        'count': count,
+        'arrivals': None,
+        'minutes': None,
+        'timestamp': None,
+        'stale': False,
+        'scheduled': False,
+    }
+    if subway_group_stats is None:
+        subway_group_stats = mta_subway_fetcher.get_realtime_data(subway_line)
+    arrivals['alerts'] = alert_store.get_alert_summaries(mta_subway_fetcher.get_route_id(subway_line), station_id, current_time)
+    if needs_schedule_fallback(subway_group_stats, current_time):
+        unavailable = f"Real-time data for the {subway_line} train is unavailable right now."
+        next_train_times = get_scheduled_arrival_times(subway_line, station_id, direction, count, current_time)
+        if next_train_times is None:
+            arrivals['text'] = unavailable
+            return arrivals
+        arrivals['arrivals'] = next_train_times
+        arrivals['minutes'] = [int((i-current_time) / 60.0) for i in next_train_times]
+        arrivals['scheduled'] = True
+        arrivals['text'] = f"{unavailable} Scheduled times: " + format_arrivals(subway_line, direction, station_name, count, next_train_times, current_time, html=False)
+        return arrivals
+
+    next_train_times = find_next_arrival_times(subway_group_stats, subway_line, direction, station_id, count, current_time, assigned_only)
+    arrivals['arrivals'] = next_train_times
+    arrivals['minutes'] = [int((i-current_time) / 60.0) for i in next_train_times]
+    arrivals['timestamp'] = subway_group_stats.timestamp
+    arrivals['stale'] = subway_group_stats.stale
+    with STAGE_SECONDS.time(stage='format', feed_group=_group_name(subway_line)):
+        arrivals['text'] = format_arrivals(subway_line, direction, station_name, count, next_train_times, current_time, html=False)
+    return arrivals
+
+def get_batch_arrivals(queries: list[tuple[str, str, str, int]], current_time: int=None) -> list[dict]:
+    """
+    Answer several arrivals queries at once, e.g. for transfers or a household board.
+    Queries are grouped by feed group, so each group is fetched at most once and every query on it is answered from the same snapshot.
+
+    Args:
+        queries: A list of (subway_line, station_id, direction, count) tuples
+        current_time: An integer representing the current epoch time, shared by every query. Defaults to now.
+
+    Returns:
+        results: A list with one dict per query, in the same order. Valid queries get the output of 'get_arrivals', and invalid ones a dict with an 'error' message.
+    """
+    if current_time is None:
+        current_time = int(datetime.now().timestamp())
+    results = [None] * len(queries)
+    queries_per_group = defaultdict(list)
+    for position, (subway_line, station_id, direction, count) in enumerate(queries):
+        error = validate_arrivals_query(subway_line, station_id, direction, count)
+        if error:
+            results[position] = {'error': error}
+        else:
+            queries_per_group[mta_subway_fetcher.get_feed_group(subway_line)].append(position)
+
+    for feed_group, positions in queries_per_group.items():
+        # Any line of the group fetches the same feed
+        subway_group_stats = mta_subway_fetcher.get_realtime_data(queries[positions[0]][0])
+        for position in positions:
+            subway_line, station_id, direction, count = queries[position]
+            results[position] = get_arrivals(subway_line, station_id, direction, count, current_time, subway_group_stats)
+    return results
+
+def get_nearby_arrivals(lat: float, lon: float, radius_meters: float, max_stations: int, count: int, direction: str=None, current_time: int=None) -> list[dict]:
+    """
+    Find the next arrivals of every line at the stations closest to a point, e.g. for "trains near me".
+
+    Args:
+        lat: The latitude of the point
+        lon: The longitude of the point
+        radius_meters: The maximum distance to a station in meters
+        max_stations: The maximum number of stations to include
+        count: An integer representing the count of upcoming trains to return per line and direction
+        direction: 'N' or 'S' to only include one direction. Defaults to both.
+        current_time: An integer representing the current epoch time. Defaults to now.
+
+    Returns:
+        stations: A list with one dict per station, nearest first, with the 'station_id', 'station_name', 'distance_meters'
+            and the outputs of 'get_arrivals' for each line and direction at the station as 'arrivals'
+    """
+    locator = station_locator.get_station_locator()
+    nearby = locator.nearest(lat, lon, radius_meters, max_stations)
+    directions = [direction] if direction else ["N", "S"]
+    queries = []
+    for station_id, _ in nearby:
+        for subway_line in locator.lines_at(station_id):
+            queries.extend((subway_line, station_id, line_direction, count) for line_direction in directions)
+    results = iter(get_batch_arrivals(queries, current_time))
+
+    stations = []
+    for station_id, distance in nearby:
+        lines = locator.lines_at(station_id)
+        stations.append({
+            'station_id': station_id,
+            'station_name': static_index.get_static_index().stop_name(station_id),
+            'distance_meters': round(distance),
+            'arrivals': [next(results) for _ in range(len(lines) * len(directions))],
+        })
+    return stations
+
+def get_departure_boards(subway_line: str=None, count: int=departure_board.DEPARTURE_BOARD_COUNT, current_time: int=None) -> dict[str, dict]:
+    """
+    Compute the next arrivals at every stop of one or every feed group, e.g. for a wall display.
+
+    Args:
+        subway_line: A line whose feed group to include. Defaults to every feed group.
+        count: An integer representing the count of upcoming trains to return per route and stop
+        current_time: An integer representing the current epoch time. Defaults to now.
+
+    Returns:
+        boards: A dict with keys as feed group names and values as the output of 'DepartureBoard.to_dict' plus whether the data is 'stale'.
+            Feed groups without real-time data are left out.
+    """
+    if current_time is None:
+        current_time = int(datetime.now().timestamp())
+    if subway_line is not None:
+        group_lines = [subway_line]
+    else:
+        # Any line of a group fetches the same feed
+        group_lines = list({mta_subway_fetcher.get_feed_group(line): line for line in reversed(mta_subway_fetcher.SUBWAY_LINE_LIST)}.values())
+    boards = {}
+    for group_line in group_lines:
+        subway_group_stats = mta_subway_fetcher.get_realtime_data(group_line)
+        if subway_group_stats is None:
+            continue
+        board = departure_board.build_departure_board(subway_group_stats, current_time, count).to_dict()
+        board['stale'] = subway_group_stats.stale
+        boards[mta_subway_fetcher.feed_group_name(mta_subway_fetcher.get_feed_group(group_line))] = board
+    return boards
+
+def get_train(subway_line: str, train_id: str=None, station_id: str=None, direction: str=None, current_time: int=None, assigned_only: bool=False) -> dict:
+    """
+    Find a train by its NYCT train ID, or the train arriving next at a station, and describe where it is and its upcoming stops.
+
+    Args:
+        subway_line: A string representing the subway line whose feed group to search
+        train_id: The NYCT train ID (e.g., '01 0123+ 242/SFT'). If not given, the next train at station_id is found instead.
+        station_id: A string representing the subway station ID, with or without direction suffix
+        direction: A string representing the direction at the station, 'N' or 'S'
+        current_time: An integer representing the current epoch time. Defaults to now.
+        assigned_only: Whether to skip trips that do not have a train assigned yet when finding the next train (False, default)
+
+    Returns:
+        train: The output of 'TrainIndex.position' plus the feed header 'timestamp' and whether the data is 'stale',
+            or None if there is no real-time data or no matching train
+    """
+    if current_time is None:
+        current_time = int(datetime.now().timestamp())
+    subway_group_stats = mta_subway_fetcher.get_realtime_data(subway_line)
+    if subway_group_stats is None:
+        return None
+    trains = train_tracker.get_train_index(subway_group_stats)
+    if train_id is None:
+        stop_id = station_id if station_id[-1] in ["N", "S"] else station_id + direction
+        next_trains = trains.next_trains(mta_subway_fetcher.get_route_id(subway_line), stop_id, current_time, 1, assigned_only)
+        if not next_trains:
+            return None
+        train_id = next_trains[0]
+    train = trains.position(train_id, current_time)
+    if train is not None:
+        train['timestamp'] = subway_group_stats.timestamp
+        train['stale'] = subway_group_stats.stale
+    return train
+
+def catch_a_ride(get_user_input: bool=False, subway_group_stats: FeedSnapshot=None, current_time: int=None):
+    """
+    Primary function to collect subway station arrival data.
+    
+    Args:
+        get_user_input: Whether to fetch real-time station data (True, if run directly) or use default options of three downtown 1 trains at Times Square (False, default)
+        subway_group_stats: The FeedSnapshot to answer from. Defaults to the latest snapshot of the line's feed group.
+        current_time: An integer representing the current epoch time. Defaults to now.
+    
+    Returns:
+        output: HTML formatted text for displaying the train arrival data. When real-time data is unavailable, or stale for over SCHEDULE_FALLBACK_AGE_SECONDS,
+            the scheduled arrivals from the static timetable, as for 'get_arrivals'.
+        *Also prints data to stdout
+
+    """
+    if get_user_input:
+        subway_line, direction, station_id, station_name, count = get_subway_selection()
+    else:
+        subway_line = "1"
+        direction = "S"
+        station_id = "127"
+        station_name = "Times Sq-42 St"
+        count = 3
+    if subway_group_stats is None:
+        subway_group_stats = fetch_data_from_input(subway_line)
+    if current_time is None:
+        current_time = int(datetime.now().timestamp())
+    if needs_schedule_fallback(subway_group_stats, current_time):
+        unavailable = f"Real-time data for the {subway_line} train is unavailable right now."
+        next_train_times = get_scheduled_arrival_times(subway_line, station_id, direction, count, current_time)
+        if next_train_times is None:
+            return unavailable
+        return f"{unavailable} Scheduled times:<br>" + format_arrivals(subway_line, direction, station_name, count, next_train_times, current_time)
+
+    next_train_times = find_next_arrival_times(subway_group_stats, subway_line, direction, station_id, count, current_time)
+    output = format_arrivals(subway_line, direction, station_name, count, next_train_times, current_time)
+    return output
+
 if __name__ == "__main__":
     catch_a_ride(True)
\ No newline at end of file
@@ -0,0 +1,6 @@
+from src.static_index import compile_static_index, StaticIndex, STATIC_INDEX_PATH
+
+# Run from the repository root as: python -m setup.create_static_index
+compile_static_index('data/stops.csv', 'data/routes.csv', STATIC_INDEX_PATH)
+static_index = StaticIndex(STATIC_INDEX_PATH)
+print(f"Wrote {STATIC_INDEX_PATH} with {len(static_index.stop_ids)} stops and {len(static_index.route_ids)} routes")
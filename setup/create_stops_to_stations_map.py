@@ -1,9 +1,11 @@
 import src.mta_subway_fetcher as mta_subway_fetcher
+import src.mta_stops_to_stations as mta_stops_to_stations
 import json
 
 def get_stops_for_lines() -> dict:
     """
     Make API calls for real-time subway data to collect a list of stations per subway line, and return all available stations for the subway line(s).
+    Every feed group is fetched once and decoded in parallel (see 'mta_stops_to_stations.get_stops_for_lines').
     
     Args:
         None (uses all possible subway lines, not giving a selection for this setup purpose)
@@ -11,23 +13,7 @@ def get_stops_for_lines() -> dict:
     Returns:
         lines_with_stops: A dict of lists of strings, with keys as the names of subway lines and values as a list of machine-readable station IDs
     """
-    lines_with_stops = {}
-    subway_lines = mta_subway_fetcher.SUBWAY_LINE_LIST
-    for line in subway_lines:
-        lines_with_stops[line] = []
-        if line in mta_subway_fetcher.SHUTTLE_INTERNAL_MAPPING.keys():
-            route_id = mta_subway_fetcher.SHUTTLE_INTERNAL_MAPPING[line]
-        else: 
-            route_id = line
-        line_data = mta_subway_fetcher.get_realtime_data(line)['entity']
-        for e in line_data:
-            if e.get('vehicle') and e['vehicle']['trip']['routeId'] == route_id and e['vehicle'].get('stopId') and e['vehicle']['stopId'] not in lines_with_stops[line]:
-                lines_with_stops[line].append(e['vehicle']['stopId'])
-            elif e.get('tripUpdate') and e['tripUpdate']['trip']['routeId'] == route_id and e['tripUpdate'].get('stopTimeUpdate'):
-                for stop in e['tripUpdate']['stopTimeUpdate']:
-                    if stop['stopId'] not in lines_with_stops[line]:
-                        lines_with_stops[line].append(stop['stopId'])
-    return lines_with_stops
+    return mta_stops_to_stations.get_stops_for_lines(mta_subway_fetcher.SUBWAY_LINE_LIST)
 
 def remove_directionality_and_dedupe(lines_with_stops_both_directions) -> dict:
     """
@@ -52,7 +38,9 @@ def remove_directionality_and_dedupe(lines_with_stops_both_directions) -> dict:
     return new_lines_with_stops
 
 
-lines_with_stops = get_stops_for_lines()
-deduped_lines_with_stops = remove_directionality_and_dedupe(lines_with_stops)
-with open(f"data/stations_per_line.json", "w") as f:
-    json.dump(deduped_lines_with_stops, f, indent=2)
\ No newline at end of file
+# Feeds are decoded in worker processes, which import this module again, so the setup only runs in the main process
+if __name__ == "__main__":
+    lines_with_stops = get_stops_for_lines()
+    deduped_lines_with_stops = remove_directionality_and_dedupe(lines_with_stops)
+    with open(f"data/stations_per_line.json", "w") as f:
+        json.dump(deduped_lines_with_stops, f, indent=2)
\ No newline at end of file
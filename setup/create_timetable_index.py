@@ -0,0 +1,9 @@
+from src.static_timetable import compile_timetable, StaticTimetable, TIMETABLE_PATH
+
+import sys
+
+# Download https://rrgtfsfeeds.s3.amazonaws.com/gtfs_subway.zip, then run from the repository root as: python -m setup.create_timetable_index [path to the zip]
+zip_path = sys.argv[1] if len(sys.argv) > 1 else 'gtfs_subway.zip'
+compile_timetable(zip_path, TIMETABLE_PATH)
+timetable = StaticTimetable(TIMETABLE_PATH)
+print(f"Wrote {TIMETABLE_PATH} with {len(timetable)} scheduled stops at {len(timetable.keys)} route stops")
@@ -0,0 +1,191 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+from src.feed_records import AlertRecord, FeedSnapshot
+from src.snapshot_diff import ChangeSet, alerts_equal
+
+import re
+import threading
+import time
+
+# ALERT_SHORT_TEXT_LENGTH -- The maximum length of the short alert text used in conversational and voice output
+ALERT_SHORT_TEXT_LENGTH = 160
+
+# _ROUTE_BULLET -- Route names written as bullets in alert text (e.g., '[A]'), read out as the bare route name
+_ROUTE_BULLET = re.compile(r'\[([0-9A-Z]{1,2})\]')
+
+# _alerts -- The alerts of the latest snapshot per feed group, keyed by alert ID
+_alerts = {}
+# _alerts_by_route -- Alerts applying to a whole route, per route ID, keyed by (feed_group, alert_id)
+_alerts_by_route = {}
+# _alerts_by_station -- Alerts naming a stop, per station ID without direction suffix, keyed by (feed_group, alert_id)
+_alerts_by_station = {}
+# _short_texts -- The pre-rendered short text of every stored alert, keyed by (feed_group, alert_id)
+_short_texts = {}
+# _version -- Incremented whenever an alert is added, changed or removed, so responses including alerts can be cached per version
+_version = 0
+# _source_snapshots -- The snapshot per feed group whose alerts were last applied, in a worker serving snapshots from another process
+_source_snapshots = {}
+_alerts_lock = threading.Lock()
+
+
+def station_id_of(stop_id: str) -> str:
+    """
+    Remove the direction suffix of a stop ID (e.g., '127' for '127S'), so alerts on either platform apply to the station.
+    """
+    if len(stop_id) > 1 and stop_id[-1] in ["N", "S"]:
+        return stop_id[:-1]
+    return stop_id
+
+def format_short_text(alert: AlertRecord, max_length: int=ALERT_SHORT_TEXT_LENGTH) -> str:
+    """
+    Render the text of an alert for voice output: the header (or else the description), with route bullets and extra whitespace removed, cut at a word boundary.
+
+    Args:
+        alert: An AlertRecord
+        max_length: The maximum length of the text
+
+    Returns:
+        The short text, ending in '...' if it was cut
+    """
+    text = alert.header_text or alert.description_text
+    text = ' '.join(_ROUTE_BULLET.sub(r'\1', text).split())
+    if len(text) > max_length:
+        text = text[:max_length - 3].rsplit(' ', 1)[0].rstrip(',;:.') + '...'
+    return text
+
+def is_active(alert: AlertRecord, current_time: int) -> bool:
+    """
+    Check whether an alert applies at a time, from its active periods. An alert without active periods is always active.
+    """
+    if not alert.active_periods:
+        return True
+    return any((not start or start <= current_time) and (not end or current_time < end) for start, end in alert.active_periods)
+
+def _index_alert(key: tuple[str, str], alert: AlertRecord) -> None:
+    for route_id, stop_id in alert.informed_entities:
+        if stop_id:
+            _alerts_by_station.setdefault(station_id_of(stop_id), {})[key] = alert
+        elif route_id:
+            _alerts_by_route.setdefault(route_id, {})[key] = alert
+    _short_texts[key] = format_short_text(alert)
+
+def _unindex_alert(key: tuple[str, str], alert: AlertRecord) -> None:
+    for route_id, stop_id in alert.informed_entities:
+        index, index_key = (_alerts_by_station, station_id_of(stop_id)) if stop_id else (_alerts_by_route, route_id)
+        alerts = index.get(index_key)
+        if alerts is not None:
+            alerts.pop(key, None)
+            if not alerts:
+                del index[index_key]
+    _short_texts.pop(key, None)
+
+def update_alerts(feed_group: str, snapshot: FeedSnapshot, changes: ChangeSet=None) -> None:
+    """
+    Apply the alerts of a newly published snapshot to the store: new alerts are indexed, changed ones re-indexed and ended ones removed.
+    Alerts that did not change are left in place. Registered as a snapshot listener.
+
+    Args:
+        feed_group: The feed group of the snapshot
+        snapshot: The newly published FeedSnapshot
+        changes: The changes since the previous snapshot of the group. When its alerts did not change, the store is left as it is without comparing them.
+            Without it, every alert is compared to the stored one.
+    """
+    global _version
+    if changes is not None and not changes.alerts_changed and feed_group in _alerts:
+        return
+    with _alerts_lock:
+        previous = _alerts.get(feed_group, {})
+        changed = False
+        for alert_id, alert in previous.items():
+            current = snapshot.alerts.get(alert_id)
+            if current is None or not alerts_equal(alert, current):
+                _unindex_alert((feed_group, alert_id), alert)
+                changed = True
+        current_alerts = {}
+        for alert_id, alert in snapshot.alerts.items():
+            old = previous.get(alert_id)
+            if old is not None and alerts_equal(old, alert):
+                current_alerts[alert_id] = old
+            else:
+                _index_alert((feed_group, alert_id), alert)
+                current_alerts[alert_id] = alert
+                changed = True
+        _alerts[feed_group] = current_alerts
+        if changed:
+            _version += 1
+
+def _sync_with_source() -> None:
+    """
+    In a worker serving snapshots published by another process (see 'mta_subway_fetcher.set_snapshot_source'), no snapshot listener runs,
+    so apply the alerts of each feed group's snapshot when a new one has been published. Only the alerts of the snapshot are loaded.
+    """
+    source = mta_subway_fetcher.get_snapshot_source()
+    if source is None:
+        return
+    for feed_group in mta_subway_fetcher.FEED_GROUPS:
+        snapshot = source(feed_group)
+        if snapshot is not None and _source_snapshots.get(feed_group) is not snapshot:
+            update_alerts(feed_group, snapshot)
+            _source_snapshots[feed_group] = snapshot
+
+def get_version() -> int:
+    """
+    Return the version of the stored alerts, which changes whenever an alert is added, changed or removed in any feed group.
+    """
+    _sync_with_source()
+    return _version
+
+def _matching_alerts(route_id: str, stop_id: str, current_time: int) -> dict[tuple[str, str], AlertRecord]:
+    """
+    Find the active alerts for a route and/or station, keyed by (feed_group, alert_id). Must be called holding _alerts_lock.
+    An alert published in several feed groups (e.g., one naming lines of two feeds) is included once.
+    """
+    matches = {}
+    if route_id:
+        matches.update(_alerts_by_route.get(route_id, {}))
+    if stop_id:
+        station_id = station_id_of(stop_id)
+        for key, alert in _alerts_by_station.get(station_id, {}).items():
+            if any(station_id_of(entity_stop) == station_id and entity_route in ('', route_id or entity_route) for entity_route, entity_stop in alert.informed_entities):
+                matches[key] = alert
+    unique = {}
+    for key, alert in matches.items():
+        if alert.alert_id not in unique and is_active(alert, current_time):
+            unique[alert.alert_id] = key
+    return {key: matches[key] for key in unique.values()}
+
+def get_alerts(route_id: str=None, stop_id: str=None, current_time: int=None) -> list[AlertRecord]:
+    """
+    Find the active alerts for a route, a station, or a route at a station.
+
+    Args:
+        route_id: The route ID (e.g., '1'). Alerts for the whole route are included.
+        stop_id: The station ID, with or without direction suffix. Alerts naming the station for any route, or for route_id, are included.
+        current_time: An integer representing the current epoch time. Defaults to now.
+
+    Returns:
+        alerts: The matching AlertRecord values that are active at current_time
+    """
+    if current_time is None:
+        current_time = int(time.time())
+    _sync_with_source()
+    with _alerts_lock:
+        return list(_matching_alerts(route_id, stop_id, current_time).values())
+
+def get_alert_summaries(route_id: str=None, stop_id: str=None, current_time: int=None) -> list[dict]:
+    """
+    Summarize the active alerts for a route and/or station for an API response, with their pre-rendered short text.
+
+    Args:
+        route_id, stop_id, current_time: As for 'get_alerts'
+
+    Returns:
+        summaries: A list of dicts with the alert 'id', 'effect', 'header' and short 'text'
+    """
+    if current_time is None:
+        current_time = int(time.time())
+    _sync_with_source()
+    with _alerts_lock:
+        return [{'id': alert.alert_id, 'effect': alert.effect, 'header': alert.header_text, 'text': _short_texts[key]}
+                for key, alert in _matching_alerts(route_id, stop_id, current_time).items()]
+
+mta_subway_fetcher.add_snapshot_listener(update_alerts)
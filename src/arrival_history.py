@@ -0,0 +1,447 @@
+from src.feed_records import FeedSnapshot
+from src.static_timetable import TIMETABLE_TIMEZONE
+
+import argparse
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+# HISTORY_PATH -- The default directory of the arrival history, with one subdirectory per service day (e.g., 'history/20240501')
+HISTORY_PATH = 'history'
+
+# SERVICE_DAY_START_HOUR -- The local hour a service day starts at, for trips without a start date. Trips running past midnight belong to the day before until then.
+SERVICE_DAY_START_HOUR = 4
+
+# OPEN_SEGMENTS -- The number of most recent day segments kept open, since trips of the previous service day run past midnight
+OPEN_SEGMENTS = 2
+
+# PREDICTION_RETENTION_SECONDS -- How long after its predicted arrival a prediction is kept to resolve its stop; predictions of trips that vanished from the feed are dropped after this
+PREDICTION_RETENTION_SECONDS = 3 * 3600
+
+# OBSERVATION_COLUMNS -- The append-only columns of predictions, one row each time the predicted arrival of a trip at a stop changes
+OBSERVATION_COLUMNS = (
+    ('trip', 'i'),       # The trip ID, as a code in the day's string table
+    ('stop', 'i'),       # The directional stop ID, as a code
+    ('route', 'i'),      # The route ID, as a code
+    ('predicted', 'q'),  # The predicted arrival epoch time
+    ('observed', 'q'),   # The feed header timestamp the prediction was made at
+)
+
+# ACTUAL_COLUMNS -- The append-only columns of resolved arrivals, one row when a stop drops out of its trip's updates, holding its last prediction
+ACTUAL_COLUMNS = (
+    ('trip', 'i'),
+    ('stop', 'i'),
+    ('route', 'i'),
+    ('actual', 'q'),     # The arrival epoch time, taken as the last prediction before the train passed the stop
+)
+
+# ERROR_COLUMNS -- The compacted prediction errors of a day, sorted by stop, route and the hour of the actual arrival
+ERROR_COLUMNS = (
+    ('stop', 'i'),
+    ('route', 'i'),
+    ('hour', 'i'),       # The local hour of day of the actual arrival, 0-23
+    ('lead', 'i'),       # Seconds from the prediction to the actual arrival
+    ('error', 'i'),      # Seconds the train arrived after the prediction (negative when early)
+)
+
+# HEADWAY_COLUMNS -- The compacted actual arrivals of a day, sorted by stop, route and time
+HEADWAY_COLUMNS = (
+    ('stop', 'i'),
+    ('route', 'i'),
+    ('actual', 'q'),
+)
+
+# STRINGS_FILE -- The file name of a day's string table: one trip, stop or route ID per line, its line number being its code
+STRINGS_FILE = 'strings.txt'
+
+# COLUMN_SUFFIX -- The file name suffix of a column, after the table and column names (e.g., 'observations.predicted.col')
+COLUMN_SUFFIX = '.col'
+
+
+def day_of(epoch_time: int) -> str:
+    """
+    Return the service day an epoch time belongs to, as 'YYYYMMDD', for trips without a start date: the local date, or the day before until SERVICE_DAY_START_HOUR.
+    """
+    return (datetime.fromtimestamp(epoch_time, TIMETABLE_TIMEZONE) - timedelta(hours=SERVICE_DAY_START_HOUR)).strftime('%Y%m%d')
+
+def hour_of(epoch_time: int) -> int:
+    """
+    Return the local hour of day (0-23) of an epoch time, in the timezone of the service.
+    """
+    return datetime.fromtimestamp(epoch_time, TIMETABLE_TIMEZONE).hour
+
+def _column_path(day_directory: str, table: str, column: str) -> str:
+    return os.path.join(day_directory, f"{table}.{column}{COLUMN_SUFFIX}")
+
+def _load_strings(day_directory: str) -> list[str]:
+    path = os.path.join(day_directory, STRINGS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return f.read().splitlines()
+
+
+class _DaySegment:
+    """
+    The open files of one day of history, appended to by ArrivalHistoryRecorder.
+    """
+
+    def __init__(self, day_directory: str):
+        os.makedirs(day_directory, exist_ok=True)
+        self.strings = _load_strings(day_directory)
+        self.codes = {s: i for i, s in enumerate(self.strings)}
+        self._strings_file = open(os.path.join(day_directory, STRINGS_FILE), 'a')
+        self._files = {}
+        for table, columns in (('observations', OBSERVATION_COLUMNS), ('actuals', ACTUAL_COLUMNS)):
+            row_count = _row_count(day_directory, table, columns)
+            for column, typecode in columns:
+                f = open(_column_path(day_directory, table, column), 'ab')
+                # Drop a partly written row left by a crash, so every column has the same number of rows
+                f.truncate(row_count * array(typecode).itemsize)
+                self._files[(table, column)] = f
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self.codes[value] = code
+            self._strings_file.write(value + '\n')
+        return code
+
+    def append(self, table: str, columns: tuple, rows: dict[str, array]) -> None:
+        for column, _ in columns:
+            self._files[(table, column)].write(rows[column].tobytes())
+
+    def flush(self) -> None:
+        # The string table is flushed first, so no row refers to a code missing from it
+        self._strings_file.flush()
+        for f in self._files.values():
+            f.flush()
+
+    def close(self) -> None:
+        self._strings_file.close()
+        for f in self._files.values():
+            f.close()
+
+
+class ArrivalHistoryRecorder:
+    """
+    Record every change of predicted arrival, and the resolved arrival of every stop a train passes, to append-only columns per service day.
+    Every row of a trip goes to the segment of its start date, so a trip running past midnight is resolved within one segment.
+    Register 'record' as a snapshot listener. Only predictions that differ from the last recorded one are written, so unchanged trips cost nothing.
+
+    Args:
+        directory: The directory to write day segments to
+    """
+
+    def __init__(self, directory: str=HISTORY_PATH):
+        self.directory = directory
+        self._segments = {}  # day -> _DaySegment
+        self._last_predictions = {}  # (trip_id, stop_id) -> last recorded predicted arrival
+        self._pruned_at = 0
+        self._lock = threading.Lock()
+
+    def _segment(self, day: str) -> _DaySegment:
+        segment = self._segments.get(day)
+        if segment is None:
+            segment = _DaySegment(os.path.join(self.directory, day))
+            self._segments[day] = segment
+            # Keep only the files of this day and the most recent others open
+            others = sorted(other for other in self._segments if other != day)
+            for old_day in others[:max(len(others) - (OPEN_SEGMENTS - 1), 0)]:
+                self._segments.pop(old_day).close()
+        return segment
+
+    def _prune(self, now: int) -> None:
+        """
+        Drop the predictions of stops due more than PREDICTION_RETENTION_SECONDS ago, left by trips that vanished from the feed without being removed.
+        Runs at most once per retention period, so its cost is spread over many snapshots.
+        """
+        if now - self._pruned_at < PREDICTION_RETENTION_SECONDS:
+            return
+        cutoff = now - PREDICTION_RETENTION_SECONDS
+        self._last_predictions = {key: arrival for key, arrival in self._last_predictions.items() if arrival >= cutoff}
+        self._pruned_at = now
+
+    def record(self, feed_group: str, snapshot: FeedSnapshot, changes) -> None:
+        """
+        Append the predictions of the added and changed trips of a snapshot, and resolve the stops that dropped out of changed or removed trips.
+
+        Args:
+            feed_group: The feed group of the snapshot
+            snapshot: The newly published FeedSnapshot
+            changes: The trips added, changed and removed since the previous snapshot of the group
+        """
+        rows = {}  # day -> (observations, actuals)
+        with self._lock:
+            for old, new in [(None, trip) for trip in changes.added.values()] + list(changes.changed.values()) + [(trip, None) for trip in changes.removed.values()]:
+                trip = new or old
+                day = trip.start_date or day_of(snapshot.timestamp)
+                segment = self._segment(day)
+                if day not in rows:
+                    rows[day] = ({column: array(typecode) for column, typecode in OBSERVATION_COLUMNS}, {column: array(typecode) for column, typecode in ACTUAL_COLUMNS})
+                observations, actuals = rows[day]
+                trip_code = segment.code(trip.trip_id)
+                route_code = segment.code(trip.route_id)
+                remaining = {stop.stop_id for stop in new.stop_times} if new is not None else set()
+                if old is not None:
+                    # Stops before the train's next stop were passed; a removed trip has passed only its next (last) stop
+                    passed = old.stop_times[:1] if new is None else [stop for stop in old.stop_times if stop.stop_id not in remaining]
+                    for stop in passed:
+                        last_prediction = self._last_predictions.pop((trip.trip_id, stop.stop_id), None)
+                        if last_prediction is None:
+                            continue
+                        actuals['trip'].append(trip_code)
+                        actuals['stop'].append(segment.code(stop.stop_id))
+                        actuals['route'].append(route_code)
+                        actuals['actual'].append(last_prediction)
+                    if new is None:
+                        for stop in old.stop_times[1:]:
+                            self._last_predictions.pop((trip.trip_id, stop.stop_id), None)
+                if new is None:
+                    continue
+                for stop in new.stop_times:
+                    key = (trip.trip_id, stop.stop_id)
+                    if self._last_predictions.get(key) == stop.arrival:
+                        continue
+                    self._last_predictions[key] = stop.arrival
+                    observations['trip'].append(trip_code)
+                    observations['stop'].append(segment.code(stop.stop_id))
+                    observations['route'].append(route_code)
+                    observations['predicted'].append(stop.arrival)
+                    observations['observed'].append(snapshot.timestamp)
+            for day, (observations, actuals) in rows.items():
+                # A day closed since its rows were collected (when trips of three days were in one snapshot) is reopened to append them
+                segment = self._segment(day)
+                segment.append('observations', OBSERVATION_COLUMNS, observations)
+                segment.append('actuals', ACTUAL_COLUMNS, actuals)
+                segment.flush()
+            self._prune(snapshot.timestamp)
+
+    def close(self) -> None:
+        """
+        Close the open day segments.
+        """
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments = {}
+
+
+def _row_count(day_directory: str, table: str, columns: tuple) -> int:
+    """
+    Count the complete rows of a table: the fewest rows of any of its columns.
+    """
+    counts = []
+    for column, typecode in columns:
+        path = _column_path(day_directory, table, column)
+        counts.append(os.path.getsize(path) // array(typecode).itemsize if os.path.exists(path) else 0)
+    return min(counts)
+
+def read_table(day_directory: str, table: str, columns: tuple) -> dict:
+    """
+    Memory-map the columns of a table, without reading them into memory.
+
+    Args:
+        day_directory: The directory of one day of history
+        table: The table name ('observations', 'actuals', 'errors' or 'headways')
+        columns: The column spec of the table (e.g., OBSERVATION_COLUMNS)
+
+    Returns:
+        columns: A dict with keys as column names and values as read-only sequences of the column values, all of the same length
+    """
+    rows = _row_count(day_directory, table, columns)
+    table_columns = {}
+    for column, typecode in columns:
+        size = rows * array(typecode).itemsize
+        if size == 0:
+            table_columns[column] = array(typecode)
+            continue
+        with open(_column_path(day_directory, table, column), 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table_columns[column] = memoryview(mapping)[:size].cast(typecode)
+    return table_columns
+
+def _write_table(day_directory: str, table: str, columns: tuple, values: dict[str, array]) -> None:
+    """
+    Write every column of a table, replacing each file atomically.
+    """
+    for column, _ in columns:
+        path = _column_path(day_directory, table, column)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(values[column].tobytes())
+        os.replace(path + '.tmp', path)
+
+def compact_day(day_directory: str) -> int:
+    """
+    Resolve the prediction error of every recorded prediction whose stop was later passed, and sort the errors and actual arrivals for queries.
+    The raw observation and actual columns are kept, so a day can be compacted again as it grows.
+
+    Args:
+        day_directory: The directory of one day of history
+
+    Returns:
+        The number of predictions with a resolved error
+    """
+    observations = read_table(day_directory, 'observations', OBSERVATION_COLUMNS)
+    actuals = read_table(day_directory, 'actuals', ACTUAL_COLUMNS)
+
+    actual_times = {}
+    for trip, stop, actual in zip(actuals['trip'], actuals['stop'], actuals['actual']):
+        actual_times[(trip, stop)] = actual
+
+    errors = []
+    # Hours are looked up once per UTC hour, since the service timezone's offsets are whole hours
+    hours = {}
+    for trip, stop, route, predicted, observed in zip(observations['trip'], observations['stop'], observations['route'], observations['predicted'], observations['observed']):
+        actual = actual_times.get((trip, stop))
+        if actual is None or observed > actual:
+            continue
+        hour = hours.get(actual // 3600)
+        if hour is None:
+            hour = hours[actual // 3600] = hour_of(actual)
+        errors.append((stop, route, hour, actual - observed, actual - predicted))
+    errors.sort()
+    _write_table(day_directory, 'errors', ERROR_COLUMNS, {column: array(typecode, (row[i] for row in errors)) for i, (column, typecode) in enumerate(ERROR_COLUMNS)})
+
+    headways = sorted(zip(actuals['stop'], actuals['route'], actuals['actual']))
+    _write_table(day_directory, 'headways', HEADWAY_COLUMNS, {column: array(typecode, (row[i] for row in headways)) for i, (column, typecode) in enumerate(HEADWAY_COLUMNS)})
+    return len(errors)
+
+
+class _RowKeys:
+    """
+    A sequence view of the leading sort columns of a compacted table, so row ranges can be found with bisect.
+    """
+
+    def __init__(self, table: dict, names: tuple):
+        self._columns = [table[name] for name in names]
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def __getitem__(self, i: int) -> tuple:
+        return tuple(column[i] for column in self._columns)
+
+def _row_range(table: dict, names: tuple, prefix: tuple) -> tuple[int, int]:
+    """
+    Find the rows of a compacted table whose leading sort columns equal a prefix.
+    """
+    keys = _RowKeys(table, names[:len(prefix)])
+    start = bisect_left(keys, prefix)
+    end = bisect_left(keys, prefix[:-1] + (prefix[-1] + 1,))
+    return start, end
+
+def percentiles(values: list[float], fractions: tuple=(0.5, 0.9, 0.99)) -> dict[str, float]:
+    """
+    Return the nearest-rank percentiles of a list of values, keyed like 'p50', or an empty dict for no values.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {}
+    for fraction in fractions:
+        rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+        result[f"p{round(fraction * 100):g}"] = values[min(rank, len(values) - 1)]
+    return result
+
+def _days(directory: str, days: list[str]) -> list[str]:
+    if days is None:
+        days = sorted(name for name in os.listdir(directory) if name.isdigit()) if os.path.isdir(directory) else []
+    return [os.path.join(directory, day) for day in days]
+
+def _compacted_table(day_directory: str, table: str, columns: tuple) -> dict:
+    """
+    Read a compacted table, compacting the day first if it has not been or has grown since.
+    """
+    raw_path = _column_path(day_directory, 'actuals', 'actual')
+    compacted_path = _column_path(day_directory, table, columns[-1][0])
+    if not os.path.exists(compacted_path) or (os.path.exists(raw_path) and os.path.getmtime(raw_path) > os.path.getmtime(compacted_path)):
+        compact_day(day_directory)
+    return read_table(day_directory, table, columns)
+
+def prediction_errors(stop_id: str, route_id: str=None, hour: int=None, min_lead: int=0, max_lead: int=None, days: list[str]=None, directory: str=HISTORY_PATH) -> dict:
+    """
+    Summarize how far actual arrivals at a stop fell from their predictions, e.g. how reliable a prediction made 10 minutes ahead is at 127S around 7 am.
+
+    Args:
+        stop_id: The directional stop ID (e.g., '127S')
+        route_id: Only include this route. Defaults to every route at the stop.
+        hour: Only include arrivals in this hour of day (0-23). Defaults to every hour.
+        min_lead, max_lead: Only include predictions made this many seconds or more (and at most max_lead) before the arrival
+        days: The day segments to include, as 'YYYYMMDD'. Defaults to every recorded day.
+        directory: The history directory
+
+    Returns:
+        summary: A dict with the number of predictions as 'count' and the percentiles of the error in seconds (positive when late), e.g. 'p50' and 'p90'
+    """
+    errors = []
+    for day_directory in _days(directory, days):
+        codes = {s: i for i, s in enumerate(_load_strings(day_directory))}
+        if stop_id not in codes or (route_id is not None and route_id not in codes):
+            continue
+        table = _compacted_table(day_directory, 'errors', ERROR_COLUMNS)
+        prefix = (codes[stop_id],) + ((codes[route_id],) if route_id is not None else ())
+        if route_id is not None and hour is not None:
+            prefix += (hour,)
+        start, end = _row_range(table, ('stop', 'route', 'hour'), prefix)
+        for i in range(start, end):
+            lead = table['lead'][i]
+            if lead < min_lead or (max_lead is not None and lead > max_lead) or (hour is not None and table['hour'][i] != hour):
+                continue
+            errors.append(table['error'][i])
+    return {'count': len(errors), **percentiles(errors)}
+
+def headways(stop_id: str, route_id: str, hour: int=None, days: list[str]=None, directory: str=HISTORY_PATH) -> dict:
+    """
+    Summarize the time between consecutive actual arrivals of a route at a stop.
+
+    Args:
+        stop_id: The directional stop ID (e.g., '127S')
+        route_id: The route ID (e.g., '1')
+        hour: Only include headways ending in this hour of day (0-23). Defaults to every hour.
+        days: The day segments to include, as 'YYYYMMDD'. Defaults to every recorded day.
+        directory: The history directory
+
+    Returns:
+        summary: A dict with the number of headways as 'count' and their percentiles in seconds, e.g. 'p50' and 'p90'
+    """
+    gaps = []
+    for day_directory in _days(directory, days):
+        codes = {s: i for i, s in enumerate(_load_strings(day_directory))}
+        if stop_id not in codes or route_id not in codes:
+            continue
+        table = _compacted_table(day_directory, 'headways', HEADWAY_COLUMNS)
+        start, end = _row_range(table, ('stop', 'route'), (codes[stop_id], codes[route_id]))
+        times = table['actual'][start:end]
+        for previous, current in zip(times, times[1:]):
+            if hour is None or hour_of(current) == hour:
+                gaps.append(current - previous)
+    return {'count': len(gaps), **percentiles(gaps)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the arrival history and report prediction error and headway percentiles for a stop.")
+    parser.add_argument('--directory', default=HISTORY_PATH, help="The history directory written by ArrivalHistoryRecorder")
+    parser.add_argument('--stop', required=True, help="The directional stop ID, e.g. 127S")
+    parser.add_argument('--route', help="The route ID, e.g. 1. Required for headways.")
+    parser.add_argument('--hour', type=int, help="Only include arrivals in this hour of day")
+    parser.add_argument('--days', type=int, default=7, help="The number of most recent days to include")
+    args = parser.parse_args()
+
+    today = datetime.strptime(day_of(int(datetime.now().timestamp())), '%Y%m%d')
+    days = [(today - timedelta(days=i)).strftime('%Y%m%d') for i in range(args.days)]
+    days = [day for day in days if os.path.isdir(os.path.join(args.directory, day))]
+    print(f"Prediction error (seconds late) at {args.stop}: {prediction_errors(args.stop, args.route, args.hour, days=days, directory=args.directory)}")
+    for minutes in (2, 5, 10, 20):
+        summary = prediction_errors(args.stop, args.route, args.hour, (minutes - 1) * 60, (minutes + 1) * 60, days, args.directory)
+        print(f"  predicted about {minutes} minutes ahead: {summary}")
+    if args.route:
+        print(f"Headways (seconds) of the {args.route} at {args.stop}: {headways(args.stop, args.route, args.hour, days, args.directory)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+from src.feed_records import FeedSnapshot
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+
+def build_arrival_index(snapshot: FeedSnapshot) -> dict[tuple[str, str], array]:
+    """
+    Group every predicted arrival in a snapshot by route and directional stop, sorted by time.
+
+    Args:
+        snapshot: A FeedSnapshot of real-time data for one feed group
+
+    Returns:
+        arrival_index: A dict with keys of (route_id, stop_id) (e.g., ('1', '127S')) and values of sorted arrays of arrival epoch times
+    """
+    arrivals_per_stop = {}
+    for trip in snapshot.trips.values():
+        for stop in trip.stop_times:
+            key = (stop.route_id, stop.stop_id)
+            if key in arrivals_per_stop:
+                arrivals_per_stop[key].append(stop.arrival)
+            else:
+                arrivals_per_stop[key] = [stop.arrival]
+    arrival_index = {key: array('q', sorted(times)) for key, times in arrivals_per_stop.items()}
+    return arrival_index
+
+def update_arrival_index(previous_index: dict[tuple[str, str], array], changes) -> dict[tuple[str, str], array]:
+    """
+    Derive the arrival index of a new snapshot from the previous snapshot's index and the trips that changed between them.
+    Only the stops of added, changed and removed trips are touched. The previous index is left unmodified, since it may still be read by queries on the previous snapshot.
+
+    Args:
+        previous_index: The arrival index of the previous snapshot of the feed group
+        changes: The ChangeSet from 'snapshot_diff.diff_snapshots' between the previous and the new snapshot
+
+    Returns:
+        arrival_index: The arrival index of the new snapshot
+    """
+    arrival_index = dict(previous_index)
+    copied = set()
+
+    def arrivals_for(key):
+        # Copy each array on its first change so the previous index keeps its own
+        if key not in copied:
+            arrival_index[key] = array('q', arrival_index.get(key, ()))
+            copied.add(key)
+        return arrival_index[key]
+
+    old_trips = list(changes.removed.values()) + [old for old, _ in changes.changed.values()]
+    new_trips = list(changes.added.values()) + [new for _, new in changes.changed.values()]
+    for trip in old_trips:
+        for stop in trip.stop_times:
+            arrivals = arrivals_for((stop.route_id, stop.stop_id))
+            i = bisect_left(arrivals, stop.arrival)
+            if i < len(arrivals) and arrivals[i] == stop.arrival:
+                del arrivals[i]
+    for trip in new_trips:
+        for stop in trip.stop_times:
+            insort(arrivals_for((stop.route_id, stop.stop_id)), stop.arrival)
+    for key in copied:
+        if not arrival_index[key]:
+            del arrival_index[key]
+    return arrival_index
+
+def get_arrival_index(snapshot: FeedSnapshot) -> dict[tuple[str, str], array]:
+    """
+    Return the arrival index of a snapshot, building it on first use. Snapshots are immutable, so the index is built once and shared by every query against it.
+
+    Args:
+        snapshot: A FeedSnapshot of real-time data for one feed group
+
+    Returns:
+        arrival_index: The output of 'build_arrival_index' for the snapshot
+    """
+    if snapshot.arrival_index is None:
+        snapshot.arrival_index = build_arrival_index(snapshot)
+    return snapshot.arrival_index
+
+def next_arrivals(arrival_index: dict[tuple[str, str], array], route_id: str, stop_id: str, current_time: int, count: int) -> list[int]:
+    """
+    Find the next arrivals at a stop after a given time.
+
+    Args:
+        arrival_index: The output of 'build_arrival_index'
+        route_id: The route ID of the line (e.g., '1', or 'GS' for the 42 St Shuttle)
+        stop_id: The directional station ID (e.g., '127S')
+        current_time: An integer representing the current epoch time; only later arrivals are returned
+        count: The maximum number of arrival times to return
+
+    Returns:
+        A list of up to 'count' arrival epoch times, earliest first
+    """
+    arrivals = arrival_index.get((route_id, stop_id))
+    if not arrivals:
+        return []
+    start = bisect_right(arrivals, current_time)
+    return arrivals[start:start + count].tolist()
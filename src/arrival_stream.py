@@ -0,0 +1,194 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.arrival_index as arrival_index
+import src.static_index as static_index
+import src.metrics as metrics
+from src.feed_records import FeedSnapshot
+
+import json
+import queue
+import threading
+import time
+
+# STREAM_KEEPALIVE_SECONDS -- How often an idle stream sends a comment line, so proxies and clients keep the connection open
+STREAM_KEEPALIVE_SECONDS = 15
+
+# STREAM_QUEUE_SIZE -- The number of undelivered events a subscriber may fall behind by before it is disconnected
+STREAM_QUEUE_SIZE = 64
+
+# STREAM_RETRY_MILLISECONDS -- How long an EventSource client waits before reconnecting after the stream drops
+STREAM_RETRY_MILLISECONDS = 5000
+
+# _subscriptions -- Every open subscription per stream key (subway_line, station_id, direction, count)
+_subscriptions = {}
+# _last_arrivals -- The last arrival times and staleness sent per stream key, so unchanged arrivals are not sent again
+_last_arrivals = {}
+_subscriptions_lock = threading.Lock()
+
+# STREAM_EVENTS -- Arrival events queued to subscribers, and subscribers dropped for falling behind
+STREAM_EVENTS = metrics.register(metrics.Counter('catch_a_ride_stream_events_total', 'Arrival stream events by result.', ('result',)))
+
+
+class Subscription:
+    """
+    One client's subscription to the arrivals of one or more stations, receiving an event whenever any of them change.
+
+    Args:
+        keys: A list of (subway_line, station_id, direction, count) stream keys, already validated
+    """
+
+    def __init__(self, keys: list[tuple[str, str, str, int]]):
+        self.keys = list(dict.fromkeys(keys))
+        self.events = queue.Queue(STREAM_QUEUE_SIZE)
+        self.closed = False
+
+    def send(self, event: str) -> None:
+        """
+        Queue an event for the client. A client too slow to keep up is closed instead of buffering without bound.
+        """
+        if self.closed:
+            return
+        try:
+            self.events.put_nowait(event)
+            STREAM_EVENTS.inc(result='sent')
+        except queue.Full:
+            self.closed = True
+            STREAM_EVENTS.inc(result='dropped')
+
+
+def _stream_key_arrivals(key: tuple[str, str, str, int], snapshot: FeedSnapshot, current_time: int) -> list[int]:
+    """
+    Find the next arrival times for a stream key in a snapshot.
+    """
+    subway_line, station_id, direction, count = key
+    stop_id = station_id if station_id[-1] in ["N", "S"] else station_id + direction
+    route_id = mta_subway_fetcher.get_route_id(subway_line)
+    return arrival_index.next_arrivals(arrival_index.get_arrival_index(snapshot), route_id, stop_id, current_time, count)
+
+def format_event(key: tuple[str, str, str, int], arrivals: list[int], snapshot: FeedSnapshot, current_time: int) -> str:
+    """
+    Format the arrivals of a stream key as a Server-Sent Event, with the same fields as the /arrivals endpoint.
+
+    Args:
+        key: The (subway_line, station_id, direction, count) stream key
+        arrivals: The next arrival epoch times at the station, or None if no real-time data is available
+        snapshot: The FeedSnapshot the arrivals were found in, or None
+        current_time: An integer representing the current epoch time
+
+    Returns:
+        event: The 'arrivals' event, with the header timestamp of the snapshot as its ID
+    """
+    subway_line, station_id, direction, count = key
+    data = {
+        'line': subway_line,
+        'station_id': station_id,
+        'station_name': static_index.get_static_index().stop_name(station_id),
+        'direction': direction,
+        'count': count,
+        'arrivals': arrivals,
+        'minutes': [int((i-current_time) / 60.0) for i in arrivals] if arrivals is not None else None,
+        'timestamp': snapshot.timestamp if snapshot is not None else None,
+        'stale': snapshot.stale if snapshot is not None else False,
+    }
+    event_id = snapshot.timestamp if snapshot is not None else 0
+    return f"id: {event_id}\nevent: arrivals\ndata: {json.dumps(data)}\n\n"
+
+def subscribe(keys: list[tuple[str, str, str, int]]) -> Subscription:
+    """
+    Open a subscription and queue the current arrivals of each of its stream keys as the first events.
+
+    Args:
+        keys: A list of (subway_line, station_id, direction, count) stream keys, already validated (see 'validate_arrivals_query' in local_wip.py)
+
+    Returns:
+        subscription: The open Subscription. Pass it to 'unsubscribe' when the client disconnects.
+    """
+    subscription = Subscription(keys)
+    current_time = int(time.time())
+    sent = {}
+    for key in subscription.keys:
+        snapshot = mta_subway_fetcher.get_realtime_data(key[0])
+        arrivals = _stream_key_arrivals(key, snapshot, current_time) if snapshot is not None else None
+        subscription.send(format_event(key, arrivals, snapshot, current_time))
+        sent[key] = (arrivals, snapshot.stale if snapshot is not None else False)
+    with _subscriptions_lock:
+        for key in subscription.keys:
+            if key not in _subscriptions:
+                _subscriptions[key] = set()
+                # The first subscriber of a key was just sent its arrivals, so only later changes are sent
+                _last_arrivals[key] = sent[key]
+            _subscriptions[key].add(subscription)
+    return subscription
+
+def unsubscribe(subscription: Subscription) -> None:
+    """
+    Close a subscription and stop tracking the stream keys no one else is subscribed to.
+    """
+    subscription.closed = True
+    with _subscriptions_lock:
+        for key in subscription.keys:
+            subscribers = _subscriptions.get(key)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del _subscriptions[key]
+                _last_arrivals.pop(key, None)
+
+def update_subscribers(feed_group: str, snapshot: FeedSnapshot, changes) -> None:
+    """
+    Send new arrivals to the subscribers of every stream key on a newly published snapshot's feed group.
+    Each key is looked up once however many clients subscribe to it, and only keys whose arrivals changed are sent. Registered as a snapshot listener.
+
+    Args:
+        feed_group: The feed group of the snapshot
+        snapshot: The newly published FeedSnapshot
+        changes: The trips added, changed and removed since the previous snapshot of the group
+    """
+    current_time = int(time.time())
+    with _subscriptions_lock:
+        group_subscriptions = {key: list(subscribers) for key, subscribers in _subscriptions.items() if mta_subway_fetcher.get_feed_group(key[0]) == feed_group}
+    for key, subscribers in group_subscriptions.items():
+        # Departed trains change the next arrivals even when no trip changed, so every key is looked up again
+        arrivals = _stream_key_arrivals(key, snapshot, current_time)
+        with _subscriptions_lock:
+            # A key unsubscribed since the lookup is not tracked again
+            if key not in _subscriptions or _last_arrivals.get(key) == (arrivals, snapshot.stale):
+                continue
+            _last_arrivals[key] = (arrivals, snapshot.stale)
+        event = format_event(key, arrivals, snapshot, current_time)
+        for subscription in subscribers:
+            subscription.send(event)
+
+def event_stream(subscription: Subscription, keepalive: float=STREAM_KEEPALIVE_SECONDS):
+    """
+    Yield the events of a subscription as a Server-Sent Events body, until the client disconnects or falls behind.
+
+    Args:
+        subscription: An open Subscription from 'subscribe'
+        keepalive: The number of idle seconds between keepalive comments
+
+    Yields:
+        Chunks of the text/event-stream response
+    """
+    try:
+        yield f"retry: {STREAM_RETRY_MILLISECONDS}\n\n"
+        while not subscription.closed:
+            try:
+                yield subscription.events.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+    finally:
+        unsubscribe(subscription)
+
+def _subscriber_counts() -> dict[tuple, int]:
+    """
+    Count the open subscriptions and the distinct stream keys they cover, for the STREAM_SUBSCRIBERS gauge.
+    """
+    with _subscriptions_lock:
+        subscriptions = set().union(*_subscriptions.values())
+        return {('subscriptions',): len(subscriptions), ('keys',): len(_subscriptions)}
+
+# STREAM_SUBSCRIBERS -- Open stream subscriptions and the stream keys they cover, computed when /metrics is rendered
+STREAM_SUBSCRIBERS = metrics.register(metrics.Gauge('catch_a_ride_stream_subscribers', 'Open arrival stream subscriptions and stream keys.', ('kind',), _subscriber_counts))
+
+mta_subway_fetcher.add_snapshot_listener(update_subscribers)
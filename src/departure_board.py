@@ -0,0 +1,151 @@
+import src.arrival_index as arrival_index
+from src.feed_records import FeedSnapshot
+
+from array import array
+from bisect import bisect_right
+
+# numpy is optional: without it the board is computed with one binary search per stop instead of in one vectorized pass over columns built once per snapshot
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# DEPARTURE_BOARD_COUNT -- The default number of upcoming arrivals kept per route and stop
+DEPARTURE_BOARD_COUNT = 3
+
+
+class DepartureBoard:
+    """
+    The next arrivals of every route at every stop of a snapshot, stored as three flat columns instead of one list per stop.
+
+    Attributes:
+        keys: A sorted list of (route_id, stop_id) tuples, one per route and directional stop with an upcoming arrival
+        offsets: The start of each key's arrivals in 'times', with one extra entry marking the end
+        times: The arrival epoch times of every key, earliest first within each key
+        timestamp: The feed header timestamp of the snapshot the board was computed from
+        current_time: The epoch time arrivals were counted from
+    """
+    __slots__ = ('keys', 'offsets', 'times', 'timestamp', 'current_time', '_positions')
+
+    def __init__(self, keys: list[tuple[str, str]], offsets: array, times: array, timestamp: int, current_time: int):
+        self.keys = keys
+        self.offsets = offsets
+        self.times = times
+        self.timestamp = timestamp
+        self.current_time = current_time
+        self._positions = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __repr__(self) -> str:
+        return f"DepartureBoard({self.timestamp}, {len(self.keys)} stops, {len(self.times)} arrivals)"
+
+    def get(self, route_id: str, stop_id: str) -> list[int]:
+        """
+        Return the upcoming arrival times of a route at a directional stop (e.g., '127S'), or an empty list.
+        """
+        if self._positions is None:
+            self._positions = {key: i for i, key in enumerate(self.keys)}
+        i = self._positions.get((route_id, stop_id))
+        if i is None:
+            return []
+        return list(self.times[self.offsets[i]:self.offsets[i + 1]])
+
+    def to_dict(self) -> dict:
+        """
+        Convert the board to plain dicts and lists for a JSON response.
+
+        Returns:
+            board: A dict with the 'timestamp', the 'current_time' and the 'arrivals' as {route_id: {stop_id: [epoch times]}}
+        """
+        arrivals = {}
+        for i, (route_id, stop_id) in enumerate(self.keys):
+            arrivals.setdefault(route_id, {})[stop_id] = [int(t) for t in self.times[self.offsets[i]:self.offsets[i + 1]]]
+        return {'timestamp': self.timestamp, 'current_time': self.current_time, 'arrivals': arrivals}
+
+
+class BoardColumns:
+    """
+    The arrival index of a snapshot as flat numpy columns, built once per snapshot so every board computed from it is a single searchsorted.
+
+    Attributes:
+        keys: The sorted (route_id, stop_id) keys of the arrival index, as a numpy object array so a board's keys are taken without a Python loop
+        starts: The start of each key's arrivals in 'times', with one extra entry marking the end
+        times: The arrival epoch times of every key, earliest first within each key
+        search_keys: Each arrival time relative to 'base', offset by its key's position shifted left 32 bits, so the whole column is sorted
+        base: The earliest arrival time of the snapshot
+    """
+    __slots__ = ('keys', 'starts', 'times', 'search_keys', 'base')
+
+    def __init__(self, index):
+        keys = sorted(index)
+        self.keys = np.empty(len(keys), dtype=object)
+        self.keys[:] = keys
+        lengths = np.fromiter((len(index[key]) for key in keys), dtype=np.int64, count=len(keys))
+        self.starts = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.starts[1:])
+        self.times = np.frombuffer(b''.join(index[key].tobytes() for key in keys), dtype=np.int64)
+        self.base = int(self.times.min()) if len(self.times) else 0
+        key_codes = np.repeat(np.arange(len(keys), dtype=np.int64), lengths)
+        self.search_keys = (key_codes << 32) + (self.times - self.base)
+
+def get_board_columns(snapshot: FeedSnapshot) -> BoardColumns:
+    """
+    Return the BoardColumns of a snapshot, building them on first use. Snapshots are immutable, so they are shared by every board computed from it.
+    """
+    if snapshot.board_columns is None:
+        snapshot.board_columns = BoardColumns(arrival_index.get_arrival_index(snapshot))
+    return snapshot.board_columns
+
+def _board_columns_numpy(columns: BoardColumns, current_time: int, count: int):
+    """
+    Find the next 'count' arrivals of every key in one vectorized pass over a snapshot's BoardColumns.
+    Returns the keys with an upcoming arrival, the offsets of their arrivals and the arrival times, as for DepartureBoard.
+    """
+    # One searchsorted finds the first arrival after current_time within every key at once. Before every arrival the query is each key's
+    # position minus one, which sorts after all arrivals of the previous key and before those of the key itself
+    relative_time = min(max(current_time - columns.base, -1), (1 << 32) - 1)
+    first = np.searchsorted(columns.search_keys, (np.arange(len(columns.keys), dtype=np.int64) << 32) + relative_time, side='right')
+    taken = np.minimum(columns.starts[1:] - first, count)
+    # Keys without upcoming arrivals are left out
+    kept = np.flatnonzero(taken)
+    first, taken = first[kept], taken[kept]
+    offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+    np.cumsum(taken, out=offsets[1:])
+    positions = np.repeat(first - offsets[:-1], taken) + np.arange(offsets[-1], dtype=np.int64)
+    return columns.keys[kept].tolist(), array('q', offsets.tobytes()), array('q', columns.times[positions].tobytes())
+
+def _board_columns_python(index: dict, current_time: int, count: int):
+    """
+    Find the next 'count' arrivals of every key with one binary search per key, used when numpy is not installed.
+    """
+    keys = []
+    offsets = array('q', [0])
+    times = array('q')
+    for key in sorted(index):
+        arrivals = index[key]
+        start = bisect_right(arrivals, current_time)
+        if start < len(arrivals):
+            keys.append(key)
+            times.extend(arrivals[start:start + count])
+            offsets.append(len(times))
+    return keys, offsets, times
+
+def build_departure_board(snapshot: FeedSnapshot, current_time: int, count: int=DEPARTURE_BOARD_COUNT) -> DepartureBoard:
+    """
+    Compute the next arrivals of every route at every stop of a snapshot at once, e.g. for a wall display or to pre-warm caches.
+
+    Args:
+        snapshot: A FeedSnapshot of real-time data for one feed group
+        current_time: An integer representing the current epoch time; only later arrivals are included
+        count: The maximum number of arrivals kept per route and stop
+
+    Returns:
+        board: A DepartureBoard. Stops without any arrival after current_time are left out.
+    """
+    if np is not None:
+        keys, offsets, times = _board_columns_numpy(get_board_columns(snapshot), current_time, count)
+    else:
+        keys, offsets, times = _board_columns_python(arrival_index.get_arrival_index(snapshot), current_time, count)
+    return DepartureBoard(keys, offsets, times, snapshot.timestamp, current_time)
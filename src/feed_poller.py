@@ -0,0 +1,153 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+
+import random
+import threading
+import time
+
+# POLL_INTERVAL_SECONDS -- The default number of seconds between refreshes of each feed group. The MTA regenerates its feeds roughly every 30 seconds
+POLL_INTERVAL_SECONDS = 15
+
+# POLL_JITTER_SECONDS -- The maximum random number of seconds added to each interval, so the feed groups do not hit the API in lockstep
+POLL_JITTER_SECONDS = 3
+
+# POLL_ERROR_BACKOFF_SECONDS -- The number of seconds to wait before retrying a feed group after a failed refresh
+POLL_ERROR_BACKOFF_SECONDS = 30
+
+# _poller -- The process-wide poller started by 'start_poller'
+_poller = None
+_poller_lock = threading.Lock()
+
+
+class FeedPoller:
+    """
+    Refresh real-time feeds in the background, one thread per feed group, so requests only read the latest published snapshot.
+    Each thread fetches, decodes and indexes its group while publishing it, keeping all of that work off the request path.
+    Decoding runs in the polling thread, reusing the records of trips that did not change since the group's previous snapshot.
+
+    Args:
+        feed_groups: The feed groups (values of SUBWAY_LINE_URL_SUFFIX) to poll. Defaults to every group in FEED_GROUPS.
+        intervals: A dict of per-group poll intervals in seconds, for groups that should not use POLL_INTERVAL_SECONDS
+        jitter: The maximum random number of seconds added to each interval
+    """
+
+    def __init__(self, feed_groups: list[str]=None, intervals: dict[str, float]=None, jitter: float=POLL_JITTER_SECONDS):
+        self.feed_groups = list(feed_groups) if feed_groups is not None else list(mta_subway_fetcher.FEED_GROUPS)
+        self.intervals = {feed_group: POLL_INTERVAL_SECONDS for feed_group in self.feed_groups}
+        if intervals:
+            self.intervals.update(intervals)
+        self.jitter = jitter
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        """
+        Start one daemon thread per feed group. Each thread refreshes its group immediately, then on its own schedule.
+        """
+        if self._threads:
+            return
+        self._stop_event.clear()
+        for feed_group in self.feed_groups:
+            mta_subway_fetcher.set_polled(feed_group, True)
+            thread = threading.Thread(target=self._run, args=(feed_group,), name=f"feed-poller-{mta_subway_fetcher.feed_group_name(feed_group)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float=None) -> None:
+        """
+        Stop every polling thread and return the feed groups to on-demand fetching.
+
+        Args:
+            timeout: The maximum number of seconds to wait for each thread to finish. Defaults to waiting indefinitely.
+        """
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        for feed_group in self.feed_groups:
+            mta_subway_fetcher.set_polled(feed_group, False)
+        self._threads = []
+
+    def is_running(self) -> bool:
+        """
+        Check whether the polling threads have been started and not stopped.
+        """
+        return bool(self._threads) and not self._stop_event.is_set()
+
+    def refresh(self, feed_group: str) -> bool:
+        """
+        Fetch, decode and index one feed group, then publish it.
+
+        Args:
+            feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+
+        Returns:
+            True if a new snapshot was published, False if the refresh failed
+        """
+        try:
+            if mta_subway_fetcher.refresh_feed_group(feed_group) is None:
+                return False
+        except Exception as e:
+            print(f"Error refreshing feed group '{mta_subway_fetcher.feed_group_name(feed_group)}': {e}")
+            return False
+        return True
+
+    def snapshot_ages(self) -> dict[str, float]:
+        """
+        Measure how old the published snapshot of each polled feed group is.
+
+        Returns:
+            A dict with keys as feed groups and values as the age in seconds from the feed header timestamp, or None for groups with no snapshot yet
+        """
+        snapshot_ages = mta_subway_fetcher.get_snapshot_ages()
+        return {feed_group: snapshot_ages.get(feed_group) for feed_group in self.feed_groups}
+
+    def _run(self, feed_group: str) -> None:
+        """
+        Poll one feed group until the poller is stopped.
+        """
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            if self.refresh(feed_group):
+                delay = self.intervals[feed_group]
+            else:
+                delay = POLL_ERROR_BACKOFF_SECONDS
+            delay += random.uniform(0, self.jitter) - (time.monotonic() - started)
+            self._stop_event.wait(max(delay, 0))
+
+
+def start_poller(feed_groups: list[str]=None, intervals: dict[str, float]=None, jitter: float=POLL_JITTER_SECONDS) -> FeedPoller:
+    """
+    Start the process-wide background poller, or return it if it is already running.
+
+    Args:
+        feed_groups: The feed groups to poll. Defaults to every group in FEED_GROUPS.
+        intervals: A dict of per-group poll intervals in seconds
+        jitter: The maximum random number of seconds added to each interval
+
+    Returns:
+        The running FeedPoller
+    """
+    global _poller
+    with _poller_lock:
+        if _poller is None or not _poller.is_running():
+            _poller = FeedPoller(feed_groups, intervals, jitter)
+            _poller.start()
+        return _poller
+
+def get_poller() -> FeedPoller:
+    """
+    Return the process-wide poller, or None if 'start_poller' has not been called.
+    """
+    return _poller
+
+def stop_poller(timeout: float=None) -> None:
+    """
+    Stop the process-wide poller if it is running.
+
+    Args:
+        timeout: The maximum number of seconds to wait for each polling thread to finish
+    """
+    global _poller
+    with _poller_lock:
+        if _poller is not None:
+            _poller.stop(timeout)
+            _poller = None
@@ -0,0 +1,138 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+
+import gzip
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+# RECORDINGS_PATH -- The default directory for recorded feeds, with one subdirectory per feed group (e.g., 'recordings/ace')
+RECORDINGS_PATH = 'recordings'
+
+# RECORDING_SEGMENT_SECONDS -- How long one archive file is appended to before a new one is started
+RECORDING_SEGMENT_SECONDS = 3600
+
+# RECORDING_MAX_SEGMENTS -- The number of archive files kept per feed group; older files are deleted as new ones start
+RECORDING_MAX_SEGMENTS = 72
+
+# RECORDING_SUFFIX -- The file name suffix of an archive file
+RECORDING_SUFFIX = '.feeds.gz'
+
+# _FRAME_HEADER -- Each recorded feed is stored as its header timestamp and byte length, followed by the raw protobuf bytes
+_FRAME_HEADER = struct.Struct('<QI')
+
+
+class FeedRecorder:
+    """
+    Save the raw protobuf bytes of every fetched feed to rotating, gzip-compressed archives, one series per feed group.
+    Archives can be replayed with local_replay_server.py or read back with 'read_recording' for offline tests and benchmarks.
+
+    Args:
+        directory: The directory to write archives to
+        segment_seconds: How long each archive file is appended to before rotating
+        max_segments: The number of archive files kept per feed group
+    """
+
+    def __init__(self, directory: str=RECORDINGS_PATH, segment_seconds: float=RECORDING_SEGMENT_SECONDS, max_segments: int=RECORDING_MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self._segments = {}  # feed group -> (segment started at, open gzip file)
+        self._lock = threading.Lock()
+
+    def record(self, feed_group: str, header_timestamp: int, data: bytes) -> None:
+        """
+        Append one feed to the current archive of its feed group, rotating the archive when it is older than segment_seconds.
+
+        Args:
+            feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+            header_timestamp: The timestamp from the feed header
+            data: The raw protobuf bytes returned by the API
+        """
+        now = time.time()
+        with self._lock:
+            segment = self._segments.get(feed_group)
+            if segment is None or now - segment[0] >= self.segment_seconds:
+                if segment is not None:
+                    segment[1].close()
+                segment = (now, self._open_segment(feed_group, now))
+                self._segments[feed_group] = segment
+            segment[1].write(_FRAME_HEADER.pack(header_timestamp, len(data)))
+            segment[1].write(data)
+            # A sync flush keeps every complete frame readable even if the process stops without closing the file
+            segment[1].flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> None:
+        """
+        Close every open archive.
+        """
+        with self._lock:
+            for _, f in self._segments.values():
+                f.close()
+            self._segments = {}
+
+    def _open_segment(self, feed_group: str, now: float):
+        """
+        Start a new archive file for a feed group and delete the oldest ones past max_segments.
+        """
+        group_directory = os.path.join(self.directory, mta_subway_fetcher.feed_group_name(feed_group))
+        os.makedirs(group_directory, exist_ok=True)
+        segments = sorted(name for name in os.listdir(group_directory) if name.endswith(RECORDING_SUFFIX))
+        for name in segments[:max(len(segments) - self.max_segments + 1, 0)]:
+            os.remove(os.path.join(group_directory, name))
+        file_name = datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S') + RECORDING_SUFFIX
+        return gzip.open(os.path.join(group_directory, file_name), 'ab')
+
+
+def read_recording(path: str):
+    """
+    Read the feeds stored in one archive file. A file cut off mid-frame (e.g., by a crash) yields every complete frame before the cut.
+
+    Args:
+        path: The path to an archive file written by FeedRecorder
+
+    Yields:
+        (header_timestamp, data) tuples in recording order
+    """
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                header = f.read(_FRAME_HEADER.size)
+                if len(header) < _FRAME_HEADER.size:
+                    return
+                header_timestamp, length = _FRAME_HEADER.unpack(header)
+                data = f.read(length)
+            except (EOFError, zlib.error):
+                return
+            if len(data) < length:
+                return
+            yield header_timestamp, data
+
+def load_recordings(directory: str=RECORDINGS_PATH, feed_groups: list[str]=None) -> dict[str, list[tuple[int, bytes]]]:
+    """
+    Load every recorded feed under a directory.
+
+    Args:
+        directory: A directory written by FeedRecorder, with one subdirectory per feed group
+        feed_groups: The feed groups to load. Defaults to every subway feed group (FEED_GROUPS).
+
+    Returns:
+        recordings: A dict with keys as feed groups (values of SUBWAY_LINE_URL_SUFFIX) and values as lists of (header_timestamp, data), sorted by timestamp
+    """
+    if feed_groups is None:
+        feed_groups = mta_subway_fetcher.FEED_GROUPS
+    recordings = {}
+    for feed_group in feed_groups:
+        group_directory = os.path.join(directory, mta_subway_fetcher.feed_group_name(feed_group))
+        if not os.path.isdir(group_directory):
+            continue
+        frames = []
+        for name in sorted(os.listdir(group_directory)):
+            if name.endswith(RECORDING_SUFFIX):
+                frames.extend(read_recording(os.path.join(group_directory, name)))
+        if frames:
+            frames.sort(key=lambda frame: frame[0])
+            recordings[feed_group] = frames
+    return recordings
@@ -0,0 +1,315 @@
+from src.gtfsproto import nyct_subway_pb2
+
+import sys
+
+# NYCT_DIRECTIONS -- The NyctTripDescriptor.Direction enum values translated to the suffix used on directional stop IDs
+NYCT_DIRECTIONS = {
+    1: 'N',
+    2: 'E',
+    3: 'S',
+    4: 'W',
+}
+
+
+class StopTimeRecord:
+    """
+    A single predicted stop of a trip, decoded from a StopTimeUpdate.
+
+    Attributes:
+        route_id: The route ID of the trip (e.g., '1', or 'GS' for the 42 St Shuttle)
+        trip_id: The GTFS trip ID
+        stop_id: The directional station ID (e.g., '127S')
+        direction: The last character of the stop ID, 'N' or 'S' for subway stops
+        arrival: The predicted arrival in epoch seconds. Origin stops only carry a departure, which is used in its place
+        departure: The predicted departure in epoch seconds, or the arrival if the feed has no departure for the stop
+        scheduled_track: The track the train is scheduled to use at the stop, from the NYCT stop time extension, or ''
+        actual_track: The track the train is using at the stop, known once the train approaches it, or ''
+    """
+    __slots__ = ('route_id', 'trip_id', 'stop_id', 'direction', 'arrival', 'departure', 'scheduled_track', 'actual_track')
+
+    def __init__(self, route_id: str, trip_id: str, stop_id: str, direction: str, arrival: int, departure: int, scheduled_track: str='', actual_track: str=''):
+        self.route_id = route_id
+        self.trip_id = trip_id
+        self.stop_id = stop_id
+        self.direction = direction
+        self.arrival = arrival
+        self.departure = departure
+        self.scheduled_track = scheduled_track
+        self.actual_track = actual_track
+
+    def __reduce__(self):
+        # Pickle as the constructor arguments rather than a dict of slots, so snapshots decoded in worker processes are small and quick to load
+        return (StopTimeRecord, (self.route_id, self.trip_id, self.stop_id, self.direction, self.arrival, self.departure, self.scheduled_track, self.actual_track))
+
+    def __repr__(self) -> str:
+        return f"StopTimeRecord({self.route_id!r}, {self.trip_id!r}, {self.stop_id!r}, {self.direction!r}, {self.arrival}, {self.departure})"
+
+
+class TripRecord:
+    """
+    A trip and its remaining stops, decoded from a TripUpdate.
+
+    Attributes:
+        trip_id: The GTFS trip ID
+        route_id: The route ID of the trip
+        direction: 'N' or 'S', from the NYCT trip extension or else the first stop ID
+        start_date: The service date of the trip as 'YYYYMMDD'
+        stop_times: A tuple of StopTimeRecord in feed (travel) order
+        train_id: The NYCT train ID from the trip extension (e.g., '01 0123+ 242/SFT'), or ''
+        is_assigned: Whether a physical train has been assigned to the trip. Unassigned trips are scheduled departures whose predictions are less reliable.
+            True when the feed has no NYCT trip extension.
+    """
+    __slots__ = ('trip_id', 'route_id', 'direction', 'start_date', 'stop_times', 'train_id', 'is_assigned')
+
+    def __init__(self, trip_id: str, route_id: str, direction: str, start_date: str, stop_times: tuple, train_id: str='', is_assigned: bool=True):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.direction = direction
+        self.start_date = start_date
+        self.stop_times = stop_times
+        self.train_id = train_id
+        self.is_assigned = is_assigned
+
+    def __reduce__(self):
+        return (TripRecord, (self.trip_id, self.route_id, self.direction, self.start_date, self.stop_times, self.train_id, self.is_assigned))
+
+    def __repr__(self) -> str:
+        return f"TripRecord({self.trip_id!r}, {self.route_id!r}, {self.direction!r}, {len(self.stop_times)} stops)"
+
+
+class VehicleRecord:
+    """
+    The last reported position of a train, decoded from a VehiclePosition.
+
+    Attributes:
+        trip_id: The GTFS trip ID the train is running
+        route_id: The route ID of the trip
+        stop_id: The directional station ID the train is at or approaching
+        current_status: The VehiclePosition.VehicleStopStatus value (0 incoming, 1 stopped, 2 in transit)
+        timestamp: The epoch time of the position report
+    """
+    __slots__ = ('trip_id', 'route_id', 'stop_id', 'current_status', 'timestamp')
+
+    def __init__(self, trip_id: str, route_id: str, stop_id: str, current_status: int, timestamp: int):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.stop_id = stop_id
+        self.current_status = current_status
+        self.timestamp = timestamp
+
+    def __reduce__(self):
+        return (VehicleRecord, (self.trip_id, self.route_id, self.stop_id, self.current_status, self.timestamp))
+
+    def __repr__(self) -> str:
+        return f"VehicleRecord({self.trip_id!r}, {self.route_id!r}, {self.stop_id!r})"
+
+
+class AlertRecord:
+    """
+    A service alert, decoded from an Alert entity.
+
+    Attributes:
+        alert_id: The ID of the feed entity carrying the alert
+        active_periods: A tuple of (start, end) epoch times the alert applies to, 0 meaning unbounded. Empty when the alert is always active.
+        informed_entities: A tuple of (route_id, stop_id) pairs the alert applies to, either of which may be '' (e.g., ('1', '') for the whole 1 line)
+        effect: The Alert.Effect value (e.g., 'SIGNIFICANT_DELAYS'), or '' if the feed gives none
+        header_text: The English header of the alert
+        description_text: The English description of the alert, or ''
+    """
+    __slots__ = ('alert_id', 'active_periods', 'informed_entities', 'effect', 'header_text', 'description_text')
+
+    def __init__(self, alert_id: str, active_periods: tuple, informed_entities: tuple, effect: str, header_text: str, description_text: str):
+        self.alert_id = alert_id
+        self.active_periods = active_periods
+        self.informed_entities = informed_entities
+        self.effect = effect
+        self.header_text = header_text
+        self.description_text = description_text
+
+    def __reduce__(self):
+        return (AlertRecord, (self.alert_id, self.active_periods, self.informed_entities, self.effect, self.header_text, self.description_text))
+
+    def __repr__(self) -> str:
+        return f"AlertRecord({self.alert_id!r}, {self.header_text!r})"
+
+
+class FeedSnapshot:
+    """
+    All trips, vehicle positions and alerts of one decoded feed.
+
+    Attributes:
+        feed_group: The feed group the snapshot was fetched for (a value of SUBWAY_LINE_URL_SUFFIX)
+        timestamp: The epoch time from the feed header, when the MTA generated the feed
+        trips: A dict of TripRecord keyed by trip ID, in feed order
+        vehicles: A dict of VehicleRecord keyed by trip ID
+        alerts: A dict of AlertRecord keyed by alert ID
+        arrival_index: The per-stop sorted arrival index, built on first use by 'arrival_index.get_arrival_index'
+        train_index: The per-train index, built on first use by 'train_tracker.get_train_index'
+        board_columns: The arrival index as flat columns for departure boards, built on first use by 'departure_board.get_board_columns'
+        stale: True once a later fetch of the feed group has failed and this snapshot is being served in its place
+        index_only: True if the snapshot carries only an arrival index, with no trip, vehicle or alert records (e.g., a streamed bus feed)
+    """
+    __slots__ = ('feed_group', 'timestamp', 'trips', 'vehicles', 'alerts', 'arrival_index', 'train_index', 'board_columns', 'stale', 'index_only')
+
+    def __init__(self, feed_group: str, timestamp: int, trips: dict, vehicles: dict, alerts: dict=None):
+        self.feed_group = feed_group
+        self.timestamp = timestamp
+        self.trips = trips
+        self.vehicles = vehicles
+        self.alerts = alerts if alerts is not None else {}
+        self.arrival_index = None
+        self.train_index = None
+        self.board_columns = None
+        self.stale = False
+        self.index_only = False
+
+    def __reduce__(self):
+        # The indexes are derived from the trips and are rebuilt where needed, and 'stale' only applies to the cached copy
+        return (FeedSnapshot, (self.feed_group, self.timestamp, self.trips, self.vehicles, self.alerts))
+
+    def __repr__(self) -> str:
+        return f"FeedSnapshot({self.feed_group!r}, {self.timestamp}, {len(self.trips)} trips)"
+
+    def iter_stop_times(self, route_id: str=None):
+        """
+        Iterate over every StopTimeRecord in the snapshot, optionally only for one route.
+
+        Args:
+            route_id: The route ID to filter on. Defaults to all routes in the snapshot.
+
+        Yields:
+            StopTimeRecord values in feed order
+        """
+        for trip in self.trips.values():
+            if route_id is None or trip.route_id == route_id:
+                yield from trip.stop_times
+
+
+def _tracks(update) -> tuple[str, str]:
+    """
+    Return the (scheduled_track, actual_track) of a StopTimeUpdate from its NYCT extension, or empty strings without one.
+    """
+    if not update.HasExtension(nyct_subway_pb2.nyct_stop_time_update):
+        return '', ''
+    nyct_update = update.Extensions[nyct_subway_pb2.nyct_stop_time_update]
+    return nyct_update.scheduled_track, nyct_update.actual_track
+
+def _train_assignment(trip) -> tuple[str, bool, str]:
+    """
+    Return the (train_id, is_assigned, direction suffix) of a TripDescriptor from its NYCT extension, or ('', True, '') without one.
+    """
+    if not trip.HasExtension(nyct_subway_pb2.nyct_trip_descriptor):
+        return '', True, ''
+    nyct_trip = trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor]
+    return nyct_trip.train_id, nyct_trip.is_assigned, NYCT_DIRECTIONS.get(nyct_trip.direction, '')
+
+def _same_trip(trip_update, trip: TripRecord) -> bool:
+    """
+    Check whether a TripUpdate predicts exactly the train assignment, stops, times and tracks already held by a TripRecord, without building any records.
+    """
+    if trip.route_id != trip_update.trip.route_id:
+        return False
+    train_id, is_assigned, _ = _train_assignment(trip_update.trip)
+    if train_id != trip.train_id or is_assigned != trip.is_assigned:
+        return False
+    stops = iter(trip.stop_times)
+    for update in trip_update.stop_time_update:
+        arrival = update.arrival.time
+        departure = update.departure.time
+        if not (arrival or departure):
+            continue
+        stop = next(stops, None)
+        if stop is None or update.stop_id != stop.stop_id or (arrival or departure) != stop.arrival or (departure or arrival) != stop.departure:
+            return False
+        if _tracks(update) != (stop.scheduled_track, stop.actual_track):
+            return False
+    return next(stops, None) is None
+
+def _decode_trip_update(trip_update, intern=sys.intern) -> TripRecord:
+    """
+    Translate a TripUpdate message into a TripRecord.
+
+    Args:
+        trip_update: A transit_realtime.TripUpdate protobuf message
+        intern: The function used to share repeated strings (route and stop IDs) between records
+
+    Returns:
+        A TripRecord holding a StopTimeRecord for every stop time update with an arrival or departure time
+    """
+    trip = trip_update.trip
+    trip_id = trip.trip_id
+    route_id = intern(trip.route_id)
+    stop_times = []
+    for update in trip_update.stop_time_update:
+        arrival = update.arrival.time
+        departure = update.departure.time
+        if not (arrival or departure):
+            # A stop with no predicted time (e.g., one the train skips) has no arrival to serve
+            continue
+        stop_id = intern(update.stop_id)
+        scheduled_track, actual_track = _tracks(update)
+        stop_times.append(StopTimeRecord(route_id, trip_id, stop_id, stop_id[-1:], arrival or departure, departure or arrival, intern(scheduled_track), intern(actual_track)))
+
+    train_id, is_assigned, direction = _train_assignment(trip)
+    if not direction and stop_times:
+        direction = stop_times[0].direction
+    return TripRecord(trip_id, route_id, direction, trip.start_date, tuple(stop_times), train_id, is_assigned)
+
+def _translated_text(translated_string, language: str='en') -> str:
+    """
+    Pick the text of a TranslatedString in the given language, falling back to an untagged or the first translation.
+    """
+    fallback = ''
+    for translation in translated_string.translation:
+        if translation.language == language:
+            return translation.text
+        if not fallback or not translation.language:
+            fallback = translation.text
+    return fallback
+
+def _decode_alert(alert_id: str, alert) -> AlertRecord:
+    """
+    Translate an Alert message into an AlertRecord.
+
+    Args:
+        alert_id: The ID of the feed entity carrying the alert
+        alert: A transit_realtime.Alert protobuf message
+    """
+    active_periods = tuple((period.start, period.end) for period in alert.active_period)
+    # Alerts on a trip name its route in the trip descriptor instead
+    informed_entities = tuple(dict.fromkeys((sys.intern(entity.route_id or entity.trip.route_id), sys.intern(entity.stop_id)) for entity in alert.informed_entity))
+    effect = alert.Effect.Name(alert.effect) if alert.HasField('effect') else ''
+    return AlertRecord(alert_id, active_periods, informed_entities, effect, _translated_text(alert.header_text), _translated_text(alert.description_text))
+
+def feedmessage_to_snapshot(pb_data, feed_group: str='', previous: FeedSnapshot=None) -> FeedSnapshot:
+    """
+    Walk a parsed FeedMessage and keep only the fields needed to answer arrival queries.
+
+    Args:
+        pb_data: A parsed transit_realtime.FeedMessage protobuf message
+        feed_group: The feed group the message was fetched for (a value of SUBWAY_LINE_URL_SUFFIX)
+        previous: The previous snapshot of the same feed group. Trips whose predictions did not change reuse its TripRecord objects instead of being rebuilt.
+
+    Returns:
+        snapshot: A FeedSnapshot of the trips, vehicle positions and alerts in the message
+    """
+    previous_trips = previous.trips if previous is not None else {}
+    trips = {}
+    vehicles = {}
+    alerts = {}
+    for entity in pb_data.entity:
+        if entity.HasField('trip_update'):
+            trip_update = entity.trip_update
+            previous_trip = previous_trips.get(trip_update.trip.trip_id)
+            if previous_trip is not None and _same_trip(trip_update, previous_trip):
+                trip = previous_trip
+            else:
+                trip = _decode_trip_update(trip_update)
+            trips[trip.trip_id] = trip
+        elif entity.HasField('vehicle'):
+            vehicle = entity.vehicle
+            vehicles[vehicle.trip.trip_id] = VehicleRecord(vehicle.trip.trip_id, sys.intern(vehicle.trip.route_id), sys.intern(vehicle.stop_id), vehicle.current_status, vehicle.timestamp)
+        elif entity.HasField('alert'):
+            alerts[entity.id] = _decode_alert(entity.id, entity.alert)
+    snapshot = FeedSnapshot(feed_group, pb_data.header.timestamp, trips, vehicles, alerts)
+    return snapshot
@@ -0,0 +1,187 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# LATENCY_BUCKETS_SECONDS -- Histogram bucket upper bounds for stage durations, from sub-millisecond lookups to slow upstream fetches
+LATENCY_BUCKETS_SECONDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# SIZE_BUCKETS_BYTES -- Histogram bucket upper bounds for feed sizes
+SIZE_BUCKETS_BYTES = (10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000)
+
+# _registry -- Every metric created in the process, in creation order, rendered by 'render'
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape_label_value(value) -> str:
+    """
+    Escape a label value for the exposition format: backslashes, double quotes and newlines.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str='') -> str:
+    """
+    Format label names and values as a Prometheus label set (e.g., '{feed_group="ace"}').
+    """
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    """
+    Format a sample value the way Prometheus expects, including infinity.
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing count, optionally split by labels.
+
+    Args:
+        name: The metric name (e.g., 'catch_a_ride_upstream_errors_total')
+        documentation: The help text shown in the exposition
+        label_names: The names of the labels every sample must be given
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float=1, **labels) -> None:
+        """
+        Add to the count for a label set.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        """
+        Return a copy of the counts, keyed by label values in the order of label_names.
+        """
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    A value computed when metrics are rendered, such as the age of the latest snapshot.
+
+    Args:
+        name: The metric name
+        documentation: The help text shown in the exposition
+        label_names: The names of the labels of each sample
+        callback: A callable returning a dict with keys as tuples of label values and values as the gauge values
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple, callback):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    A distribution of observed values in cumulative buckets, optionally split by labels.
+
+    Args:
+        name: The metric name (e.g., 'catch_a_ride_decode_seconds')
+        documentation: The help text shown in the exposition
+        label_names: The names of the labels every observation must be given
+        buckets: The bucket upper bounds, in increasing order. A +Inf bucket is always added.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple=(), buckets: tuple=LATENCY_BUCKETS_SECONDS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record one observation for a label set.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry = self._values[key]
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the number of seconds spent in a 'with' block.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = {key: (list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()}
+        for key, (bucket_counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_label = 'le="' + _format_value(upper_bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def register(metric):
+    """
+    Add a metric to the process-wide registry so it is included by 'render'.
+
+    Returns:
+        The metric, so it can be assigned where it is created
+    """
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def render() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        registered = list(_registry)
+    lines = []
+    for metric in registered:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            print(f"Error rendering metric {metric.name}: {e}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,420 @@
+from src.gtfsproto import gtfs_realtime_pb2
+from src.feed_records import FeedSnapshot
+import src.mta_subway_fetcher as mta_subway_fetcher
+
+import collections
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from google.protobuf.message import DecodeError
+
+# BUS_BASE_URL -- The MTA Bus Time GTFS-realtime server. Set MTA_BUS_BASE_URL to point at another server with the same paths, such as local_replay_server.py (e.g., "http://127.0.0.1:8081")
+BUS_BASE_URL = os.environ.get("MTA_BUS_BASE_URL", "https://gtfsrt.prod.obanyc.com")
+
+# BUS_TRIP_UPDATES_PATH -- The path of the trip updates feed for every bus route, appended to BUS_BASE_URL
+BUS_TRIP_UPDATES_PATH = '/tripUpdates'
+
+# BUS_API_KEY -- The MTA Bus Time API key, sent as the 'key' query parameter. Read from MTA_BUS_API_KEY.
+BUS_API_KEY = os.environ.get("MTA_BUS_API_KEY", "")
+
+# BUS_FEED_GROUP -- The feed group name of the bus feed, used for its snapshots, metrics and recordings (e.g., 'recordings/bus')
+BUS_FEED_GROUP = 'bus'
+
+# BUS_CACHE_TTL_SECONDS -- The number of seconds a decoded bus feed is served before it is fetched again
+BUS_CACHE_TTL_SECONDS = 30
+
+# BUS_MAX_ARRIVALS_PER_STOP -- The number of earliest arrivals kept per route and stop, so memory is bounded by the subscriptions rather than the feed size
+BUS_MAX_ARRIVALS_PER_STOP = 8
+
+# BUS_MAX_SUBSCRIPTIONS -- The number of subscribed (route, stop) pairs kept; the least recently subscribed is dropped past this
+BUS_MAX_SUBSCRIPTIONS = 512
+
+# BUS_NEW_STOP_REFETCH_SECONDS -- The age of the cached feed past which a query for a stop it does not hold fetches the feed again. A younger feed is served, and the stop is picked up by the next refresh.
+BUS_NEW_STOP_REFETCH_SECONDS = 10
+
+# BUS_NEW_SUBSCRIPTIONS_PER_MINUTE -- The number of new (route, stop) pairs subscribed per minute, so queries for many unknown stops cannot evict the subscriptions in use
+BUS_NEW_SUBSCRIPTIONS_PER_MINUTE = 30
+
+# BUS_READ_CHUNK_BYTES -- The most bytes read from the response at once while skipping unneeded fields
+BUS_READ_CHUNK_BYTES = 65536
+
+# _FEED_HEADER_FIELD, _FEED_ENTITY_FIELD -- The field numbers of FeedMessage.header and FeedMessage.entity
+_FEED_HEADER_FIELD = 1
+_FEED_ENTITY_FIELD = 2
+
+# _subscriptions -- The (route_id, stop_id) pairs to keep arrivals for, in subscription order. An empty route_id means every route at the stop, and an empty stop_id every stop of the route.
+_subscriptions = {}
+# _new_subscription_times -- When each new pair was subscribed in the last minute, for BUS_NEW_SUBSCRIPTIONS_PER_MINUTE
+_new_subscription_times = collections.deque()
+_subscriptions_lock = threading.Lock()
+
+# _bus_cache -- The latest decoded bus feed, as (fetched_at, snapshot, subscriptions decoded for), or None
+_bus_cache = None
+# _bus_failed_at -- When the last fetch of the bus feed failed, so requests waiting on it serve the stale feed instead of fetching again
+_bus_failed_at = 0
+_bus_cache_lock = threading.Lock()
+
+# _feed_recorder -- The FeedRecorder saving fetched bus feeds, set with 'set_feed_recorder'
+_feed_recorder = None
+
+
+def _read_varint(stream) -> int:
+    """
+    Read one base-128 varint from a stream.
+
+    Returns:
+        The value, or None at the end of the stream before the first byte
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if shift == 0:
+                return None
+            raise DecodeError("Truncated varint")
+        result |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+def _read_exactly(stream, length: int, keep: bool=True) -> bytes:
+    """
+    Read exactly 'length' bytes from a stream, which may return fewer per read (e.g., an HTTP response). With keep=False the bytes are discarded in chunks.
+    """
+    chunks = []
+    remaining = length
+    while remaining:
+        chunk = stream.read(min(remaining, BUS_READ_CHUNK_BYTES) if not keep else remaining)
+        if not chunk:
+            raise DecodeError(f"Truncated field: {remaining} of {length} bytes missing")
+        remaining -= len(chunk)
+        if keep:
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+def iter_feed_fields(stream):
+    """
+    Read a FeedMessage from a stream one top-level field at a time, so only one entity is ever held in memory.
+
+    Args:
+        stream: A file-like object with a 'read' method, positioned at the start of a protobuf-encoded FeedMessage
+
+    Yields:
+        (field_number, data) tuples for the header and each entity, in feed order, with the encoded bytes of the field. Other fields are skipped.
+    """
+    while True:
+        tag = _read_varint(stream)
+        if tag is None:
+            return
+        field_number, wire_type = tag >> 3, tag & 7
+        if wire_type == 2:
+            length = _read_varint(stream)
+            if length is None:
+                raise DecodeError("Truncated field length")
+            keep = field_number in (_FEED_HEADER_FIELD, _FEED_ENTITY_FIELD)
+            data = _read_exactly(stream, length, keep)
+            if keep:
+                yield field_number, data
+        elif wire_type == 0:
+            _read_varint(stream)
+        elif wire_type == 1:
+            _read_exactly(stream, 8, False)
+        elif wire_type == 5:
+            _read_exactly(stream, 4, False)
+        else:
+            raise DecodeError(f"Unsupported wire type {wire_type}")
+
+def _subscription_pattern(subscriptions: frozenset) -> re.Pattern:
+    """
+    Build a pattern matching the encoded bytes of any subscribed route or stop ID. An entity without a match cannot hold a subscribed arrival, so it is skipped without being parsed.
+    """
+    tokens = {route_id if not stop_id else stop_id for route_id, stop_id in subscriptions}
+    return re.compile(b'|'.join(re.escape(token.encode('utf-8')) for token in sorted(tokens, key=len, reverse=True)))
+
+def stream_to_snapshot(stream, subscriptions: frozenset, max_per_stop: int=BUS_MAX_ARRIVALS_PER_STOP) -> FeedSnapshot:
+    """
+    Decode a bus trip updates feed from a stream, keeping only the earliest arrivals of subscribed routes and stops.
+
+    Args:
+        stream: A file-like object positioned at the start of a protobuf-encoded FeedMessage
+        subscriptions: A frozenset of (route_id, stop_id) pairs, as kept by 'subscribe'
+        max_per_stop: The number of earliest arrivals kept per route and stop
+
+    Returns:
+        snapshot: An index-only FeedSnapshot with no trips, whose 'arrival_index' holds the kept arrivals as for 'arrival_index.build_arrival_index'
+    """
+    timestamp = 0
+    pattern = _subscription_pattern(subscriptions) if subscriptions else None
+    # Per (route_id, stop_id), a heap of negated arrival times holding the earliest max_per_stop
+    heaps = {}
+    for field_number, data in iter_feed_fields(stream):
+        if field_number == _FEED_HEADER_FIELD:
+            timestamp = gtfs_realtime_pb2.FeedHeader.FromString(data).timestamp
+            continue
+        if pattern is None or not pattern.search(data):
+            continue
+        entity = gtfs_realtime_pb2.FeedEntity.FromString(data)
+        if not entity.HasField('trip_update'):
+            continue
+        route_id = entity.trip_update.trip.route_id
+        route_wide = (route_id, '') in subscriptions
+        for update in entity.trip_update.stop_time_update:
+            stop_id = update.stop_id
+            if not (route_wide or (route_id, stop_id) in subscriptions or ('', stop_id) in subscriptions):
+                continue
+            arrival = update.arrival.time or update.departure.time
+            if not arrival:
+                continue
+            key = (sys.intern(route_id), sys.intern(stop_id))
+            heap = heaps.get(key)
+            if heap is None:
+                heaps[key] = [-arrival]
+            elif len(heap) < max_per_stop:
+                heapq.heappush(heap, -arrival)
+            elif -heap[0] > arrival:
+                heapq.heapreplace(heap, -arrival)
+    snapshot = FeedSnapshot(BUS_FEED_GROUP, timestamp, {}, {})
+    snapshot.index_only = True
+    snapshot.arrival_index = {key: array('q', sorted(-arrival for arrival in heap)) for key, heap in heaps.items()}
+    return snapshot
+
+
+class _DeadlineStream:
+    """
+    Read a streamed response, giving up at a monotonic time even if the server keeps sending slowly (see 'mta_subway_fetcher._read_before').
+    """
+
+    def __init__(self, response, give_up_at: float):
+        self.response = response
+        self.give_up_at = give_up_at
+
+    def read(self, size: int=-1) -> bytes:
+        import requests
+        remaining = self.give_up_at - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout("Download did not finish before the deadline")
+        connection = self.response.raw.connection
+        if connection is not None and connection.sock is not None:
+            connection.sock.settimeout(remaining)
+        return self.response.raw.read1(size if size > 0 else BUS_READ_CHUNK_BYTES, decode_content=True)
+
+
+class _RecordingStream:
+    """
+    Pass reads through to a stream while keeping a copy of the bytes, so a streamed feed can still be recorded.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.data = bytearray()
+
+    def read(self, size: int=-1) -> bytes:
+        chunk = self.stream.read(size)
+        self.data += chunk
+        return chunk
+
+
+def subscribe(stop_id: str, route_id: str='') -> bool:
+    """
+    Keep the arrivals of a route at a stop in every decoded bus feed from now on.
+
+    Args:
+        stop_id: The bus stop ID (e.g., '308209'), or '' for every stop of the route
+        route_id: The bus route ID (e.g., 'B63'), or '' for every route at the stop
+
+    Returns:
+        True if the pair was not subscribed yet, False if it was, or None if it was not subscribed because BUS_NEW_SUBSCRIPTIONS_PER_MINUTE new pairs already were
+    """
+    key = (route_id, stop_id)
+    now = time.monotonic()
+    with _subscriptions_lock:
+        is_new = key not in _subscriptions
+        if is_new:
+            while _new_subscription_times and now - _new_subscription_times[0] >= 60:
+                _new_subscription_times.popleft()
+            if len(_new_subscription_times) >= BUS_NEW_SUBSCRIPTIONS_PER_MINUTE:
+                return None
+            _new_subscription_times.append(now)
+        _subscriptions.pop(key, None)
+        _subscriptions[key] = None
+        while len(_subscriptions) > BUS_MAX_SUBSCRIPTIONS:
+            del _subscriptions[next(iter(_subscriptions))]
+    return is_new
+
+def get_subscriptions() -> frozenset:
+    with _subscriptions_lock:
+        return frozenset(_subscriptions)
+
+def set_feed_recorder(recorder) -> None:
+    """
+    Save the raw bytes of every successfully decoded bus feed with a recorder, as 'mta_subway_fetcher.set_feed_recorder' does for subway feeds.
+    Recording keeps a copy of each whole feed while it is decoded.
+
+    Args:
+        recorder: A FeedRecorder, or None to stop recording
+    """
+    global _feed_recorder
+    _feed_recorder = recorder
+
+def _is_covered(subscriptions: frozenset, route_id: str, stop_id: str) -> bool:
+    """
+    Check whether a feed decoded for a set of subscriptions holds the arrivals of a route (or every route) at a stop.
+    """
+    return (route_id, stop_id) in subscriptions or ('', stop_id) in subscriptions or (bool(route_id) and (route_id, '') in subscriptions)
+
+def fetch_bus_snapshot(subscriptions: frozenset=None, deadline: float=None) -> FeedSnapshot:
+    """
+    Fetch the bus trip updates feed and decode it while it downloads, bypassing the cache.
+    Failed requests are retried like subway feeds (see 'mta_subway_fetcher.api_to_bin'), unless a deadline is given.
+
+    Args:
+        subscriptions: The (route_id, stop_id) pairs to keep arrivals for. Defaults to the current subscriptions.
+        deadline: The most seconds the fetch may take, including a slow download, when it is tried only once. Defaults to every retry with no limit besides the timeouts.
+
+    Returns:
+        snapshot: The output of 'stream_to_snapshot' for the current subscriptions, or None if the feed could not be fetched or decoded
+    """
+    import requests
+    import urllib3
+    url = f'{BUS_BASE_URL}{BUS_TRIP_UPDATES_PATH}'
+    params = {'key': BUS_API_KEY} if BUS_API_KEY else None
+    if subscriptions is None:
+        subscriptions = get_subscriptions()
+    recorder = _feed_recorder
+    session = mta_subway_fetcher.get_session()
+    attempts = mta_subway_fetcher.FEED_RETRY_ATTEMPTS if deadline is None else 1
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(mta_subway_fetcher.FEED_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        timeout = (mta_subway_fetcher.FEED_CONNECT_TIMEOUT_SECONDS, mta_subway_fetcher.FEED_READ_TIMEOUT_SECONDS)
+        if deadline is not None:
+            give_up_at = time.monotonic() + deadline
+            timeout = (min(timeout[0], deadline), min(timeout[1], deadline))
+        try:
+            with mta_subway_fetcher.FETCH_SECONDS.time(feed_group=BUS_FEED_GROUP):
+                with session.get(url, params=params, stream=True, timeout=timeout) as r:
+                    r.raise_for_status()
+                    r.raw.decode_content = True
+                    stream = _DeadlineStream(r, give_up_at) if deadline is not None else r.raw
+                    if recorder is not None:
+                        stream = _RecordingStream(stream)
+                    snapshot = stream_to_snapshot(stream, subscriptions)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            print(f"Error fetching {url} (attempt {attempt + 1} of {attempts}): {e}")
+            mta_subway_fetcher.UPSTREAM_ERRORS.inc(feed_group=BUS_FEED_GROUP, reason='fetch')
+            continue
+        except (DecodeError, OSError) as e:
+            print(f"Error decoding the bus feed: {e}")
+            mta_subway_fetcher.UPSTREAM_ERRORS.inc(feed_group=BUS_FEED_GROUP, reason='decode')
+            return None
+        if recorder is not None:
+            try:
+                recorder.record(BUS_FEED_GROUP, snapshot.timestamp, bytes(stream.data))
+            except Exception as e:
+                print(f"Error recording the bus feed: {e}")
+        return snapshot
+    return None
+
+def _get_bus_cache(ttl: float=None) -> tuple:
+    """
+    Return the latest decoded bus feed with the subscriptions it was decoded for, fetching it when the cached one is older than ttl seconds (see 'get_bus_snapshot').
+    """
+    global _bus_cache, _bus_failed_at
+    if ttl is None:
+        ttl = BUS_CACHE_TTL_SECONDS
+    with _bus_cache_lock:
+        now = time.time()
+        if _bus_cache is not None and now - _bus_cache[0] < ttl:
+            mta_subway_fetcher.FEED_CACHE_REQUESTS.inc(feed_group=BUS_FEED_GROUP, result='hit')
+            return _bus_cache[1:]
+        subscriptions = get_subscriptions()
+        # Requests that waited on a fetch that just failed are answered without fetching again
+        snapshot = None
+        if now - _bus_failed_at >= mta_subway_fetcher.FEED_CACHE_MIN_REFETCH_SECONDS:
+            snapshot = fetch_bus_snapshot(subscriptions, deadline=mta_subway_fetcher.FEED_REQUEST_DEADLINE_SECONDS)
+            if snapshot is None:
+                _bus_failed_at = time.time()
+        if snapshot is None:
+            mta_subway_fetcher.FEED_CACHE_REQUESTS.inc(feed_group=BUS_FEED_GROUP, result='stale')
+            if _bus_cache is None:
+                return None, frozenset()
+            _bus_cache[1].stale = True
+            return _bus_cache[1:]
+        mta_subway_fetcher.FEED_CACHE_REQUESTS.inc(feed_group=BUS_FEED_GROUP, result='miss')
+        _bus_cache = (time.time(), snapshot, subscriptions)
+        return _bus_cache[1:]
+
+def get_bus_snapshot(ttl: float=None) -> FeedSnapshot:
+    """
+    Return the latest decoded bus feed, fetching it when the cached one is older than ttl seconds.
+    Every bus fetch answers a request, so it is tried once within 'mta_subway_fetcher.FEED_REQUEST_DEADLINE_SECONDS', and not again for FEED_CACHE_MIN_REFETCH_SECONDS after failing.
+
+    Args:
+        ttl: The number of seconds a fetched feed is served. Defaults to BUS_CACHE_TTL_SECONDS, and 0 always fetches.
+
+    Returns:
+        snapshot: A FeedSnapshot with the arrivals of the subscribed routes and stops. If the feed cannot be fetched, the last one is returned with its 'stale' attribute set, or None if there is none.
+    """
+    return _get_bus_cache(ttl)[0]
+
+def next_bus_arrivals(snapshot: FeedSnapshot, stop_id: str, route_id: str, current_time: int, count: int) -> list[tuple[int, str]]:
+    """
+    Find the next bus arrivals at a stop after a given time.
+
+    Args:
+        snapshot: A FeedSnapshot from 'get_bus_snapshot'
+        stop_id: The bus stop ID
+        route_id: The bus route ID, or '' for every route at the stop
+        current_time: An integer representing the current epoch time; only later arrivals are returned
+        count: The maximum number of arrivals to return
+
+    Returns:
+        A list of up to 'count' (arrival epoch time, route_id) tuples, earliest first
+    """
+    arrivals = []
+    for (key_route_id, key_stop_id), times in snapshot.arrival_index.items():
+        if key_stop_id == stop_id and (not route_id or key_route_id == route_id):
+            arrivals.extend((arrival, key_route_id) for arrival in times if arrival > current_time)
+    return heapq.nsmallest(count, arrivals)
+
+def get_bus_arrivals(stop_id: str, route_id: str='', count: int=3, current_time: int=None) -> dict:
+    """
+    Find the next bus arrivals at a stop, subscribing to the stop first.
+    A stop the cached feed was not decoded for is picked up by the next refresh, which comes early (once the feed is BUS_NEW_STOP_REFETCH_SECONDS old) rather than on every new stop.
+
+    Args:
+        stop_id: The bus stop ID (e.g., '308209')
+        route_id: The bus route ID (e.g., 'B63'), or '' for every route at the stop
+        count: An integer representing the count of upcoming buses to return
+        current_time: An integer representing the current epoch time. Defaults to now.
+
+    Returns:
+        arrivals: A dict with the query, the 'arrivals' as dicts with the 'route_id' and arrival 'time', the 'minutes' until each arrival,
+            the feed header 'timestamp', whether the data is 'stale' and whether the stop is 'pending' the next refresh. 'arrivals' is None when the feed is unavailable or the stop is pending.
+            None if the stop could not be subscribed (see 'subscribe').
+    """
+    if current_time is None:
+        current_time = int(time.time())
+    if subscribe(stop_id, route_id) is None:
+        print(f"Not subscribing to bus stop {stop_id}: more than {BUS_NEW_SUBSCRIPTIONS_PER_MINUTE} new stops this minute")
+        return None
+    cache = _bus_cache
+    covered = cache is not None and _is_covered(cache[2], route_id, stop_id)
+    snapshot, subscriptions = _get_bus_cache(None if covered else BUS_NEW_STOP_REFETCH_SECONDS)
+    arrivals = {'stop_id': stop_id, 'route_id': route_id, 'count': count, 'arrivals': None, 'minutes': None, 'timestamp': None, 'stale': False, 'pending': False}
+    if snapshot is None:
+        return arrivals
+    arrivals['timestamp'] = snapshot.timestamp
+    arrivals['stale'] = snapshot.stale
+    if not _is_covered(subscriptions, route_id, stop_id):
+        arrivals['pending'] = True
+        return arrivals
+    next_arrivals = next_bus_arrivals(snapshot, stop_id, route_id, current_time, count)
+    arrivals['arrivals'] = [{'route_id': arrival_route_id, 'time': arrival} for arrival, arrival_route_id in next_arrivals]
+    arrivals['minutes'] = [int((arrival - current_time) / 60.0) for arrival, _ in next_arrivals]
+    return arrivals
@@ -1,30 +1,56 @@
 import src.mta_subway_fetcher as mta_subway_fetcher
+import src.static_timetable as static_timetable
+from src.feed_records import FeedSnapshot, TripRecord
+from src.snapshot_diff import ChangeSet
+
+import json
+import threading
+
+# STATIC_STATIONS_PATH -- Stations per line collected during regular weekday service, used when live data is too sparse
+STATIC_STATIONS_PATH = 'data/stations_per_line.json'
+
+# STATION_LIST_MIN_FRACTION -- The live station list of a line is used once it holds at least this fraction of the line's stations in STATIC_STATIONS_PATH
+STATION_LIST_MIN_FRACTION = 0.5
+
+# _station_sequences -- Ordered, de-duplicated directional stop IDs per (route_id, direction), merged from every published snapshot
+_station_sequences = {}
+# _station_positions -- The index of every stop ID in its sequence in _station_sequences, so merging a trip does not search the sequence for each stop
+_station_positions = {}
+_station_sequences_lock = threading.Lock()
+
+# _source_snapshots -- The snapshot per feed group whose published station sequences were last copied, in a worker serving snapshots from another process
+_source_snapshots = {}
+
+# _static_stations -- The contents of STATIC_STATIONS_PATH, loaded on first use
+_static_stations = None
 
 def get_stops_for_lines(subway_lines: list[str]=mta_subway_fetcher.SUBWAY_LINE_LIST) -> dict:
     """
     Make API calls for real-time subway data to collect a list of stations per subway line, and return all available stations for the subway line(s).
+    Each feed group is fetched at most once, and the groups are decoded in parallel (see 'mta_subway_fetcher.refresh_all_feed_groups').
     
     Args:
         subway_lines: A list of strings for the subway line(s) to search. Defaults to all possible subway lines.
     
     Returns:
-        lines_with_stops: A dict of lists of strings, with keys as the names of subway lines and values as a list of machine-readable station IDs
+        lines_with_stops: A dict of lists of strings, with keys as the names of subway lines and values as a list of machine-readable station IDs.
+            Lines whose feed group could not be fetched are left out.
     """
+    snapshots = mta_subway_fetcher.refresh_all_feed_groups([mta_subway_fetcher.get_feed_group(line) for line in subway_lines], ttl=None)
     lines_with_stops = {}
     for line in subway_lines:
-        lines_with_stops[line] = []
-        if line in mta_subway_fetcher.SHUTTLE_INTERNAL_MAPPING.keys():
-            route_id = mta_subway_fetcher.SHUTTLE_INTERNAL_MAPPING[line]
-        else: 
-            route_id = line
-        line_data = mta_subway_fetcher.get_realtime_data(line)['entity']
-        for e in line_data:
-            if e.get('vehicle') and e['vehicle']['trip']['routeId'] == route_id and e['vehicle'].get('stopId') and e['vehicle']['stopId'] not in lines_with_stops[line]:
-                lines_with_stops[line].append(e['vehicle']['stopId'])
-            elif e.get('tripUpdate') and e['tripUpdate']['trip']['routeId'] == route_id and e['tripUpdate'].get('stopTimeUpdate'):
-                for stop in e['tripUpdate']['stopTimeUpdate']:
-                    if stop['stopId'] not in lines_with_stops[line]:
-                        lines_with_stops[line].append(stop['stopId'])
+        # A dict keeps the first-seen order of stop IDs while making duplicate checks constant time
+        line_stops = {}
+        route_id = mta_subway_fetcher.get_route_id(line)
+        line_data = snapshots.get(mta_subway_fetcher.get_feed_group(line))
+        if line_data is None:
+            continue
+        for vehicle in line_data.vehicles.values():
+            if vehicle.route_id == route_id and vehicle.stop_id:
+                line_stops[vehicle.stop_id] = None
+        for stop in line_data.iter_stop_times(route_id):
+            line_stops[stop.stop_id] = None
+        lines_with_stops[line] = list(line_stops)
     return lines_with_stops
 
 def remove_directionality_and_dedupe(lines_with_stops_both_directions) -> dict:
@@ -76,9 +102,206 @@ def split_directionality_and_dedupe(lines_with_stops_both_directions) -> tuple[d
             elif station[-1] == "S":
                 lines_with_stops_south[f"{k}S"].append(station)
     
-    # Remove duplicates
+    # Remove duplicates, keeping the order stations were first seen in
     for line in lines_with_stops_both_directions.keys():
-        lines_with_stops_north[f"{line}N"] = list(set(lines_with_stops_north[f"{line}N"]))
-        lines_with_stops_south[f"{line}S"] = list(set(lines_with_stops_south[f"{line}S"]))
+        lines_with_stops_north[f"{line}N"] = list(dict.fromkeys(lines_with_stops_north[f"{line}N"]))
+        lines_with_stops_south[f"{line}S"] = list(dict.fromkeys(lines_with_stops_south[f"{line}S"]))
     
-    return lines_with_stops_north, lines_with_stops_south
\ No newline at end of file
+    return lines_with_stops_north, lines_with_stops_south
+
+def merge_stop_sequence(sequence: list[str], stop_ids: list[str], positions: dict[str, int]=None) -> bool:
+    """
+    Merge the stops of one trip, in travel order, into the known stop sequence of its route and direction.
+    Each stop missing from the sequence is inserted right after the trip's previous stop, or before the trip's next known stop when it is at the start of the trip.
+    Known stops are found by their position, so a trip that adds nothing takes time linear in its own stops. A trip that adds stops links them
+    between their neighbours, and the sequence and positions are rewritten once, in time linear in the sequence.
+
+    Args:
+        sequence: The ordered stop IDs known so far, modified in place
+        stop_ids: The stop IDs of a trip, in travel order
+        positions: The index of every stop ID in the sequence, modified in place with it. Built from the sequence when not given.
+
+    Returns:
+        True if any stop was added to the sequence
+    """
+    if positions is None:
+        positions = {stop_id: index for index, stop_id in enumerate(sequence)}
+    if all(stop_id in positions for stop_id in stop_ids):
+        return False
+    if not any(stop_id in positions for stop_id in stop_ids):
+        # Nothing to place the trip against, so its stops follow the known ones (a dict drops the repeats of a trip that loops back to its start)
+        for stop_id in dict.fromkeys(stop_ids):
+            positions[stop_id] = len(sequence)
+            sequence.append(stop_id)
+        return True
+
+    # The stop after and before each stop, so inserting one takes constant time
+    following = dict(zip(sequence, sequence[1:]))
+    preceding = dict(zip(sequence[1:], sequence))
+    first = sequence[0]
+    added = set()
+    previous = None
+    # Stops seen before the first known stop of the trip, a dict so a trip that loops back to its start adds them once
+    pending = {}
+    for stop_id in stop_ids:
+        if stop_id in positions or stop_id in added:
+            if pending:
+                # Stops seen before the first known stop of the trip come right before it
+                before = preceding.get(stop_id)
+                for pending_id in pending:
+                    if before is None:
+                        first = pending_id
+                    else:
+                        following[before] = pending_id
+                        preceding[pending_id] = before
+                    before = pending_id
+                following[before] = stop_id
+                preceding[stop_id] = before
+                added.update(pending)
+                pending = {}
+            previous = stop_id
+        elif previous is None:
+            pending[stop_id] = None
+        else:
+            after = following.get(previous)
+            following[previous] = stop_id
+            preceding[stop_id] = previous
+            if after is not None:
+                following[stop_id] = after
+                preceding[after] = stop_id
+            added.add(stop_id)
+            previous = stop_id
+
+    stop_id = first
+    sequence.clear()
+    while stop_id is not None:
+        positions[stop_id] = len(sequence)
+        sequence.append(stop_id)
+        stop_id = following.get(stop_id)
+    return True
+
+def _has_new_stops(trip: TripRecord, last_trip: TripRecord) -> bool:
+    """
+    Check whether a trip may contain stops not merged from the previous snapshot. A trip that only dropped stops it has passed adds nothing.
+    """
+    if last_trip is None or len(trip.stop_times) > len(last_trip.stop_times):
+        return True
+    offset = len(last_trip.stop_times) - len(trip.stop_times)
+    return any(stop.stop_id != last_stop.stop_id for stop, last_stop in zip(trip.stop_times, last_trip.stop_times[offset:]))
+
+def update_station_lists(feed_group: str, snapshot: FeedSnapshot, changes: ChangeSet) -> None:
+    """
+    Merge the new and changed trips of a newly published snapshot into the station sequences. Registered as a snapshot listener, so it runs on every fetch without fetching itself.
+
+    Args:
+        feed_group: The feed group of the snapshot
+        snapshot: The newly published FeedSnapshot
+        changes: The trips added, changed and removed since the previous snapshot of the group
+    """
+    updated_trips = [(trip, None) for trip in changes.added.values()] + [(new, old) for old, new in changes.changed.values()]
+    with _station_sequences_lock:
+        for trip, old_trip in updated_trips:
+            if not trip.stop_times or not _has_new_stops(trip, old_trip):
+                continue
+            key = (trip.route_id, trip.direction)
+            if key not in _station_sequences:
+                _station_sequences[key] = []
+                _station_positions[key] = {}
+            merge_stop_sequence(_station_sequences[key], [stop.stop_id for stop in trip.stop_times if stop.direction == trip.direction], _station_positions[key])
+
+def get_station_sequences(feed_group: str) -> dict[tuple[str, str], list[str]]:
+    """
+    Copy the merged station sequences of every line of a feed group, e.g. to publish them with the group's snapshot (see src/shared_snapshot.py).
+
+    Returns:
+        A dict with keys as (route_id, direction) and values as lists of directional stop IDs in travel order
+    """
+    route_ids = {mta_subway_fetcher.get_route_id(line) for line in mta_subway_fetcher.SUBWAY_LINE_LIST if mta_subway_fetcher.get_feed_group(line) == feed_group}
+    with _station_sequences_lock:
+        return {key: list(sequence) for key, sequence in _station_sequences.items() if key[0] in route_ids}
+
+def _sync_with_source(subway_line: str) -> None:
+    """
+    In a worker serving snapshots published by another process (see 'mta_subway_fetcher.set_snapshot_source'), no snapshot listener runs,
+    so copy the station sequences the publisher merged for the line's feed group whenever a new snapshot of it is published.
+    """
+    source = mta_subway_fetcher.get_snapshot_source()
+    if source is None:
+        return
+    feed_group = mta_subway_fetcher.get_feed_group(subway_line)
+    snapshot = source(feed_group)
+    if snapshot is None or _source_snapshots.get(feed_group) is snapshot:
+        return
+    sequences = getattr(snapshot, 'station_sequences', {})
+    with _station_sequences_lock:
+        for key, sequence in sequences.items():
+            _station_sequences[key] = list(sequence)
+            _station_positions[key] = {stop_id: index for index, stop_id in enumerate(sequence)}
+        _source_snapshots[feed_group] = snapshot
+
+def load_static_stations() -> dict[str, list[str]]:
+    """
+    Load the stations per line collected during regular weekday service, reading the file only on the first call.
+
+    Returns:
+        A dict of lists of strings, with keys as the names of subway lines and values as non-directional station IDs
+    """
+    global _static_stations
+    if _static_stations is None:
+        with open(STATIC_STATIONS_PATH, 'r') as f:
+            _static_stations = json.load(f)
+    return _static_stations
+
+def is_station_on_line(subway_line: str, station_id: str) -> bool:
+    """
+    Check whether a line stops at a station, either in regular service or on any trip merged from the live feeds (e.g., a reroute).
+
+    Args:
+        subway_line: The identifier for the subway line. Must match one of the values in SUBWAY_LINE_LIST.
+        station_id: The station ID, with or without direction suffix (e.g., '127' or '127S')
+
+    Returns:
+        True if the line stops at the station in either direction
+    """
+    if station_id[-1:] in ["N", "S"]:
+        station_id = station_id[:-1]
+    if station_id in load_static_stations().get(subway_line, []):
+        return True
+    _sync_with_source(subway_line)
+    route_id = mta_subway_fetcher.get_route_id(subway_line)
+    with _station_sequences_lock:
+        return any(f"{station_id}{direction}" in _station_positions.get((route_id, direction), {}) for direction in ["N", "S"])
+
+def get_station_list(subway_line: str, direction: str, refresh: bool=True) -> list[str]:
+    """
+    Return the stations of a line in travel order for one direction.
+    The list is built from live trips as snapshots are published. While it holds fewer than STATION_LIST_MIN_FRACTION of the line's regular service
+    stations (e.g., right after startup), the regular service stations are returned instead, in the travel order of the static timetable's trips.
+    Without a timetable (see setup/create_timetable_index.py), or for stations it does not schedule, they are ordered by station ID as an approximation.
+
+    Args:
+        subway_line: The identifier for the subway line. Must match one of the values in SUBWAY_LINE_LIST.
+        direction: 'N' for northbound or 'S' for southbound
+        refresh: Whether to make sure the line's feed group has a snapshot first, fetching it only if the cache has none fresh (True, default)
+
+    Returns:
+        station_ids: A list of directional station IDs (e.g., ['101S', '103S', ...])
+    """
+    if refresh:
+        mta_subway_fetcher.get_realtime_data(subway_line)
+    _sync_with_source(subway_line)
+    route_id = mta_subway_fetcher.get_route_id(subway_line)
+    with _station_sequences_lock:
+        station_ids = list(_station_sequences.get((route_id, direction), []))
+    static_station_ids = load_static_stations().get(subway_line, [])
+    if len(station_ids) < STATION_LIST_MIN_FRACTION * len(static_station_ids):
+        station_ids = [f"{station_id}{direction}" for station_id in sorted(static_station_ids, reverse=direction == "N")]
+        timetable = static_timetable.get_static_timetable()
+        if timetable is not None:
+            regular_station_ids = set(static_station_ids)
+            scheduled = {stop_id: None for stop_id in timetable.stop_order(route_id, direction) if stop_id[:-1] in regular_station_ids}
+            station_ids = list(scheduled) + [station_id for station_id in station_ids if station_id not in scheduled]
+    return station_ids
+
+
+mta_subway_fetcher.add_snapshot_listener(update_station_lists)
\ No newline at end of file
@@ -1,10 +1,22 @@
 from src.gtfsproto import nyct_subway_pb2
+from src.feed_records import FeedSnapshot, feedmessage_to_snapshot
+import src.metrics as metrics
+import src.snapshot_diff as snapshot_diff
+import src.arrival_index as arrival_index
 
-import requests
-from google.protobuf import json_format
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+# requests and json_format are imported where they are first used, since importing them takes longer than most queries answered from a warm cache
+if TYPE_CHECKING:
+    import requests
 
 # SUBWAY_BASE_URL -- The URL needed to make API calls for real-time subway line data. For subways other that the numbered lines and Grand Central shuttle, a suffix must be appended to this URL
-SUBWAY_BASE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs"
+# Set MTA_SUBWAY_BASE_URL to point at another server with the same paths, such as local_replay_server.py (e.g., "http://127.0.0.1:8081/Dataservice/mtagtfsfeeds/nyct%2Fgtfs")
+SUBWAY_BASE_URL = os.environ.get("MTA_SUBWAY_BASE_URL", "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs")
 
 # SUBWAY_LINE_URL_SUFFIX -- The string to append to SUBWAY_BASE_URL to pull real-time data for the given subway line
 SUBWAY_LINE_URL_SUFFIX = {
@@ -47,20 +59,163 @@ SHUTTLE_INTERNAL_MAPPING = {
 # SUBWAY_LINE_LIST -- All available subway lines converted to a list of strings
 SUBWAY_LINE_LIST = list(SUBWAY_LINE_URL_SUFFIX.keys())
 
+# FEED_GROUPS -- Every distinct feed group (URL suffix), each fetched from its own real-time feed URL
+FEED_GROUPS = list(dict.fromkeys(SUBWAY_LINE_URL_SUFFIX.values()))
 
-def api_to_bin(api_url: str) -> bytes:
+# FEED_CACHE_TTL_SECONDS -- How long a fetched feed is reused, counted from the timestamp in the feed header. The MTA refreshes its feeds roughly every 30 seconds
+FEED_CACHE_TTL_SECONDS = 30
+
+# FEED_CACHE_MIN_REFETCH_SECONDS -- The minimum time between two fetches of the same feed group, so a feed whose header timestamp is already older than the TTL is not refetched on every call
+FEED_CACHE_MIN_REFETCH_SECONDS = 5
+
+# FEED_CONNECT_TIMEOUT_SECONDS -- The number of seconds to wait for a connection to the MTA API
+FEED_CONNECT_TIMEOUT_SECONDS = 3.05
+
+# FEED_READ_TIMEOUT_SECONDS -- The number of seconds to wait between bytes of a feed response before giving up
+FEED_READ_TIMEOUT_SECONDS = 10
+
+# FEED_RETRY_ATTEMPTS -- The number of times a failed feed request is tried in total
+FEED_RETRY_ATTEMPTS = 3
+
+# FEED_RETRY_BACKOFF_SECONDS -- The wait before the first retry of a failed feed request, doubled for each later retry
+FEED_RETRY_BACKOFF_SECONDS = 0.5
+
+# FEED_REQUEST_DEADLINE_SECONDS -- The most time a fetch made while answering a request may take in total. Such fetches are tried once; retries are left to the poller.
+FEED_REQUEST_DEADLINE_SECONDS = 5
+
+# CIRCUIT_BREAKER_THRESHOLD -- The number of consecutive failed fetches of a feed group before requests to it are paused
+CIRCUIT_BREAKER_THRESHOLD = 3
+
+# CIRCUIT_BREAKER_COOLDOWN_SECONDS -- How long requests to a failing feed group are paused the first time, doubled each time it fails again after the pause, up to CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = 15
+CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS = 300
+
+# FEED_DECODE_PROCESSES -- The number of worker processes decoding feeds for full-network refreshes (see 'refresh_all_feed_groups'), so decoding does not hold the GIL of the
+# request-serving process. Each process that refreshes the whole network starts its own workers, so the default is capped at FEED_DECODE_MAX_DEFAULT_PROCESSES.
+# Set CATCH_A_RIDE_DECODE_PROCESSES to override; 0 or 1 decodes in the fetching threads instead.
+FEED_DECODE_MAX_DEFAULT_PROCESSES = 4
+FEED_DECODE_PROCESSES = int(os.environ.get("CATCH_A_RIDE_DECODE_PROCESSES", min(os.cpu_count() or 1, FEED_DECODE_MAX_DEFAULT_PROCESSES)))
+
+# _session -- The pooled keep-alive HTTP session shared by every feed request, created on first use
+_session = None
+_session_lock = threading.Lock()
+
+# _decode_pool -- The worker processes decoding feeds, started on first use by '_get_decode_pool'
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+# _circuit_breakers -- The failure state per feed group, stored as [consecutive_failures, times_opened, open_until, last_failed_at].
+# A group's state is only read or changed while holding its lock from '_get_feed_group_lock'.
+_circuit_breakers = {}
+
+# _feed_cache -- Process-wide cache of the latest feed per feed group (the values of SUBWAY_LINE_URL_SUFFIX), stored as (fetched_at, header_timestamp, snapshot)
+_feed_cache = {}
+
+# _feed_group_locks -- One lock per feed group, held around every fetch of the group, so concurrent requests for lines sharing a feed trigger a single fetch
+_feed_group_locks = {}
+_feed_group_locks_guard = threading.Lock()
+
+# _snapshot_listeners -- Functions called with (feed_group, snapshot, changes) each time a new snapshot is published, registered with 'add_snapshot_listener'
+_snapshot_listeners = []
+
+# _feed_recorder -- An optional FeedRecorder (see src/feed_recorder.py) saving the raw bytes of every fetched feed, set with 'set_feed_recorder'
+_feed_recorder = None
+
+# _snapshot_source -- An optional callable returning the snapshot of a feed group published by another process (see src/shared_snapshot.py), set with 'set_snapshot_source'. When set, feeds are never fetched.
+_snapshot_source = None
+
+# _polled_feed_groups -- Feed groups kept up to date by a background poller (see src/feed_poller.py). Requests for these groups are served from the cache without fetching
+_polled_feed_groups = set()
+
+# FETCH_SECONDS, FETCH_BYTES, DECODE_SECONDS -- Per feed group histograms of download time (including retries), download size and decode time, exposed at /metrics
+FETCH_SECONDS = metrics.register(metrics.Histogram('catch_a_ride_fetch_seconds', 'Time to download a feed from the API, including retries.', ('feed_group',)))
+FETCH_BYTES = metrics.register(metrics.Histogram('catch_a_ride_fetch_bytes', 'Size of downloaded feeds in bytes.', ('feed_group',), metrics.SIZE_BUCKETS_BYTES))
+DECODE_SECONDS = metrics.register(metrics.Histogram('catch_a_ride_decode_seconds', 'Time to decode a feed into a snapshot.', ('feed_group',)))
+
+# UPSTREAM_ERRORS -- Failed feed fetches per feed group, by reason: 'fetch' (no response after retries), 'decode' (invalid protobuf) or 'circuit_open' (skipped while paused)
+UPSTREAM_ERRORS = metrics.register(metrics.Counter('catch_a_ride_upstream_errors_total', 'Failed feed fetches by reason.', ('feed_group', 'reason')))
+
+# FEED_CACHE_REQUESTS -- Requests for feed data per feed group, by result: 'hit' (served from the cache), 'miss' (fetched) or 'stale' (fetch failed, last snapshot served)
+FEED_CACHE_REQUESTS = metrics.register(metrics.Counter('catch_a_ride_feed_cache_requests_total', 'Requests for feed data by cache result.', ('feed_group', 'result')))
+
+
+def get_session() -> 'requests.Session':
+    """
+    Return the HTTP session shared by every feed request, creating it on first use.
+    The session keeps connections to the MTA API alive between fetches and asks for gzip-compressed responses.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(FEED_GROUPS), pool_maxsize=len(FEED_GROUPS))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _session = session
+        return _session
+
+def api_to_bin(api_url: str, attempts: int=FEED_RETRY_ATTEMPTS, deadline: float=None) -> bytes:
     """
     Return the content of the API call in bytes, the format needed for protobuf-encoded data.
+    Failed requests are retried up to 'attempts' times with exponential backoff.
 
     Args:
         api_url: The API endpoint to collect real-time transit data
+        attempts: The number of times to try the request in total
+        deadline: The most seconds to spend on every attempt together, including the backoff and a slow download. Defaults to no limit besides the timeouts.
     
     Returns:
-        r.content: The byte stream response from the API call
+        r.content: The byte stream response from the API call, or None if every attempt failed
     """
+    import requests
+    import urllib3
+    session = get_session()
+    give_up_at = time.monotonic() + deadline if deadline is not None else None
+    for attempt in range(attempts):
+        if attempt:
+            backoff = FEED_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            if give_up_at is not None and time.monotonic() + backoff >= give_up_at:
+                break
+            time.sleep(backoff)
+        timeout = (FEED_CONNECT_TIMEOUT_SECONDS, FEED_READ_TIMEOUT_SECONDS)
+        if give_up_at is not None:
+            remaining = give_up_at - time.monotonic()
+            timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+        try:
+            with session.get(url=api_url, timeout=timeout, stream=True) as r:
+                r.raise_for_status()
+                if give_up_at is None:
+                    return r.content
+                return _read_before(r, give_up_at)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            print(f"Error fetching {api_url} (attempt {attempt + 1} of {attempts}): {e}")
+    return None
 
-    r = requests.get(url=api_url)
-    return r.content
+def _read_before(response: 'requests.Response', give_up_at: float) -> bytes:
+    """
+    Read the body of a streamed response, giving up at a monotonic time even if the server keeps sending slowly.
+    Each read waits on the socket for at most the time left, rather than the full read timeout.
+
+    Args:
+        response: A requests.Response of a request made with stream=True
+        give_up_at: The time.monotonic() value to give up at
+    """
+    import requests
+    chunks = []
+    while True:
+        remaining = give_up_at - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout("Download did not finish before the deadline")
+        connection = response.raw.connection
+        if connection is not None and connection.sock is not None:
+            connection.sock.settimeout(remaining)
+        chunk = response.raw.read1(65536, decode_content=True)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
 
 def bin_to_feedmessage(indata: bytes) -> dict:
     """
@@ -77,26 +232,445 @@ def bin_to_feedmessage(indata: bytes) -> dict:
             }
     """
 
+    from google.protobuf import json_format
     pb_data = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage() # Create an object for the incoming message feed type 
     pb_data.ParseFromString(indata) # Decode the input message
     message_dict = json_format.MessageToDict(pb_data) # Translate the message to a Python-readable dictionary
     return message_dict
 
-def get_realtime_data(subway_line: str) -> dict:
+def bin_to_snapshot(indata: bytes, feed_group: str='', previous: FeedSnapshot=None) -> FeedSnapshot:
+    """
+    Translate the protobuf-encoded data feed to compact arrival records, without building the intermediate dict of bin_to_feedmessage.
+
+    Args:
+        indata: A stream of Protocol Buffer data collected from the MTA's real-time feed.
+        feed_group: The feed group the data was fetched for (a value of SUBWAY_LINE_URL_SUFFIX)
+        previous: The previous snapshot of the feed group, whose records are reused for trips that did not change
+
+    Returns:
+        snapshot: A FeedSnapshot with the trips and vehicle positions of the feed, keyed by trip ID
+    """
+    pb_data = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    pb_data.ParseFromString(indata)
+    snapshot = feedmessage_to_snapshot(pb_data, feed_group, previous)
+    return snapshot
+
+def _get_decode_pool() -> ProcessPoolExecutor:
+    """
+    Return the worker processes decoding feeds, starting them on first use, or None when FEED_DECODE_PROCESSES is under 2.
+    Workers are started from a clean server process rather than forked from this one, since the poller and web server threads may hold locks at fork time.
+    """
+    global _decode_pool
+    if FEED_DECODE_PROCESSES < 2:
+        return None
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _decode_pool = ProcessPoolExecutor(FEED_DECODE_PROCESSES, mp_context=multiprocessing.get_context(start_method))
+        return _decode_pool
+
+def _decode_feed(indata: bytes, feed_group: str) -> FeedSnapshot:
+    """
+    Decode a feed in a worker process. The snapshot is sent back pickled as the constructor arguments of its records (see FeedSnapshot.__reduce__).
+    """
+    return bin_to_snapshot(indata, feed_group)
+
+def get_feed_group(subway_line: str) -> str:
+    """
+    Find the feed group for a subway line. Lines in the same feed group share one real-time feed URL.
+
+    Args:
+        subway_line: The identifier for the subway line. Must match one of the values in SUBWAY_LINE_LIST.
+
+    Returns:
+        feed_group: The URL suffix shared by every line in the group (e.g., '-ace' for the A/C/E/Sr trains, '' for the numbered lines)
+    """
+    return SUBWAY_LINE_URL_SUFFIX[subway_line]
+
+def get_route_id(subway_line: str) -> str:
+    """
+    Find the route ID used in the real-time feed for a subway line.
+
+    Args:
+        subway_line: The identifier for the subway line. Must match one of the values in SUBWAY_LINE_LIST.
+
+    Returns:
+        route_id: The route ID of the line (e.g., 'GS' for the 'S' 42 St Shuttle, '1' for the '1' train)
+    """
+    return SHUTTLE_INTERNAL_MAPPING.get(subway_line, subway_line)
+
+def _get_feed_group_lock(feed_group: str) -> threading.Lock:
+    """
+    Return the lock guarding fetches for a feed group, creating it on first use.
+    """
+    with _feed_group_locks_guard:
+        if feed_group not in _feed_group_locks:
+            _feed_group_locks[feed_group] = threading.Lock()
+        return _feed_group_locks[feed_group]
+
+def _is_fresh(cache_entry: tuple, ttl: float, now: float) -> bool:
+    """
+    Check whether a cached feed can still be served.
+
+    Args:
+        cache_entry: A value of _feed_cache, as (fetched_at, header_timestamp, snapshot)
+        ttl: The number of seconds a feed stays fresh after the timestamp in its header
+        now: The current epoch time
+
+    Returns:
+        True if the cached feed has not expired
+    """
+    fetched_at, header_timestamp, _ = cache_entry
+    # The header timestamp is when the MTA generated the feed, so a newer feed is expected ttl seconds later. Cap it by the
+    # fetch time in case of clock skew, and never refetch sooner than FEED_CACHE_MIN_REFETCH_SECONDS if upstream is lagging
+    expires_at = min(header_timestamp, fetched_at) + ttl
+    expires_at = max(expires_at, fetched_at + min(ttl, FEED_CACHE_MIN_REFETCH_SECONDS))
+    return now < expires_at
+
+def feed_group_name(feed_group: str) -> str:
+    """
+    Return a readable name for a feed group, for logs and status output.
+
+    Args:
+        feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+
+    Returns:
+        The suffix without its leading dash (e.g., 'ace'), or 'numbered' for the 1/2/3/4/5/6/7/S feed
+    """
+    return feed_group.lstrip('-') or 'numbered'
+
+def _circuit_is_open(feed_group: str, now: float) -> bool:
+    """
+    Check whether requests to a feed group are paused after repeated failures.
+    """
+    breaker = _circuit_breakers.get(feed_group)
+    return breaker is not None and now < breaker[2]
+
+def _recently_failed(feed_group: str, now: float) -> bool:
+    """
+    Check whether the last fetch of a feed group failed less than FEED_CACHE_MIN_REFETCH_SECONDS ago, so requests waiting on it serve the stale snapshot instead of fetching again.
+    """
+    breaker = _circuit_breakers.get(feed_group)
+    return breaker is not None and now - breaker[3] < FEED_CACHE_MIN_REFETCH_SECONDS
+
+def _record_fetch_result(feed_group: str, success: bool, now: float) -> None:
+    """
+    Update the circuit breaker of a feed group after a fetch. A success closes the breaker, and a failure past CIRCUIT_BREAKER_THRESHOLD opens it with an exponentially growing cooldown.
+    """
+    if success:
+        _circuit_breakers.pop(feed_group, None)
+        return
+    breaker = _circuit_breakers.setdefault(feed_group, [0, 0, 0.0, 0.0])
+    breaker[3] = time.time()
+    breaker[0] += 1
+    if breaker[0] >= CIRCUIT_BREAKER_THRESHOLD:
+        cooldown = min(CIRCUIT_BREAKER_COOLDOWN_SECONDS * 2 ** breaker[1], CIRCUIT_BREAKER_MAX_COOLDOWN_SECONDS)
+        breaker[1] += 1
+        breaker[2] = now + cooldown
+        print(f"Pausing requests to feed group '{feed_group_name(feed_group)}' for {cooldown} seconds after {breaker[0]} failed fetches")
+
+def fetch_feed_group(feed_group: str, parallel: bool=False, deadline: float=None) -> FeedSnapshot:
+    """
+    Fetch and decode the real-time feed of a feed group, bypassing the cache.
+    If the fetch fails, or the feed group's circuit breaker is open, the cached snapshot of the group (if any) is marked as stale.
+    When a snapshot source is set (see 'set_snapshot_source'), the latest snapshot published by the source is returned instead.
+    Callers hold the feed group's lock from '_get_feed_group_lock', which also guards its circuit breaker.
+
+    Args:
+        feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+        parallel: Whether to decode in a worker process (see FEED_DECODE_PROCESSES) instead of the calling thread. Records of the cached snapshot
+            are then not reused, since they would have to be sent to the worker.
+        deadline: The most seconds the download may take, for fetches made while answering a request, which are tried once.
+            Defaults to retrying up to FEED_RETRY_ATTEMPTS times, as the poller does.
+
+    Returns:
+        snapshot: A FeedSnapshot of the feed, or None if the feed could not be fetched or decoded
+    """
+    if _snapshot_source is not None:
+        return _snapshot_source(feed_group)
+    now = time.time()
+    group_name = feed_group_name(feed_group)
+    if _circuit_is_open(feed_group, now):
+        UPSTREAM_ERRORS.inc(feed_group=group_name, reason='circuit_open')
+        snapshot = None
+    else:
+        subway_realtime_api = f'{SUBWAY_BASE_URL}{feed_group}'
+        with FETCH_SECONDS.time(feed_group=group_name):
+            if deadline is not None:
+                realtime_data = api_to_bin(subway_realtime_api, 1, deadline)
+            else:
+                realtime_data = api_to_bin(subway_realtime_api)
+        snapshot = None
+        if realtime_data is None:
+            UPSTREAM_ERRORS.inc(feed_group=group_name, reason='fetch')
+        else:
+            FETCH_BYTES.observe(len(realtime_data), feed_group=group_name)
+            try:
+                decode_pool = _get_decode_pool() if parallel else None
+                with DECODE_SECONDS.time(feed_group=group_name):
+                    if decode_pool is not None:
+                        snapshot = decode_pool.submit(_decode_feed, realtime_data, feed_group).result()
+                    else:
+                        snapshot = bin_to_snapshot(realtime_data, feed_group, get_cached_snapshot(feed_group))
+            except Exception as e:
+                print(f"Error decoding feed group '{group_name}': {e}")
+                UPSTREAM_ERRORS.inc(feed_group=group_name, reason='decode')
+        _record_fetch_result(feed_group, snapshot is not None, now)
+        if snapshot is not None and _feed_recorder is not None:
+            try:
+                _feed_recorder.record(feed_group, snapshot.timestamp, realtime_data)
+            except Exception as e:
+                print(f"Error recording feed group '{group_name}': {e}")
+    if snapshot is None:
+        cached_snapshot = get_cached_snapshot(feed_group)
+        if cached_snapshot is not None:
+            cached_snapshot.stale = True
+    return snapshot
+
+def refresh_feed_group(feed_group: str) -> FeedSnapshot:
+    """
+    Fetch a feed group while holding its lock, retrying as the poller does, and publish the new snapshot.
+
+    Args:
+        feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+
+    Returns:
+        snapshot: The published FeedSnapshot, or None if the feed could not be fetched or decoded
+    """
+    with _get_feed_group_lock(feed_group):
+        snapshot = fetch_feed_group(feed_group)
+        if snapshot is not None:
+            publish_snapshot(feed_group, snapshot)
+        return snapshot
+
+def refresh_all_feed_groups(feed_groups: list[str]=None, ttl: float=0) -> dict[str, FeedSnapshot]:
+    """
+    Fetch every feed group once, concurrently, decode them in parallel worker processes, and publish the new snapshots.
+    Used for full-network operations, which would otherwise fetch and decode one group after another on a single core.
+
+    Args:
+        feed_groups: The feed groups to refresh. Defaults to every group in FEED_GROUPS.
+        ttl: Groups with a cached snapshot fresh for this many seconds (as in 'get_realtime_data'), or kept up to date by a poller, are served from the cache instead.
+            Defaults to 0, refreshing every group; None uses FEED_CACHE_TTL_SECONDS.
+
+    Returns:
+        snapshots: A dict with keys as feed groups and values as their latest FeedSnapshot: the new one, or the cached stale one if the refresh failed.
+            Groups with neither are left out.
+    """
+    if feed_groups is None:
+        feed_groups = FEED_GROUPS
+    feed_groups = list(dict.fromkeys(feed_groups))
+    if ttl is None:
+        ttl = FEED_CACHE_TTL_SECONDS
+
+    def refresh(feed_group):
+        cache_entry = _feed_cache.get(feed_group)
+        if ttl and cache_entry and (feed_group in _polled_feed_groups or _is_fresh(cache_entry, ttl, time.time())):
+            FEED_CACHE_REQUESTS.inc(feed_group=feed_group_name(feed_group), result='hit')
+            return cache_entry[2]
+        with _get_feed_group_lock(feed_group):
+            snapshot = fetch_feed_group(feed_group, parallel=True)
+            if snapshot is not None and _snapshot_source is None:
+                publish_snapshot(feed_group, snapshot)
+            return snapshot
+
+    snapshots = {}
+    with ThreadPoolExecutor(max_workers=len(feed_groups) or 1) as executor:
+        for feed_group, snapshot in zip(feed_groups, executor.map(refresh, feed_groups)):
+            if snapshot is None:
+                snapshot = get_cached_snapshot(feed_group)
+            if snapshot is not None:
+                snapshots[feed_group] = snapshot
+    return snapshots
+
+def publish_snapshot(feed_group: str, snapshot: FeedSnapshot) -> None:
+    """
+    Make a snapshot the one served for its feed group, and pass it to every snapshot listener along with what changed since the previous snapshot.
+    The arrival index of the snapshot is updated from the previous one for only the changed trips, or built in full for the first snapshot of the group.
+
+    Args:
+        feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+        snapshot: The newly fetched FeedSnapshot for the group
+    """
+    previous = get_cached_snapshot(feed_group)
+    changes = snapshot_diff.diff_snapshots(previous, snapshot)
+    if snapshot.arrival_index is None:
+        if previous is not None and previous.arrival_index is not None:
+            snapshot.arrival_index = arrival_index.update_arrival_index(previous.arrival_index, changes)
+        else:
+            arrival_index.get_arrival_index(snapshot)
+    _feed_cache[feed_group] = (time.time(), snapshot.timestamp, snapshot)
+    for listener in list(_snapshot_listeners):
+        try:
+            listener(feed_group, snapshot, changes)
+        except Exception as e:
+            print(f"Error in snapshot listener {getattr(listener, '__name__', listener)}: {e}")
+
+def set_feed_recorder(recorder) -> None:
+    """
+    Save the raw bytes of every successfully decoded feed with a recorder.
+
+    Args:
+        recorder: A FeedRecorder, or None to stop recording
+    """
+    global _feed_recorder
+    _feed_recorder = recorder
+
+def set_snapshot_source(source) -> None:
+    """
+    Serve every feed group from snapshots published by another process instead of fetching feeds, so worker processes share one poller.
+
+    Snapshots from a source are served as they are: they are not diffed or passed to snapshot listeners, which run in the publishing process.
+    Modules keeping derived state read it from the source instead (see 'get_snapshot_source').
+
+    Args:
+        source: A callable taking a feed group and returning its latest FeedSnapshot or None (e.g., a shared_snapshot.SharedSnapshotReader), or None to fetch feeds again
+    """
+    global _snapshot_source
+    _snapshot_source = source
+
+def get_snapshot_source():
+    """
+    Return the callable set with 'set_snapshot_source', or None when this process fetches and publishes feeds itself.
+    """
+    return _snapshot_source
+
+def add_snapshot_listener(listener) -> None:
+    """
+    Register a function to be called with (feed_group, snapshot, changes) each time a new snapshot is published, from the thread that published it.
+    Listeners keep derived state (e.g., station lists) up to date without fetching feeds themselves, applying only the trips in the ChangeSet.
+
+    Args:
+        listener: A callable taking a feed group, a FeedSnapshot and a snapshot_diff.ChangeSet
+    """
+    if listener not in _snapshot_listeners:
+        _snapshot_listeners.append(listener)
+
+def remove_snapshot_listener(listener) -> None:
+    """
+    Stop calling a function registered with 'add_snapshot_listener'.
+    """
+    if listener in _snapshot_listeners:
+        _snapshot_listeners.remove(listener)
+
+def get_cached_snapshot(feed_group: str) -> FeedSnapshot:
+    """
+    Return the latest published snapshot of a feed group without fetching, fresh or not.
+
+    Args:
+        feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+
+    Returns:
+        The cached FeedSnapshot, or None if the group has never been fetched
+    """
+    cache_entry = _feed_cache.get(feed_group)
+    return cache_entry[2] if cache_entry else None
+
+def get_snapshot_ages(now: float=None) -> dict[str, float]:
+    """
+    Measure how old the cached snapshot of each feed group is, from the timestamp in its feed header.
+
+    Args:
+        now: The epoch time to measure against. Defaults to the current time.
+
+    Returns:
+        snapshot_ages: A dict with keys as feed groups and values as the age of their snapshot in seconds. Groups never fetched are omitted.
+    """
+    if now is None:
+        now = time.time()
+    snapshot_ages = {feed_group: now - header_timestamp for feed_group, (_, header_timestamp, _) in list(_feed_cache.items())}
+    return snapshot_ages
+
+def set_polled(feed_group: str, polled: bool) -> None:
+    """
+    Mark whether a background poller keeps a feed group up to date. Requests for polled groups never fetch once a snapshot has been published.
+
+    Args:
+        feed_group: A value of SUBWAY_LINE_URL_SUFFIX
+        polled: True when a poller starts refreshing the group, False when it stops
+    """
+    if polled:
+        _polled_feed_groups.add(feed_group)
+    else:
+        _polled_feed_groups.discard(feed_group)
+
+def clear_feed_cache() -> None:
+    """
+    Drop every cached feed, forcing the next request for each feed group to fetch from the API.
+    """
+    _feed_cache.clear()
+
+def get_realtime_data(subway_line: str, ttl: float=None, as_dict: bool=False) -> FeedSnapshot | dict:
     """
     Collect real-time subway data for the given line group.
+    Feeds are cached per feed group for the whole process, so requests for lines sharing a feed (e.g., '1' and '2') reuse a single fetch.
+    Feed groups refreshed by a background poller are always served from the cache once their first snapshot is published.
+    Otherwise a fetch is tried once within FEED_REQUEST_DEADLINE_SECONDS, and requests that waited on a fetch that failed are answered from the cache without fetching again.
 
     Args:
         subway_line: The identifier for the subway lines to be fetched. Must match one of the values in SUBWAY_LINE_LIST.
+        ttl: The number of seconds a cached feed stays fresh after the timestamp in its header. Defaults to FEED_CACHE_TTL_SECONDS, and 0 always fetches.
+        as_dict: Whether to return the full MessageToDict output of bin_to_feedmessage instead of a FeedSnapshot. Intended for debugging; always fetches and is never cached.
 
     Returns:
-        message_data: A dictionary of real-time subway details. Note that in most cases, the output will contain data unrelated to the request (e.g., input '1' will contain data for the 1/2/3/4/5/6/7/S trains)
+        snapshot: A FeedSnapshot of real-time subway details. Note that in most cases, the output will contain data unrelated to the request (e.g., input '1' will contain data for the 1/2/3/4/5/6/7/S trains)
+            The snapshot is shared with other callers through the cache and must not be modified.
+            If the feed cannot be fetched, the last good snapshot is returned with its 'stale' attribute set, or None if there is none.
     """
     try:
-        subway_realtime_api= f'{SUBWAY_BASE_URL}{SUBWAY_LINE_URL_SUFFIX[subway_line]}'
+        feed_group = get_feed_group(subway_line)
     except Exception as e:
         print(f"Error locating subway group: {e}")
         return None
-    realtime_data = api_to_bin(subway_realtime_api)
-    message_data = bin_to_feedmessage(realtime_data)
-    return message_data
+    if as_dict:
+        realtime_data = api_to_bin(f'{SUBWAY_BASE_URL}{feed_group}')
+        return bin_to_feedmessage(realtime_data) if realtime_data is not None else None
+    if ttl is None:
+        ttl = FEED_CACHE_TTL_SECONDS
+
+    group_name = feed_group_name(feed_group)
+    if _snapshot_source is not None:
+        snapshot = _snapshot_source(feed_group)
+        cache_entry = _feed_cache.get(feed_group)
+        if snapshot is not None and (cache_entry is None or cache_entry[2] is not snapshot):
+            # The publishing process already ran the listeners, so the snapshot is only cached for status and metrics
+            _feed_cache[feed_group] = (time.time(), snapshot.timestamp, snapshot)
+        FEED_CACHE_REQUESTS.inc(feed_group=group_name, result='hit' if snapshot is not None and not snapshot.stale else 'stale')
+        return snapshot
+    cache_entry = _feed_cache.get(feed_group)
+    if cache_entry and (feed_group in _polled_feed_groups or _is_fresh(cache_entry, ttl, time.time())):
+        FEED_CACHE_REQUESTS.inc(feed_group=group_name, result='hit')
+        return cache_entry[2]
+
+    with _get_feed_group_lock(feed_group):
+        # Another request may have refreshed this feed group while waiting on the lock, or just failed to
+        cache_entry = _feed_cache.get(feed_group)
+        if cache_entry and _is_fresh(cache_entry, ttl, time.time()):
+            FEED_CACHE_REQUESTS.inc(feed_group=group_name, result='hit')
+            return cache_entry[2]
+        if _recently_failed(feed_group, time.time()):
+            FEED_CACHE_REQUESTS.inc(feed_group=group_name, result='stale')
+            return cache_entry[2] if cache_entry else None
+        snapshot = fetch_feed_group(feed_group, deadline=FEED_REQUEST_DEADLINE_SECONDS)
+        if snapshot is None:
+            # Serve the last good snapshot, already marked stale by fetch_feed_group, rather than nothing
+            FEED_CACHE_REQUESTS.inc(feed_group=group_name, result='stale')
+            return cache_entry[2] if cache_entry else None
+        FEED_CACHE_REQUESTS.inc(feed_group=group_name, result='miss')
+        publish_snapshot(feed_group, snapshot)
+    return snapshot
+
+def _cache_hit_ratios() -> dict[tuple, float]:
+    """
+    Compute the fraction of feed requests answered from the cache per feed group, for the hit ratio gauge.
+    """
+    requests_per_group = {}
+    for (group_name, result), count in FEED_CACHE_REQUESTS.values().items():
+        hits, total = requests_per_group.get(group_name, (0, 0))
+        requests_per_group[group_name] = (hits + (count if result == 'hit' else 0), total + count)
+    return {(group_name,): hits / total for group_name, (hits, total) in requests_per_group.items() if total}
+
+# SNAPSHOT_AGE, FEED_CACHE_HIT_RATIO -- Gauges computed when /metrics is rendered
+SNAPSHOT_AGE = metrics.register(metrics.Gauge('catch_a_ride_snapshot_age_seconds', 'Age of the latest snapshot per feed group, from its feed header timestamp.', ('feed_group',),
+                                              lambda: {(feed_group_name(feed_group),): age for feed_group, age in get_snapshot_ages().items()}))
+FEED_CACHE_HIT_RATIO = metrics.register(metrics.Gauge('catch_a_ride_feed_cache_hit_ratio', 'Fraction of feed requests answered from the cache.', ('feed_group',), _cache_hit_ratios))
@@ -0,0 +1,140 @@
+import src.alert_store as alert_store
+import src.metrics as metrics
+from src.feed_records import FeedSnapshot
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+# RESPONSE_CACHE_MAX_ENTRIES -- The number of rendered responses kept before the least recently used is evicted
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+
+# RESPONSE_CACHE_BUCKET_SECONDS -- The length of a time bucket, the longest a response is reused. Responses with arrivals end sooner, when a minute count changes (see 'next_minute_change').
+RESPONSE_CACHE_BUCKET_SECONDS = 60
+
+# RESPONSE_MAX_AGE_SECONDS -- The longest time a client may reuse a response without revalidating, so new snapshots are picked up before the response ends
+RESPONSE_MAX_AGE_SECONDS = 15
+
+# RESPONSE_CACHE_REQUESTS -- Lookups of rendered responses by result ('hit' or 'miss'), exposed at /metrics
+RESPONSE_CACHE_REQUESTS = metrics.register(metrics.Counter('catch_a_ride_response_cache_requests_total', 'Lookups of rendered responses by cache result.', ('endpoint', 'result')))
+
+
+class CachedResponse:
+    """
+    A rendered response body with its validator.
+
+    Attributes:
+        body: The encoded response body
+        mimetype: The mimetype of the body
+        etag: A strong ETag derived from the body, without quotes
+        expires: The epoch time the response stops being valid: the end of its time bucket, or sooner when a minute count in it changes
+    """
+    __slots__ = ('body', 'mimetype', 'etag', 'expires')
+
+    def __init__(self, body: bytes, mimetype: str, expires: int):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.expires = expires
+
+    def max_age(self, current_time: int) -> int:
+        """
+        Return the Cache-Control max-age for the response at a time: until it expires, at most RESPONSE_MAX_AGE_SECONDS.
+        """
+        return max(0, min(self.expires - current_time, RESPONSE_MAX_AGE_SECONDS))
+
+
+def time_bucket(current_time: int) -> int:
+    """
+    Return the time bucket of an epoch time, e.g. the minute since the epoch.
+    """
+    return current_time // RESPONSE_CACHE_BUCKET_SECONDS
+
+def next_minute_change(arrival_times: list[int], current_time: int) -> int:
+    """
+    Find when a response listing arrivals in whole minutes first changes: when the minutes until one of them drop (the count is rounded down,
+    so it drops a second past each whole minute before the arrival), or when one arrives and leaves the list.
+
+    Args:
+        arrival_times: The arrival epoch times in the response, all after current_time
+        current_time: The epoch time the response was rendered at
+
+    Returns:
+        The first epoch time at which the response is out of date, at most the end of its time bucket
+    """
+    expires = (time_bucket(current_time) + 1) * RESPONSE_CACHE_BUCKET_SECONDS
+    for arrival in arrival_times:
+        expires = min(expires, arrival, current_time + 1 + (arrival - current_time) % 60)
+    return expires
+
+def snapshot_version(snapshot: FeedSnapshot) -> tuple:
+    """
+    Identify a snapshot for cache keys: its feed header timestamp, and whether it has gone stale since being cached. None when there is no snapshot.
+    """
+    if snapshot is None:
+        return None
+    return (snapshot.feed_group, snapshot.timestamp, snapshot.stale)
+
+
+class ResponseCache:
+    """
+    A bounded LRU cache of rendered responses, keyed by the query, the version of the snapshot answering it and the version of the alert store.
+    An expired response is rendered again under its key. Entries for old snapshots or alerts are never requested again and age out through eviction.
+
+    Args:
+        max_entries: The number of responses kept before the least recently used is evicted
+    """
+
+    def __init__(self, max_entries: int=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_render(self, endpoint: str, query: tuple, snapshot: FeedSnapshot, current_time: int, render, mimetype: str='application/json') -> CachedResponse:
+        """
+        Return the cached response for a query, rendering and storing it on a miss.
+
+        Args:
+            endpoint: The name of the endpoint, part of the key and the metric labels
+            query: A hashable tuple of the query's options
+            snapshot: The FeedSnapshot the response is answered from, or None
+            current_time: An integer representing the current epoch time
+            render: A callable returning the response body as a str or bytes, or a (body, expires) tuple for a response that stops being valid
+                before the end of the time bucket (e.g., from 'next_minute_change'). Called without holding the cache lock.
+            mimetype: The mimetype of the body
+
+        Returns:
+            The CachedResponse
+        """
+        key = (endpoint, query, snapshot_version(snapshot), alert_store.get_version())
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and current_time < cached.expires:
+                self._entries.move_to_end(key)
+            else:
+                cached = None
+        if cached is not None:
+            RESPONSE_CACHE_REQUESTS.inc(endpoint=endpoint, result='hit')
+            return cached
+        RESPONSE_CACHE_REQUESTS.inc(endpoint=endpoint, result='miss')
+        body = render()
+        if isinstance(body, tuple):
+            body, expires = body
+        else:
+            expires = (time_bucket(current_time) + 1) * RESPONSE_CACHE_BUCKET_SECONDS
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        cached = CachedResponse(body, mimetype, expires)
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,326 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.mta_stops_to_stations as mta_stops_to_stations
+import src.arrival_index as arrival_index
+import src.arrival_history as arrival_history
+import src.feed_poller as feed_poller
+from src.feed_records import FeedSnapshot
+
+import argparse
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+# SHARED_SNAPSHOT_PATH -- The default directory for published arrival snapshots. /dev/shm keeps them in memory where it exists.
+SHARED_SNAPSHOT_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'catch-a-ride')
+
+# SHARED_SNAPSHOT_MAGIC -- The first bytes of a published snapshot file, including the format version
+SHARED_SNAPSHOT_MAGIC = b'CARSHM03'
+
+# SHARED_SNAPSHOT_SUFFIX -- The file name suffix of a published snapshot, after the feed group name (e.g., 'ace.arrivals')
+SHARED_SNAPSHOT_SUFFIX = '.arrivals'
+
+# SHARED_SNAPSHOT_CHECK_SECONDS -- How often a worker checks whether a newer snapshot was published for a feed group
+SHARED_SNAPSHOT_CHECK_SECONDS = 1.0
+
+# SHARED_SNAPSHOT_STALE_SECONDS -- How long after its publication a snapshot is served as stale, e.g. when the publisher has stopped
+SHARED_SNAPSHOT_STALE_SECONDS = 120
+
+# KEY_WIDTH -- The fixed width in bytes of each (route_id, stop_id) key, stored as 'route_id\0stop_id' padded with zero bytes
+KEY_WIDTH = 16
+
+# RECORD_SECTIONS -- The records published after the arrivals, each pickled on its own so a worker only loads the ones it uses
+RECORD_SECTIONS = ('trips', 'vehicles', 'alerts', 'station_sequences')
+
+# _HEADER -- Magic, version, feed header timestamp, publication time, key count, then the offset of each of RECORD_SECTIONS and of the end of the file.
+# The key table, offsets and arrivals follow, all 8-byte aligned, then the record sections.
+_HEADER = struct.Struct(f'<8sQQdQ{len(RECORD_SECTIONS) + 1}Q')
+
+
+def _encode_key(route_id: str, stop_id: str) -> bytes:
+    """
+    Encode a (route_id, stop_id) key for the key table.
+
+    Raises:
+        ValueError: If the key does not fit KEY_WIDTH
+    """
+    key = f"{route_id}\0{stop_id}".encode('utf-8')
+    if len(key) > KEY_WIDTH:
+        raise ValueError(f"Key ({route_id!r}, {stop_id!r}) is longer than {KEY_WIDTH} bytes")
+    return key.ljust(KEY_WIDTH, b'\0')
+
+def snapshot_path(directory: str, feed_group: str) -> str:
+    """
+    Return the path of the published snapshot of a feed group.
+    """
+    return os.path.join(directory, mta_subway_fetcher.feed_group_name(feed_group) + SHARED_SNAPSHOT_SUFFIX)
+
+def write_snapshot(path: str, snapshot: FeedSnapshot, version: int, station_sequences: dict=None) -> None:
+    """
+    Write the arrival index and the records of a snapshot to a file, replacing the previous version atomically.
+    Workers that mapped the previous version keep reading it until they next check for a new one.
+
+    Args:
+        path: The path of the snapshot file, from 'snapshot_path'
+        snapshot: A FeedSnapshot, whose arrival index is built if it has none
+        version: The version number of this snapshot, increasing with each write
+        station_sequences: The station lists merged from the feed group's trips (see 'mta_stops_to_stations.get_station_sequences'), so workers need not merge them
+
+    Raises:
+        ValueError: If a (route_id, stop_id) key of the arrival index does not fit KEY_WIDTH. Nothing is written.
+    """
+    index = arrival_index.get_arrival_index(snapshot)
+    keys = sorted((_encode_key(route_id, stop_id), times) for (route_id, stop_id), times in index.items())
+    offsets = [0]
+    for _, times in keys:
+        offsets.append(offsets[-1] + len(times))
+    # Records are pickled as the constructor arguments of their classes (see TripRecord.__reduce__), after the arrivals
+    records = {'trips': snapshot.trips, 'vehicles': snapshot.vehicles, 'alerts': snapshot.alerts, 'station_sequences': station_sequences or {}}
+    sections = [pickle.dumps(records[name], pickle.HIGHEST_PROTOCOL) for name in RECORD_SECTIONS]
+    section_offsets = [_HEADER.size + len(keys) * KEY_WIDTH + 8 * len(offsets) + 8 * offsets[-1]]
+    for section in sections:
+        section_offsets.append(section_offsets[-1] + len(section))
+    header = _HEADER.pack(SHARED_SNAPSHOT_MAGIC, version, snapshot.timestamp, time.time(), len(keys), *section_offsets)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(key for key, _ in keys))
+        f.write(array('q', offsets).tobytes())
+        for _, times in keys:
+            f.write(times.tobytes())
+        for section in sections:
+            f.write(section)
+    os.replace(temp_path, path)
+
+
+class _KeyTable:
+    """
+    A read-only sequence view of the fixed-width key table, so it can be searched with bisect.
+    """
+
+    def __init__(self, buffer: memoryview, count: int):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self._buffer[i * KEY_WIDTH:(i + 1) * KEY_WIDTH])
+
+
+class SharedArrivalIndex:
+    """
+    A read-only arrival index over a memory-mapped snapshot file, with the same 'get' lookup as the dict from 'build_arrival_index'.
+    Arrival times are returned as views into the mapping, so nothing is copied or parsed. The records are only unpickled by 'load_records'.
+
+    Args:
+        path: The path of a file written by 'write_snapshot'
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, self.version, self.timestamp, self.published_at, count, *self._section_offsets = _HEADER.unpack_from(buffer)
+        if magic != SHARED_SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a published arrival snapshot")
+        keys_end = _HEADER.size + count * KEY_WIDTH
+        offsets_end = keys_end + 8 * (count + 1)
+        self._keys = _KeyTable(buffer[_HEADER.size:keys_end], count)
+        self._offsets = buffer[keys_end:offsets_end].cast('q')
+        self._arrivals = buffer[offsets_end:self._section_offsets[0]].cast('q')
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return self.get(key) is not None
+
+    def __iter__(self):
+        for i in range(len(self._keys)):
+            route_id, stop_id = self._keys[i].rstrip(b'\0').decode('utf-8').split('\0')
+            yield route_id, stop_id
+
+    def __getitem__(self, key: tuple[str, str]):
+        arrivals = self.get(key)
+        if arrivals is None:
+            raise KeyError(key)
+        return arrivals
+
+    def get(self, key: tuple[str, str], default=None):
+        """
+        Return the sorted arrival times of a (route_id, stop_id) key as a read-only view of int64 values, or the default.
+        """
+        try:
+            encoded = _encode_key(*key)
+        except ValueError:
+            # No key that long is ever published
+            return default
+        i = bisect_left(self._keys, encoded)
+        if i == len(self._keys) or self._keys[i] != encoded:
+            return default
+        return self._arrivals[self._offsets[i]:self._offsets[i + 1]]
+
+    def load_records(self, name: str):
+        """
+        Unpickle one of RECORD_SECTIONS published with the index, e.g. the dict of TripRecord for 'trips'.
+        """
+        i = RECORD_SECTIONS.index(name)
+        return pickle.loads(self._mmap[self._section_offsets[i]:self._section_offsets[i + 1]])
+
+    def load_snapshot(self, feed_group: str) -> 'SharedFeedSnapshot':
+        """
+        Return a FeedSnapshot of a feed group served from this index, whose records are only unpickled when first used.
+        """
+        return SharedFeedSnapshot(feed_group, self)
+
+
+class SharedFeedSnapshot(FeedSnapshot):
+    """
+    A FeedSnapshot read from a published snapshot file. Arrivals are answered from the mapped index without loading any records, and the trips,
+    vehicle positions, alerts and station sequences are each unpickled the first time they are used (e.g., for /train, assigned-only arrivals or alerts).
+
+    Args:
+        feed_group: The feed group the file was published for
+        index: The SharedArrivalIndex of the published file
+
+    Attributes:
+        station_sequences: The station lists of the feed group's lines merged by the publisher, keyed by (route_id, direction)
+    """
+    __slots__ = ('_records',)
+
+    def __init__(self, feed_group: str, index: SharedArrivalIndex):
+        self.feed_group = feed_group
+        self.timestamp = index.timestamp
+        self.arrival_index = index
+        self.train_index = None
+        self.board_columns = None
+        self.stale = False
+        self.index_only = False
+        self._records = {}
+
+    def _load(self, name: str):
+        records = self._records.get(name)
+        if records is None:
+            records = self.arrival_index.load_records(name)
+            self._records[name] = records
+        return records
+
+    @property
+    def trips(self) -> dict:
+        return self._load('trips')
+
+    @property
+    def vehicles(self) -> dict:
+        return self._load('vehicles')
+
+    @property
+    def alerts(self) -> dict:
+        return self._load('alerts')
+
+    @property
+    def station_sequences(self) -> dict:
+        return self._load('station_sequences')
+
+
+class SharedSnapshotWriter:
+    """
+    Publish every new snapshot's arrival index and records to a directory of memory-mapped files, one per feed group, for worker processes to read.
+    Register 'publish' as a snapshot listener in the one process that polls the feeds.
+
+    Args:
+        directory: The directory to publish to, created if needed. Only the publishing user may write to it, since workers unpickle what is published there.
+    """
+
+    def __init__(self, directory: str=SHARED_SNAPSHOT_PATH):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def publish(self, feed_group: str, snapshot: FeedSnapshot, changes=None) -> None:
+        """
+        Write a snapshot as the next version for its feed group, with the group's merged station lists. It is written even without changes,
+        so workers see the new header timestamp. Register it after the station lists' own listener, as importing this module does.
+        """
+        with self._lock:
+            version = self._versions.get(feed_group, 0) + 1
+            write_snapshot(snapshot_path(self.directory, feed_group), snapshot, version, mta_stops_to_stations.get_station_sequences(feed_group))
+            self._versions[feed_group] = version
+
+
+class SharedSnapshotReader:
+    """
+    Serve the snapshots published by a SharedSnapshotWriter, in a worker process that does not fetch any feeds itself.
+    Each feed group's file is mapped once per version, and checked for a new version at most every check_seconds. Snapshots are not published
+    in the worker, so no diff or snapshot listener runs there; the records are only unpickled when a request uses them (see SharedFeedSnapshot).
+    Files not owned by the user running the worker are refused.
+
+    Args:
+        directory: The directory the writer publishes to
+        check_seconds: The minimum number of seconds between checks for a new version of a feed group
+    """
+
+    def __init__(self, directory: str=SHARED_SNAPSHOT_PATH, check_seconds: float=SHARED_SNAPSHOT_CHECK_SECONDS):
+        self.directory = directory
+        self.check_seconds = check_seconds
+        self._snapshots = {}  # feed group -> (checked at, (inode, mtime) of the mapped file, snapshot)
+        self._lock = threading.Lock()
+
+    def __call__(self, feed_group: str) -> FeedSnapshot:
+        """
+        Return the latest published snapshot of a feed group, or None if none has been published.
+        Its arrival index is read from the mapped file, and its trips, vehicle positions and alerts are loaded from it when first used.
+        """
+        now = time.time()
+        entry = self._snapshots.get(feed_group)
+        if entry is not None and now - entry[0] < self.check_seconds:
+            return entry[2]
+        with self._lock:
+            path = snapshot_path(self.directory, feed_group)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            file_key = (stat.st_ino, stat.st_mtime_ns)
+            if entry is not None and entry[1] == file_key:
+                snapshot = entry[2]
+            else:
+                try:
+                    if stat.st_uid != os.getuid():
+                        raise ValueError(f"{path} is not owned by this user")
+                    snapshot = SharedArrivalIndex(path).load_snapshot(feed_group)
+                except (OSError, ValueError) as e:
+                    print(f"Error reading shared snapshot {path}: {e}")
+                    return entry[2] if entry is not None else None
+            snapshot.stale = now - snapshot.arrival_index.published_at > SHARED_SNAPSHOT_STALE_SECONDS
+            self._snapshots[feed_group] = (now, file_key, snapshot)
+            return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll every feed group and publish the decoded snapshots for worker processes started with CATCH_A_RIDE_SHARED_SNAPSHOTS set.")
+    parser.add_argument('--directory', default=SHARED_SNAPSHOT_PATH, help="The directory to publish snapshots to")
+    args = parser.parse_args()
+
+    # Workers do not see snapshots being published, so arrival history (see local_app.py) is recorded here
+    if os.environ.get("CATCH_A_RIDE_HISTORY"):
+        mta_subway_fetcher.add_snapshot_listener(arrival_history.ArrivalHistoryRecorder(os.environ["CATCH_A_RIDE_HISTORY"]).record)
+    writer = SharedSnapshotWriter(args.directory)
+    mta_subway_fetcher.add_snapshot_listener(writer.publish)
+    feed_poller.start_poller()
+    print(f"Publishing arrival snapshots to {args.directory}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        feed_poller.stop_poller()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+from src.feed_records import AlertRecord, FeedSnapshot, TripRecord
+
+
+class ChangeSet:
+    """
+    The trips that differ between two consecutive snapshots of a feed group, and whether their alerts differ.
+
+    Attributes:
+        feed_group: The feed group of both snapshots
+        previous_timestamp: The feed header timestamp of the older snapshot, or None if there was none
+        timestamp: The feed header timestamp of the newer snapshot
+        added: A dict of TripRecord keyed by trip ID, for trips only in the newer snapshot
+        changed: A dict of (old TripRecord, new TripRecord) keyed by trip ID, for trips whose stops or predicted times changed
+        removed: A dict of TripRecord keyed by trip ID, for trips only in the older snapshot
+        alerts_changed: True if an alert was added, changed or removed. Alerts do not count towards the truth value, which is about trips.
+    """
+    __slots__ = ('feed_group', 'previous_timestamp', 'timestamp', 'added', 'changed', 'removed', 'alerts_changed')
+
+    def __init__(self, feed_group: str, previous_timestamp: int, timestamp: int, added: dict, changed: dict, removed: dict, alerts_changed: bool=True):
+        self.feed_group = feed_group
+        self.previous_timestamp = previous_timestamp
+        self.timestamp = timestamp
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+        self.alerts_changed = alerts_changed
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self) -> str:
+        return f"ChangeSet({self.feed_group!r}, {len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed)"
+
+    def routes(self) -> set[str]:
+        """
+        Return the route IDs of every added, changed or removed trip.
+        """
+        routes = {trip.route_id for trip in self.added.values()}
+        routes.update(new.route_id for _, new in self.changed.values())
+        routes.update(trip.route_id for trip in self.removed.values())
+        return routes
+
+
+def trips_equal(old: TripRecord, new: TripRecord) -> bool:
+    """
+    Check whether two records of a trip have the same route, train assignment, and the same stops at the same predicted times and tracks.
+    """
+    if old is new:
+        return True
+    if old.route_id != new.route_id or old.train_id != new.train_id or old.is_assigned != new.is_assigned or len(old.stop_times) != len(new.stop_times):
+        return False
+    for old_stop, new_stop in zip(old.stop_times, new.stop_times):
+        if old_stop.stop_id != new_stop.stop_id or old_stop.arrival != new_stop.arrival or old_stop.departure != new_stop.departure:
+            return False
+        if old_stop.scheduled_track != new_stop.scheduled_track or old_stop.actual_track != new_stop.actual_track:
+            return False
+    return True
+
+def alerts_equal(old: AlertRecord, new: AlertRecord) -> bool:
+    """
+    Check whether two records of an alert have the same active periods, informed entities, effect and text.
+    """
+    return old is new or all(getattr(old, name) == getattr(new, name) for name in AlertRecord.__slots__)
+
+def diff_snapshots(previous: FeedSnapshot, current: FeedSnapshot) -> ChangeSet:
+    """
+    Compare two snapshots of a feed group by trip ID.
+    Trips decoded with 'previous' passed to 'feedmessage_to_snapshot' share TripRecord objects when unchanged, so most comparisons are an identity check.
+
+    Args:
+        previous: The older FeedSnapshot, or None for the first snapshot of a feed group (every trip is then added)
+        current: The newer FeedSnapshot
+
+    Returns:
+        changes: A ChangeSet of added, changed and removed trips, and whether any alert changed
+    """
+    if previous is None:
+        return ChangeSet(current.feed_group, None, current.timestamp, dict(current.trips), {}, {}, bool(current.alerts))
+    added = {}
+    changed = {}
+    previous_trips = previous.trips
+    for trip_id, trip in current.trips.items():
+        old = previous_trips.get(trip_id)
+        if old is None:
+            added[trip_id] = trip
+        elif not trips_equal(old, trip):
+            changed[trip_id] = (old, trip)
+    removed = {trip_id: trip for trip_id, trip in previous_trips.items() if trip_id not in current.trips}
+    previous_alerts = previous.alerts
+    alerts_changed = len(previous_alerts) != len(current.alerts) or any(
+        alert_id not in previous_alerts or not alerts_equal(previous_alerts[alert_id], alert) for alert_id, alert in current.alerts.items())
+    changes = ChangeSet(current.feed_group, previous.timestamp, current.timestamp, added, changed, removed, alerts_changed)
+    return changes
@@ -0,0 +1,287 @@
+import csv
+import mmap
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+
+# STATIC_INDEX_PATH -- The compiled static GTFS index, built from data/stops.csv and data/routes.csv by setup/create_static_index.py
+STATIC_INDEX_PATH = 'data/static_index.bin'
+
+# STATIC_INDEX_MAGIC -- The first bytes of a static index file, including the format version
+STATIC_INDEX_MAGIC = b'CARSIDX1'
+
+# STATIC_INDEX_SECTIONS -- The sections of a static index file, in file order, with the array typecode of each ('s' for a string table)
+STATIC_INDEX_SECTIONS = (
+    ('stop_ids', 's'),       # Every stop ID, sorted
+    ('stop_names', 's'),     # Every distinct stop name, sorted
+    ('stop_name', 'i'),      # Per stop, the position of its name in stop_names
+    ('parent', 'i'),         # Per stop, the position of its parent station in stop_ids, or -1
+    ('location_type', 'i'),  # Per stop, the GTFS location_type (1 for a station, 0 for a platform)
+    ('lat', 'd'),            # Per stop, the latitude
+    ('lon', 'd'),            # Per stop, the longitude
+    ('name_offsets', 'i'),   # Per stop name, the start of its stops in name_stops (one extra entry marks the end)
+    ('name_stops', 'i'),     # Positions in stop_ids, grouped by stop name
+    ('route_ids', 's'),      # Every route ID, sorted
+    ('route_short', 's'),    # Per route, the short name
+    ('route_long', 's'),     # Per route, the long name
+    ('route_color', 's'),    # Per route, the hex color
+    ('route_text', 's'),     # Per route, the hex text color
+    ('route_sort', 'i'),     # Per route, the sort order
+)
+
+# _static_index -- The process-wide static index, loaded on first use by 'get_static_index'
+_static_index = None
+_static_index_lock = threading.Lock()
+
+
+def _pack_strings(strings: list[str]) -> bytes:
+    """
+    Pack strings into a string table: a count, one offset per string plus an end offset, then the UTF-8 bytes.
+    """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('i', [0])
+    for e in encoded:
+        offsets.append(offsets[-1] + len(e))
+    return struct.pack('<i', len(encoded)) + offsets.tobytes() + b''.join(encoded)
+
+def compile_static_index(stops_csv: str='data/stops.csv', routes_csv: str='data/routes.csv', output_path: str=STATIC_INDEX_PATH) -> None:
+    """
+    Compile the static GTFS stops and routes (from https://rrgtfsfeeds.s3.amazonaws.com/gtfs_subway.zip) into a compact binary index.
+
+    Args:
+        stops_csv: The path to the GTFS stops.csv file
+        routes_csv: The path to the GTFS routes.csv file
+        output_path: The path of the index file to write
+    """
+    with open(stops_csv, 'r') as f:
+        stops = sorted(csv.DictReader(f), key=lambda row: row['stop_id'])
+    with open(routes_csv, 'r') as f:
+        routes = sorted(csv.DictReader(f), key=lambda row: row['route_id'])
+
+    stop_ids = [row['stop_id'] for row in stops]
+    stop_position = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+    stop_names = sorted({row['stop_name'] for row in stops})
+    name_position = {name: i for i, name in enumerate(stop_names)}
+
+    stops_per_name = [[] for _ in stop_names]
+    for i, row in enumerate(stops):
+        stops_per_name[name_position[row['stop_name']]].append(i)
+    name_offsets = array('i', [0])
+    for positions in stops_per_name:
+        name_offsets.append(name_offsets[-1] + len(positions))
+
+    sections = {
+        'stop_ids': stop_ids,
+        'stop_names': stop_names,
+        'stop_name': array('i', [name_position[row['stop_name']] for row in stops]),
+        'parent': array('i', [stop_position.get(row['parent_station'], -1) for row in stops]),
+        'location_type': array('i', [int(row['location_type'] or 0) for row in stops]),
+        'lat': array('d', [float(row['stop_lat']) for row in stops]),
+        'lon': array('d', [float(row['stop_lon']) for row in stops]),
+        'name_offsets': name_offsets,
+        'name_stops': array('i', [i for positions in stops_per_name for i in positions]),
+        'route_ids': [row['route_id'] for row in routes],
+        'route_short': [row['route_short_name'] for row in routes],
+        'route_long': [row['route_long_name'] for row in routes],
+        'route_color': [row['route_color'] for row in routes],
+        'route_text': [row['route_text_color'] for row in routes],
+        'route_sort': array('i', [int(row['route_sort_order'] or 0) for row in routes]),
+    }
+    write_sections(output_path, STATIC_INDEX_MAGIC, STATIC_INDEX_SECTIONS, sections)
+
+def write_sections(output_path: str, magic: bytes, section_spec: tuple, sections: dict) -> None:
+    """
+    Write an index file made of sections: the magic bytes, an (offset, length) per section, then the sections themselves.
+    Every section starts on an 8-byte boundary so it can be cast in place once memory-mapped.
+
+    Args:
+        output_path: The path of the file to write
+        magic: The first bytes of the file, identifying its format and version
+        section_spec: The (name, typecode) of every section in file order, 's' marking a string table
+        sections: A dict with keys as section names and values as lists of strings (for string tables) or arrays of the section's typecode
+    """
+    header_size = len(magic) + 16 * len(section_spec)
+    table = b''
+    body = b''
+    for name, typecode in section_spec:
+        data = _pack_strings(sections[name]) if typecode == 's' else sections[name].tobytes()
+        body += b'\0' * (-(header_size + len(body)) % 8)
+        table += struct.pack('<QQ', header_size + len(body), len(data))
+        body += data
+    with open(output_path, 'wb') as f:
+        f.write(magic + table + body)
+
+def map_sections(path: str, magic: bytes, section_spec: tuple) -> tuple[mmap.mmap, dict]:
+    """
+    Memory-map an index file written by 'write_sections'.
+
+    Args:
+        path: The path of the index file
+        magic: The magic bytes the file must start with
+        section_spec: The (name, typecode) of every section in file order, as written
+
+    Returns:
+        (mapping, sections): The mmap, which must be kept open while the sections are used, and a dict with keys as section names and values
+            as read-only string tables or memoryviews cast to the section's typecode
+    """
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapping)
+    if bytes(buffer[:len(magic)]) != magic:
+        raise ValueError(f"{path} is not a {magic[:-1].decode()} version {magic[-1:].decode()} file")
+    sections = {}
+    for i, (name, typecode) in enumerate(section_spec):
+        offset, length = struct.unpack_from('<QQ', buffer, len(magic) + 16 * i)
+        section = buffer[offset:offset + length]
+        sections[name] = _StringTable(section) if typecode == 's' else section.cast(typecode)
+    return mapping, sections
+
+
+class _StringTable:
+    """
+    A read-only sequence view of a packed string table, decoding each string only when it is accessed.
+    """
+
+    def __init__(self, buffer: memoryview):
+        count = struct.unpack_from('<i', buffer)[0]
+        self._offsets = buffer[4:8 + 4 * count].cast('i')
+        self._blob = buffer[8 + 4 * count:]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def find(self, value: str) -> int:
+        """
+        Binary search for a string in a sorted table.
+
+        Returns:
+            The position of the string, or -1 if it is not in the table
+        """
+        i = bisect_left(self, value)
+        if i < len(self) and self[i] == value:
+            return i
+        return -1
+
+
+class StaticIndex:
+    """
+    Read-only lookups over a compiled static index file, memory-mapped so nothing is parsed up front.
+
+    Args:
+        path: The path to an index written by 'compile_static_index'
+    """
+
+    def __init__(self, path: str=STATIC_INDEX_PATH):
+        try:
+            self._mmap, sections = map_sections(path, STATIC_INDEX_MAGIC, STATIC_INDEX_SECTIONS)
+        except ValueError:
+            raise ValueError(f"{path} is not a static index file, rebuild it with setup/create_static_index.py")
+        self.stop_ids = sections['stop_ids']
+        self.stop_names = sections['stop_names']
+        self.lat = sections['lat']
+        self.lon = sections['lon']
+        self.location_type = sections['location_type']
+        self.route_ids = sections['route_ids']
+        self._sections = sections
+        # Positions of stop IDs already looked up, so repeated lookups skip the binary search
+        self._stop_positions = {}
+
+    def __contains__(self, stop_id: str) -> bool:
+        return self.stop_position(stop_id) >= 0
+
+    def stop_position(self, stop_id: str) -> int:
+        """
+        Find the position of a stop ID in the index, used to read the per-stop arrays.
+
+        Returns:
+            The position, or -1 for an unknown stop ID
+        """
+        position = self._stop_positions.get(stop_id)
+        if position is None:
+            position = self.stop_ids.find(stop_id)
+            if position >= 0:
+                self._stop_positions[stop_id] = position
+        return position
+
+    def stop_name(self, stop_id: str) -> str:
+        """
+        Translate a stop ID (e.g., '127S') to its human-readable station name.
+
+        Returns:
+            The station name, or None for an unknown stop ID
+        """
+        i = self.stop_position(stop_id)
+        if i < 0:
+            return None
+        return self.stop_names[self._sections['stop_name'][i]]
+
+    def stop_ids_for_name(self, stop_name: str) -> list[str]:
+        """
+        Translate a human-readable station name to every stop ID with that name (e.g., '23 St' to ['130', '130N', '130S', 'A30', ...]).
+
+        Returns:
+            A list of stop IDs, empty for an unknown name
+        """
+        i = self.stop_names.find(stop_name)
+        if i < 0:
+            return []
+        offsets = self._sections['name_offsets']
+        name_stops = self._sections['name_stops']
+        return [self.stop_ids[name_stops[j]] for j in range(offsets[i], offsets[i + 1])]
+
+    def parent_station(self, stop_id: str) -> str:
+        """
+        Find the parent station of a directional stop ID (e.g., '127' for '127S').
+
+        Returns:
+            The parent stop ID, or None if the stop is a station itself or unknown
+        """
+        i = self.stop_position(stop_id)
+        if i < 0 or self._sections['parent'][i] < 0:
+            return None
+        return self.stop_ids[self._sections['parent'][i]]
+
+    def stop_location(self, stop_id: str) -> tuple[float, float]:
+        """
+        Return the (latitude, longitude) of a stop ID, or None for an unknown stop ID.
+        """
+        i = self.stop_position(stop_id)
+        if i < 0:
+            return None
+        return self.lat[i], self.lon[i]
+
+    def route(self, route_id: str) -> dict:
+        """
+        Return the metadata of a route ID (e.g., 'GS'), with keys 'route_id', 'short_name', 'long_name', 'color', 'text_color' and 'sort_order', or None for an unknown route.
+        """
+        i = self.route_ids.find(route_id)
+        if i < 0:
+            return None
+        return {
+            'route_id': route_id,
+            'short_name': self._sections['route_short'][i],
+            'long_name': self._sections['route_long'][i],
+            'color': self._sections['route_color'][i],
+            'text_color': self._sections['route_text'][i],
+            'sort_order': self._sections['route_sort'][i],
+        }
+
+
+def get_static_index(path: str=STATIC_INDEX_PATH) -> StaticIndex:
+    """
+    Return the process-wide static index, memory-mapping the file on the first call.
+
+    Args:
+        path: The path to the compiled index. Only used by the first call.
+    """
+    global _static_index
+    with _static_index_lock:
+        if _static_index is None:
+            _static_index = StaticIndex(path)
+        return _static_index
@@ -0,0 +1,321 @@
+import src.static_index as static_index
+
+import csv
+import io
+import heapq
+import threading
+import time
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# TIMETABLE_PATH -- The compiled static timetable, built from the MTA static subway data by setup/create_timetable_index.py. Not committed, as it is built from a download.
+TIMETABLE_PATH = 'data/timetable_index.bin'
+
+# TIMETABLE_MAGIC -- The first bytes of a timetable file, including the format version
+TIMETABLE_MAGIC = b'CARTTB02'
+
+# TIMETABLE_RETRY_SECONDS -- How long to wait after a failed load before trying to load the timetable again, e.g. once it has been built
+TIMETABLE_RETRY_SECONDS = 300
+
+# TIMETABLE_TIMEZONE -- The agency timezone that GTFS stop times are given in
+TIMETABLE_TIMEZONE = ZoneInfo('America/New_York')
+
+# TIMETABLE_SECTIONS -- The sections of a timetable file, in file order, with the array typecode of each ('s' for a string table)
+TIMETABLE_SECTIONS = (
+    ('keys', 's'),                # Every 'route_id\0stop_id' with scheduled stops, sorted
+    ('key_offsets', 'i'),         # Per key, the start of its stops in times and services (one extra entry marks the end)
+    ('times', 'i'),               # Per scheduled stop, the arrival in seconds after the start of its service day (may exceed 24 hours), sorted within each key
+    ('services', 'i'),            # Per scheduled stop, the position of its trip's service ID in service_ids
+    ('service_ids', 's'),         # Every service ID from calendar.txt and calendar_dates.txt, sorted
+    ('service_days', 'i'),        # Per service, a bit mask of the weekdays it runs on (bit 0 for Monday)
+    ('service_start', 'i'),       # Per service, the first date it runs as YYYYMMDD
+    ('service_end', 'i'),         # Per service, the last date it runs as YYYYMMDD
+    ('exception_dates', 'i'),     # Every calendar_dates.txt entry's date as YYYYMMDD, sorted
+    ('exception_services', 'i'),  # Per exception, the position of its service ID
+    ('exception_types', 'i'),     # Per exception, 1 if service is added on the date and 2 if it is removed
+    ('order_keys', 's'),          # Every 'route_id\0direction' with scheduled trips, sorted
+    ('order_offsets', 'i'),       # Per order key, the start of its stops in order_stops (one extra entry marks the end)
+    ('order_stops', 's'),         # Directional stop IDs per route and direction, in travel order
+)
+
+# _WEEKDAYS -- The calendar.txt day columns, in the order of their bits in service_days
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# _static_timetable -- The process-wide timetable, loaded on first use by 'get_static_timetable'
+_static_timetable = None
+# _static_timetable_retry_at -- The monotonic time before which a failed load is not tried again
+_static_timetable_retry_at = 0.0
+_static_timetable_lock = threading.Lock()
+
+
+def _read_csv(archive: zipfile.ZipFile, name: str):
+    """
+    Iterate over the rows of a file in a GTFS zip as dicts, or nothing if the zip has no such file.
+    """
+    if name not in archive.namelist():
+        return
+    with archive.open(name) as f:
+        yield from csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig'))
+
+def _seconds(gtfs_time: str) -> int:
+    """
+    Convert a GTFS time (e.g., '25:04:30', past midnight of the service day) to seconds after the start of the service day.
+    """
+    hours, minutes, seconds = gtfs_time.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def _travel_order(patterns: set[tuple[str, ...]]) -> list[str]:
+    """
+    Order the stops of a route and direction so each one comes after every stop a trip makes right before it, keeping each branch together.
+    Stops that no order can satisfy, e.g. on a trip that loops back, are placed in the order they were first seen.
+
+    Args:
+        patterns: The distinct stop ID sequences of the route's trips in one direction, each in stop_sequence order
+
+    Returns:
+        Every stop ID of the patterns, once
+    """
+    seen = {}
+    following = {}
+    waiting = {}
+    for stops in sorted(patterns, key=lambda stops: (-len(stops), stops)):
+        for stop_id in stops:
+            seen.setdefault(stop_id, len(seen))
+            following.setdefault(stop_id, {})
+            waiting.setdefault(stop_id, 0)
+        for stop_id, next_stop_id in zip(stops, stops[1:]):
+            if next_stop_id != stop_id and next_stop_id not in following[stop_id]:
+                following[stop_id][next_stop_id] = None
+                waiting[next_stop_id] += 1
+    order = []
+    ordered = set()
+    # Stops are taken most recently readied first, so a branch is finished before the next one starts, and ties go to the first seen stop
+    ready = [(0, seen[stop_id], stop_id) for stop_id, count in waiting.items() if count == 0]
+    heapq.heapify(ready)
+    step = 0
+    while len(order) < len(seen):
+        if not ready:
+            stop_id = min((stop_id for stop_id in seen if stop_id not in ordered), key=seen.get)
+            heapq.heappush(ready, (0, seen[stop_id], stop_id))
+        _, _, stop_id = heapq.heappop(ready)
+        if stop_id in ordered:
+            continue
+        order.append(stop_id)
+        ordered.add(stop_id)
+        step -= 1
+        for next_stop_id in following[stop_id]:
+            waiting[next_stop_id] -= 1
+            if waiting[next_stop_id] == 0 and next_stop_id not in ordered:
+                heapq.heappush(ready, (step, seen[next_stop_id], next_stop_id))
+    return order
+
+def compile_timetable(zip_path: str='gtfs_subway.zip', output_path: str=TIMETABLE_PATH) -> None:
+    """
+    Compile trips.txt, stop_times.txt, calendar.txt and calendar_dates.txt of the static GTFS zip (https://rrgtfsfeeds.s3.amazonaws.com/gtfs_subway.zip)
+    into a timetable of scheduled arrivals per route and directional stop.
+
+    Args:
+        zip_path: The path to the GTFS zip
+        output_path: The path of the timetable file to write
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        calendar = list(_read_csv(archive, 'calendar.txt'))
+        exceptions = list(_read_csv(archive, 'calendar_dates.txt'))
+        service_ids = sorted({row['service_id'] for row in calendar} | {row['service_id'] for row in exceptions})
+        service_position = {service_id: i for i, service_id in enumerate(service_ids)}
+        trips = {row['trip_id']: (row['route_id'], service_position[row['service_id']]) for row in _read_csv(archive, 'trips.txt') if row['service_id'] in service_position}
+
+        stops_per_key = {}
+        stops_per_trip = {}
+        for row in _read_csv(archive, 'stop_times.txt'):
+            trip = trips.get(row['trip_id'])
+            gtfs_time = row['arrival_time'] or row['departure_time']
+            if trip is None or not gtfs_time:
+                continue
+            if row['trip_id'] not in stops_per_trip:
+                stops_per_trip[row['trip_id']] = []
+            stops_per_trip[row['trip_id']].append((int(row['stop_sequence']), row['stop_id']))
+            key = f"{trip[0]}\0{row['stop_id']}"
+            if key not in stops_per_key:
+                stops_per_key[key] = []
+            stops_per_key[key].append((_seconds(gtfs_time), trip[1]))
+
+    patterns = {}
+    for trip_id, stops in stops_per_trip.items():
+        stop_ids = tuple(stop_id for _, stop_id in sorted(stops))
+        key = f"{trips[trip_id][0]}\0{stop_ids[0][-1:]}"
+        if key not in patterns:
+            patterns[key] = set()
+        patterns[key].add(stop_ids)
+    order_keys = sorted(patterns)
+    order_offsets = array('i', [0])
+    order_stops = []
+    for key in order_keys:
+        order_stops.extend(_travel_order(patterns[key]))
+        order_offsets.append(len(order_stops))
+
+    keys = sorted(stops_per_key)
+    key_offsets = array('i', [0])
+    times = array('i')
+    services = array('i')
+    for key in keys:
+        for seconds, service in sorted(stops_per_key[key]):
+            times.append(seconds)
+            services.append(service)
+        key_offsets.append(len(times))
+
+    service_days = array('i', [0] * len(service_ids))
+    service_start = array('i', [0] * len(service_ids))
+    service_end = array('i', [0] * len(service_ids))
+    for row in calendar:
+        i = service_position[row['service_id']]
+        service_days[i] = sum(1 << bit for bit, day in enumerate(_WEEKDAYS) if row[day] == '1')
+        service_start[i] = int(row['start_date'])
+        service_end[i] = int(row['end_date'])
+    exceptions.sort(key=lambda row: int(row['date']))
+
+    sections = {
+        'keys': keys,
+        'key_offsets': key_offsets,
+        'times': times,
+        'services': services,
+        'service_ids': service_ids,
+        'service_days': service_days,
+        'service_start': service_start,
+        'service_end': service_end,
+        'exception_dates': array('i', [int(row['date']) for row in exceptions]),
+        'exception_services': array('i', [service_position[row['service_id']] for row in exceptions]),
+        'exception_types': array('i', [int(row['exception_type']) for row in exceptions]),
+        'order_keys': order_keys,
+        'order_offsets': order_offsets,
+        'order_stops': order_stops,
+    }
+    static_index.write_sections(output_path, TIMETABLE_MAGIC, TIMETABLE_SECTIONS, sections)
+
+
+class StaticTimetable:
+    """
+    Scheduled arrival lookups over a compiled timetable file, memory-mapped so nothing is parsed up front.
+
+    Args:
+        path: The path to a timetable written by 'compile_timetable'
+    """
+
+    def __init__(self, path: str=TIMETABLE_PATH):
+        self._mmap, self._sections = static_index.map_sections(path, TIMETABLE_MAGIC, TIMETABLE_SECTIONS)
+        self.keys = self._sections['keys']
+        self.times = self._sections['times']
+        # Active services per service date, since every query on a day asks about the same one or two dates
+        self._active_services = {}
+        self._key_positions = {}
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def active_services(self, service_date: date) -> frozenset[int]:
+        """
+        Return the positions of the services running on a date, from the weekly calendar and its exceptions.
+        """
+        services = self._active_services.get(service_date)
+        if services is not None:
+            return services
+        sections = self._sections
+        day = int(service_date.strftime('%Y%m%d'))
+        weekday_bit = 1 << service_date.weekday()
+        active = {i for i in range(len(sections['service_days']))
+                  if sections['service_days'][i] & weekday_bit and sections['service_start'][i] <= day <= sections['service_end'][i]}
+        dates = sections['exception_dates']
+        for i in range(bisect_left(dates, day), bisect_right(dates, day)):
+            if sections['exception_types'][i] == 1:
+                active.add(sections['exception_services'][i])
+            else:
+                active.discard(sections['exception_services'][i])
+        services = frozenset(active)
+        if len(self._active_services) > 8:
+            self._active_services.clear()
+        self._active_services[service_date] = services
+        return services
+
+    def _key_position(self, route_id: str, stop_id: str) -> int:
+        key = (route_id, stop_id)
+        position = self._key_positions.get(key)
+        if position is None:
+            position = self.keys.find(f"{route_id}\0{stop_id}")
+            self._key_positions[key] = position
+        return position
+
+    def next_arrivals(self, route_id: str, stop_id: str, current_time: int, count: int) -> list[int]:
+        """
+        Find the next scheduled arrivals at a stop after a given time, with the same arguments as 'arrival_index.next_arrivals'.
+
+        Args:
+            route_id: The route ID of the line (e.g., '1', or 'GS' for the 42 St Shuttle)
+            stop_id: The directional station ID (e.g., '127S')
+            current_time: An integer representing the current epoch time; only later arrivals are returned
+            count: The maximum number of arrival times to return
+
+        Returns:
+            A list of up to 'count' scheduled arrival epoch times, earliest first
+        """
+        position = self._key_position(route_id, stop_id)
+        if position < 0:
+            return []
+        offsets = self._sections['key_offsets']
+        start, end = offsets[position], offsets[position + 1]
+        services = self._sections['services']
+        today = datetime.fromtimestamp(current_time, TIMETABLE_TIMEZONE).date()
+        arrivals = []
+        # Trips of the previous service day run past midnight, with times over 24 hours
+        for service_date in (today - timedelta(days=1), today):
+            # GTFS times count from noon minus 12 hours, which is midnight except on daylight saving changes
+            day_start = int(datetime(service_date.year, service_date.month, service_date.day, 12, tzinfo=TIMETABLE_TIMEZONE).timestamp()) - 43200
+            active = self.active_services(service_date)
+            found = 0
+            for i in range(bisect_right(self.times, current_time - day_start, start, end), end):
+                if services[i] in active:
+                    arrivals.append(day_start + self.times[i])
+                    found += 1
+                    if found == count:
+                        break
+        arrivals.sort()
+        return arrivals[:count]
+
+
+    def stop_order(self, route_id: str, direction: str) -> list[str]:
+        """
+        Return the scheduled stops of a route in one direction in travel order, e.g. ['101S', '103S', ...] for ('1', 'S').
+
+        Returns:
+            A list of directional stop IDs, empty if the route has no scheduled trips in that direction
+        """
+        position = self._sections['order_keys'].find(f"{route_id}\0{direction}")
+        if position < 0:
+            return []
+        offsets = self._sections['order_offsets']
+        order_stops = self._sections['order_stops']
+        return [order_stops[i] for i in range(offsets[position], offsets[position + 1])]
+
+
+def get_static_timetable(path: str=TIMETABLE_PATH) -> StaticTimetable:
+    """
+    Return the process-wide timetable, memory-mapping the file on the first call.
+    If it cannot be loaded, loading is tried again on the first call TIMETABLE_RETRY_SECONDS later.
+
+    Args:
+        path: The path to the compiled timetable. Only used until it has been loaded.
+
+    Returns:
+        The StaticTimetable, or None if the timetable has not been built (see setup/create_timetable_index.py)
+    """
+    global _static_timetable, _static_timetable_retry_at
+    with _static_timetable_lock:
+        if _static_timetable is None and time.monotonic() >= _static_timetable_retry_at:
+            try:
+                _static_timetable = StaticTimetable(path)
+            except (OSError, ValueError) as e:
+                _static_timetable_retry_at = time.monotonic() + TIMETABLE_RETRY_SECONDS
+                print(f"Scheduled arrivals are unavailable: {e}")
+        return _static_timetable
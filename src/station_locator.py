@@ -0,0 +1,99 @@
+import src.static_index as static_index
+import src.mta_stops_to_stations as mta_stops_to_stations
+
+import heapq
+import math
+import threading
+
+# STATION_GRID_CELL_DEGREES -- The height of one grid cell in degrees of latitude (about 550 meters). Cells are as wide in meters at the grid's mean latitude.
+STATION_GRID_CELL_DEGREES = 0.005
+
+# METERS_PER_DEGREE -- The length of one degree of latitude, used for the equirectangular distances between nearby points
+METERS_PER_DEGREE = 111_195
+
+# _station_locator -- The process-wide locator, built on first use by 'get_station_locator'
+_station_locator = None
+_station_locator_lock = threading.Lock()
+
+
+class StationLocator:
+    """
+    A uniform grid over the coordinates of every parent station, for nearest-station queries.
+    Only the cells overlapping the search radius are scanned, so a query reads a handful of stations instead of all of them.
+
+    Args:
+        static: The StaticIndex to take the stations and their coordinates from
+        cell_degrees: The height of one grid cell in degrees of latitude
+    """
+
+    def __init__(self, static: static_index.StaticIndex, cell_degrees: float=STATION_GRID_CELL_DEGREES):
+        self.station_ids = []
+        self.lat = []
+        self.lon = []
+        for i in range(len(static.stop_ids)):
+            if static.location_type[i] == 1:
+                self.station_ids.append(static.stop_ids[i])
+                self.lat.append(static.lat[i])
+                self.lon.append(static.lon[i])
+        # Longitude is scaled by the cosine of the mean latitude, so grid cells are square in meters
+        mean_lat = sum(self.lat) / len(self.lat) if self.lat else 0.0
+        self.lon_scale = math.cos(math.radians(mean_lat))
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        for position in range(len(self.station_ids)):
+            self._cells.setdefault(self._cell(self.lat[position], self.lon[position]), []).append(position)
+        self._lines = None
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon * self.lon_scale / self.cell_degrees))
+
+    def nearest(self, lat: float, lon: float, radius_meters: float, count: int) -> list[tuple[str, float]]:
+        """
+        Find the stations closest to a point within a radius.
+
+        Args:
+            lat: The latitude of the point
+            lon: The longitude of the point
+            radius_meters: The maximum distance to a station in meters
+            count: The maximum number of stations to return
+
+        Returns:
+            stations: A list of up to 'count' (station_id, distance in meters) tuples, nearest first
+        """
+        cell_y, cell_x = self._cell(lat, lon)
+        point_scale = math.cos(math.radians(lat))
+        reach_y = int(math.ceil(radius_meters / METERS_PER_DEGREE / self.cell_degrees))
+        reach_x = int(math.ceil(radius_meters / METERS_PER_DEGREE / point_scale * self.lon_scale / self.cell_degrees))
+        candidates = []
+        for y in range(cell_y - reach_y, cell_y + reach_y + 1):
+            for x in range(cell_x - reach_x, cell_x + reach_x + 1):
+                for position in self._cells.get((y, x), ()):
+                    d_lat = self.lat[position] - lat
+                    d_lon = (self.lon[position] - lon) * point_scale
+                    distance = METERS_PER_DEGREE * math.sqrt(d_lat * d_lat + d_lon * d_lon)
+                    if distance <= radius_meters:
+                        candidates.append((distance, self.station_ids[position]))
+        return [(station_id, distance) for distance, station_id in heapq.nsmallest(count, candidates)]
+
+    def lines_at(self, station_id: str) -> list[str]:
+        """
+        Return the subway lines stopping at a station during regular service (e.g., ['1', '2', '3'] for '127').
+        """
+        if self._lines is None:
+            lines = {}
+            for subway_line, station_ids in mta_stops_to_stations.load_static_stations().items():
+                for line_station_id in station_ids:
+                    lines.setdefault(line_station_id, []).append(subway_line)
+            self._lines = lines
+        return self._lines.get(station_id, [])
+
+
+def get_station_locator() -> StationLocator:
+    """
+    Return the process-wide station locator, building its grid from the static index on the first call.
+    """
+    global _station_locator
+    with _station_locator_lock:
+        if _station_locator is None:
+            _station_locator = StationLocator(static_index.get_static_index())
+        return _station_locator
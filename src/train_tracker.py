@@ -0,0 +1,137 @@
+from src.feed_records import FeedSnapshot, TripRecord
+
+from array import array
+from bisect import bisect_right
+
+# VEHICLE_STATUSES -- The names of the VehiclePosition.VehicleStopStatus values
+VEHICLE_STATUSES = {0: 'incoming', 1: 'stopped', 2: 'in_transit'}
+
+
+class TrainIndex:
+    """
+    The trains of one snapshot, keyed by NYCT train ID, with the trip arriving next at every stop.
+    Built once per snapshot, so each query is a dict lookup plus at most one binary search.
+
+    Attributes:
+        trains: A dict of lists of TripRecord keyed by train ID (or by trip ID for trips without a NYCT train ID). A train that already has its next trip
+            in the feed has several, ordered by their first stop, so the trip it is running now comes first.
+        assigned_arrival_index: An arrival index like 'arrival_index.build_arrival_index', over assigned trips only
+    """
+    __slots__ = ('snapshot', 'trains', 'assigned_arrival_index', '_stop_arrivals', '_stop_trips')
+
+    def __init__(self, snapshot: FeedSnapshot):
+        self.snapshot = snapshot
+        self.trains = {}
+        arrivals_per_stop = {}
+        assigned_per_stop = {}
+        for trip in snapshot.trips.values():
+            self.trains.setdefault(trip.train_id or trip.trip_id, []).append(trip)
+            for stop in trip.stop_times:
+                key = (stop.route_id, stop.stop_id)
+                arrivals_per_stop.setdefault(key, []).append((stop.arrival, trip.trip_id))
+                if trip.is_assigned:
+                    assigned_per_stop.setdefault(key, []).append(stop.arrival)
+        for trips in self.trains.values():
+            if len(trips) > 1:
+                trips.sort(key=lambda trip: trip.stop_times[0].arrival if trip.stop_times else 0)
+        # Per stop, the arrival times sorted as in the arrival index, and the trip of each arrival at the same position
+        self._stop_arrivals = {}
+        self._stop_trips = {}
+        for key, arrivals in arrivals_per_stop.items():
+            arrivals.sort()
+            self._stop_arrivals[key] = array('q', [arrival for arrival, _ in arrivals])
+            self._stop_trips[key] = [snapshot.trips[trip_id] for _, trip_id in arrivals]
+        self.assigned_arrival_index = {key: array('q', sorted(times)) for key, times in assigned_per_stop.items()}
+
+    def __len__(self) -> int:
+        return len(self.trains)
+
+    def __contains__(self, train_id: str) -> bool:
+        return train_id in self.trains
+
+    def __repr__(self) -> str:
+        return f"TrainIndex({self.snapshot.timestamp}, {len(self.trains)} trains)"
+
+    def get(self, train_id: str) -> TripRecord:
+        """
+        Return the trip a train is running now, or None if the snapshot has no such train.
+        """
+        trips = self.trains.get(train_id)
+        return trips[0] if trips else None
+
+    def next_trains(self, route_id: str, stop_id: str, current_time: int, count: int=1, assigned_only: bool=False) -> list[str]:
+        """
+        Find the trains arriving next at a stop after a given time.
+
+        Args:
+            route_id: The route ID of the line (e.g., '1', or 'GS' for the 42 St Shuttle)
+            stop_id: The directional station ID (e.g., '127S')
+            current_time: An integer representing the current epoch time; only later arrivals are included
+            count: The maximum number of trains to return
+            assigned_only: Whether to skip trips without an assigned train
+
+        Returns:
+            A list of up to 'count' train IDs, arriving earliest first
+        """
+        arrivals = self._stop_arrivals.get((route_id, stop_id))
+        if not arrivals:
+            return []
+        trips = self._stop_trips[(route_id, stop_id)]
+        found = []
+        for i in range(bisect_right(arrivals, current_time), len(arrivals)):
+            if not assigned_only or trips[i].is_assigned:
+                found.append(trips[i].train_id or trips[i].trip_id)
+                if len(found) == count:
+                    break
+        return found
+
+    def position(self, train_id: str, current_time: int) -> dict:
+        """
+        Describe where a train is and where it is going, from its trip updates and its last vehicle position.
+
+        Args:
+            train_id: The train ID, as in 'trains'
+            current_time: An integer representing the current epoch time; only later stops are listed as upcoming
+
+        Returns:
+            train: A dict with the 'train_id', and the 'trip_id', 'route_id', 'direction' and whether it 'is_assigned' of the trip it is running now,
+                the 'stop_id' and 'status' of its last vehicle position (None without one), and its 'upcoming' stops over this and any later trips
+                as dicts with the 'trip_id', 'stop_id', 'arrival', 'departure', 'scheduled_track' and 'actual_track'. None if the snapshot has no such train.
+        """
+        trips = self.trains.get(train_id)
+        if not trips:
+            return None
+        trip = trips[0]
+        vehicle = self.snapshot.vehicles.get(trip.trip_id)
+        return {
+            'train_id': train_id,
+            'trip_id': trip.trip_id,
+            'route_id': trip.route_id,
+            'direction': trip.direction,
+            'is_assigned': trip.is_assigned,
+            'stop_id': vehicle.stop_id if vehicle is not None else None,
+            'status': VEHICLE_STATUSES.get(vehicle.current_status) if vehicle is not None else None,
+            'upcoming': [{'trip_id': stop.trip_id, 'stop_id': stop.stop_id, 'arrival': stop.arrival, 'departure': stop.departure,
+                          'scheduled_track': stop.scheduled_track, 'actual_track': stop.actual_track}
+                         for trip in trips for stop in trip.stop_times if stop.departure > current_time],
+        }
+
+
+def get_train_index(snapshot: FeedSnapshot) -> TrainIndex:
+    """
+    Return the train index of a snapshot, building it on first use, like 'arrival_index.get_arrival_index'.
+    """
+    if snapshot.train_index is None:
+        snapshot.train_index = TrainIndex(snapshot)
+    return snapshot.train_index
+
+def get_assigned_arrival_index(snapshot: FeedSnapshot) -> dict[tuple[str, str], array]:
+    """
+    Return an arrival index of a snapshot without the trips that have no assigned train, for use with 'arrival_index.next_arrivals'.
+
+    Raises:
+        ValueError: If the snapshot is index-only, so which trips are assigned is unknown
+    """
+    if snapshot.index_only:
+        raise ValueError(f"Snapshot of feed group '{snapshot.feed_group}' has no trip records to filter by assigned train")
+    return get_train_index(snapshot).assigned_arrival_index
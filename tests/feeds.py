@@ -0,0 +1,78 @@
+from src.gtfsproto import nyct_subway_pb2, gtfs_realtime_pb2
+
+import random
+
+# FEED_STOPS -- The non-directional stop IDs of the generated subway feeds, in southbound order
+FEED_STOPS = [f"1{i:02d}" for i in range(1, 43)]
+
+
+def make_subway_feed(timestamp: int, routes: tuple=('1', '2', '3'), trips_per_route: int=20, seed: int=0, start_date: str='20240501') -> bytes:
+    """
+    Build a protobuf-encoded subway feed with NYCT extensions, shaped like the numbered lines' feed.
+    Trips alternate between directions, start at a random stop, and are 90 seconds apart between stops. Every trip has a vehicle position.
+
+    Args:
+        timestamp: The feed header timestamp; first arrivals are up to 10 minutes after it
+        routes: The route IDs to generate trips for
+        trips_per_route: The number of trips per route
+        seed: The seed of the random starting stops and times, so different seeds give changed trips
+        start_date: The start date of every trip as 'YYYYMMDD'
+
+    Returns:
+        The encoded FeedMessage
+    """
+    rnd = random.Random(seed)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '1.0'
+    feed.header.timestamp = timestamp
+    for route_id in routes:
+        for n in range(trips_per_route):
+            direction = 'S' if n % 2 else 'N'
+            stops = FEED_STOPS if direction == 'S' else FEED_STOPS[::-1]
+            first = rnd.randrange(0, len(stops) - 5)
+            entity = feed.entity.add(id=f"{route_id}-{n}")
+            trip = entity.trip_update.trip
+            trip.trip_id = f"{n:06d}_{route_id}..{direction}"
+            trip.route_id = route_id
+            trip.start_date = start_date
+            extension = trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor]
+            extension.train_id = f"0{route_id} {n:04d} X/Y"
+            extension.is_assigned = bool(n % 3)
+            extension.direction = 1 if direction == 'N' else 3
+            arrival = timestamp + rnd.randrange(0, 600)
+            for stop_id in stops[first:]:
+                update = entity.trip_update.stop_time_update.add(stop_id=stop_id + direction)
+                update.arrival.time = arrival
+                update.departure.time = arrival + 30
+                arrival += 90
+            vehicle = feed.entity.add(id=f"{route_id}-{n}-vehicle").vehicle
+            vehicle.trip.CopyFrom(trip)
+            vehicle.stop_id = stops[first] + direction
+            vehicle.timestamp = timestamp - 10
+    return feed.SerializeToString()
+
+def make_bus_feed(timestamp: int, routes: int=20, trips_per_route: int=10, stops_per_route: int=30, seed: int=0) -> bytes:
+    """
+    Build a protobuf-encoded bus trip updates feed. Route 'B<r>' serves stops '3<r:02d><s:03d>', and every trip has a vehicle position as well.
+
+    Returns:
+        The encoded FeedMessage
+    """
+    rnd = random.Random(seed)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '1.0'
+    feed.header.timestamp = timestamp
+    for r in range(routes):
+        for n in range(trips_per_route):
+            entity = feed.entity.add(id=f"{r}_{n}")
+            trip = entity.trip_update.trip
+            trip.trip_id = f"MTA_{r}_{n}"
+            trip.route_id = f"B{r}"
+            arrival = timestamp + rnd.randrange(-60, 900)
+            for s in range(stops_per_route):
+                entity.trip_update.stop_time_update.add(stop_id=f"3{r:02d}{s:03d}").arrival.time = arrival
+                arrival += rnd.randrange(40, 120)
+            vehicle = feed.entity.add(id=f"{r}_{n}_vehicle").vehicle
+            vehicle.trip.trip_id = trip.trip_id
+            vehicle.stop_id = f"3{r:02d}000"
+    return feed.SerializeToString()
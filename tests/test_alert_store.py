@@ -0,0 +1,67 @@
+import src.alert_store as alert_store
+import src.snapshot_diff as snapshot_diff
+from src.feed_records import AlertRecord, FeedSnapshot
+
+import pytest
+
+# TIMESTAMP -- The current time of every lookup
+TIMESTAMP = 1714560000
+
+# ROUTE_ALERT, STATION_ALERT, OTHER_ROUTE_ALERT, ENDED_ALERT -- Alerts on the whole 1 line, on the 1 at 127, on the 7 at 127, and one no longer active
+ROUTE_ALERT = AlertRecord('route', (), (('1', ''),), 'SIGNIFICANT_DELAYS', 'Delays on [1] trains', '')
+STATION_ALERT = AlertRecord('station', ((TIMESTAMP - 60, TIMESTAMP + 60),), (('1', '127N'),), 'DETOUR', '', 'Uptown [1] trains skip Times Sq')
+OTHER_ROUTE_ALERT = AlertRecord('other', (), (('7', '127'),), 'REDUCED_SERVICE', 'Fewer [7] trains', '')
+ENDED_ALERT = AlertRecord('ended', ((TIMESTAMP - 120, TIMESTAMP - 60),), (('1', ''),), 'DELAYS', 'Earlier delays', '')
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    for name in ('_alerts', '_alerts_by_route', '_alerts_by_station', '_short_texts', '_source_snapshots'):
+        monkeypatch.setattr(alert_store, name, {})
+
+def _publish(feed_group: str, alerts: list[AlertRecord], previous: FeedSnapshot=None) -> FeedSnapshot:
+    snapshot = FeedSnapshot(feed_group, TIMESTAMP, {}, {}, {alert.alert_id: alert for alert in alerts})
+    alert_store.update_alerts(feed_group, snapshot, snapshot_diff.diff_snapshots(previous, snapshot))
+    return snapshot
+
+def _ids(route_id: str=None, stop_id: str=None) -> set[str]:
+    return {alert.alert_id for alert in alert_store.get_alerts(route_id, stop_id, TIMESTAMP)}
+
+
+def test_alerts_are_indexed_by_route_and_station():
+    _publish('', [ROUTE_ALERT, STATION_ALERT, OTHER_ROUTE_ALERT, ENDED_ALERT])
+    assert _ids('1') == {'route'}
+    assert _ids('1', '127S') == {'route', 'station'}
+    assert _ids(stop_id='127') == {'station', 'other'}
+    assert _ids('7', '127') == {'other'}
+    assert _ids('2', '128') == set()
+
+def test_alert_in_several_feed_groups_is_included_once():
+    _publish('', [ROUTE_ALERT])
+    _publish('-ace', [ROUTE_ALERT])
+    assert len(alert_store.get_alerts('1', current_time=TIMESTAMP)) == 1
+    assert [summary['id'] for summary in alert_store.get_alert_summaries('1', '127', TIMESTAMP)] == ['route']
+
+def test_changed_and_ended_alerts_are_reindexed():
+    first = _publish('', [ROUTE_ALERT, STATION_ALERT])
+    moved = AlertRecord('station', (), (('1', '128N'),), 'DETOUR', 'Uptown [1] trains skip 34 St', '')
+    _publish('', [moved], first)
+    assert _ids('1', '127') == set()
+    assert _ids('1', '128') == {'station'}
+    assert alert_store.get_alert_summaries('1', '128', TIMESTAMP)[0]['text'] == 'Uptown 1 trains skip 34 St'
+    assert alert_store._alerts_by_route == {}
+
+def test_unchanged_alerts_are_not_compared_again(monkeypatch):
+    first = _publish('', [ROUTE_ALERT])
+    monkeypatch.setattr(alert_store, 'alerts_equal', lambda old, new: pytest.fail("alerts compared without changes"))
+    second = FeedSnapshot('', TIMESTAMP + 30, {}, {}, {ROUTE_ALERT.alert_id: ROUTE_ALERT})
+    changes = snapshot_diff.diff_snapshots(first, second)
+    assert not changes.alerts_changed
+    alert_store.update_alerts('', second, changes)
+    assert _ids('1') == {'route'}
+
+def test_short_text_drops_bullets_and_is_cut_at_a_word():
+    alert = AlertRecord('long', (), (), '', '[A]  trains are delayed ' + 'while we address a problem ' * 10, '')
+    text = alert_store.format_short_text(alert, 60)
+    assert text.startswith('A trains are delayed while')
+    assert len(text) <= 60 and text.endswith('...') and '  ' not in text
@@ -0,0 +1,64 @@
+import src.arrival_history as arrival_history
+import src.snapshot_diff as snapshot_diff
+from src.feed_records import FeedSnapshot, StopTimeRecord, TripRecord
+
+import os
+from datetime import datetime
+
+# SERVICE_TIMEZONE -- The timezone service days and hours are counted in
+SERVICE_TIMEZONE = arrival_history.TIMETABLE_TIMEZONE
+
+# STOPS -- The directional stop IDs of the simulated trips, in travel order
+STOPS = [f"1{i:02d}S" for i in range(1, 21)]
+
+
+def _trip(trip_id: str, start_date: str, stops: list[tuple[str, int]]) -> TripRecord:
+    return TripRecord(trip_id, '1', 'S', start_date, tuple(StopTimeRecord('1', trip_id, stop_id, 'S', arrival, arrival) for stop_id, arrival in stops))
+
+def _run(recorder, start: int, seconds: int, start_date: str, trip_count: int=4) -> None:
+    """
+    Record snapshots every 30 seconds of trains running from 'start', each dropping the stops it has passed.
+    """
+    trips = {f"t{n}": [(stop_id, start + n * 600 + i * 120) for i, stop_id in enumerate(STOPS)] for n in range(trip_count)}
+    previous = None
+    for now in range(start, start + seconds, 30):
+        records = {trip_id: _trip(trip_id, start_date, [stop for stop in stops if stop[1] > now]) for trip_id, stops in trips.items()}
+        snapshot = FeedSnapshot('', now, {trip_id: trip for trip_id, trip in records.items() if trip.stop_times}, {})
+        recorder.record('', snapshot, snapshot_diff.diff_snapshots(previous, snapshot))
+        previous = snapshot
+
+
+def test_trips_past_midnight_stay_in_their_service_day(tmp_path):
+    recorder = arrival_history.ArrivalHistoryRecorder(str(tmp_path))
+    start = int(datetime(2024, 5, 1, 23, 40, tzinfo=SERVICE_TIMEZONE).timestamp())
+    _run(recorder, start, 5400, '20240501')
+    recorder.close()
+    assert os.listdir(tmp_path) == ['20240501']
+    assert arrival_history.compact_day(str(tmp_path / '20240501')) > 0
+    hours = set(arrival_history.read_table(str(tmp_path / '20240501'), 'errors', arrival_history.ERROR_COLUMNS)['hour'])
+    assert hours == {23, 0}
+
+def test_hours_are_local_on_daylight_saving_days(tmp_path):
+    recorder = arrival_history.ArrivalHistoryRecorder(str(tmp_path))
+    # Clocks go from 2 am to 3 am on March 10, 2024
+    start = int(datetime(2024, 3, 10, 1, 30, tzinfo=SERVICE_TIMEZONE).timestamp())
+    _run(recorder, start, 3600, '20240309')
+    recorder.close()
+    arrival_history.compact_day(str(tmp_path / '20240309'))
+    hours = set(arrival_history.read_table(str(tmp_path / '20240309'), 'errors', arrival_history.ERROR_COLUMNS)['hour'])
+    assert hours == {1, 3}
+
+def test_day_of_counts_early_hours_in_previous_day():
+    assert arrival_history.day_of(int(datetime(2024, 5, 2, 1, 0, tzinfo=SERVICE_TIMEZONE).timestamp())) == '20240501'
+    assert arrival_history.day_of(int(datetime(2024, 5, 2, 5, 0, tzinfo=SERVICE_TIMEZONE).timestamp())) == '20240502'
+
+def test_vanished_trip_predictions_are_evicted(tmp_path):
+    recorder = arrival_history.ArrivalHistoryRecorder(str(tmp_path))
+    start = int(datetime(2024, 5, 1, 8, 0, tzinfo=SERVICE_TIMEZONE).timestamp())
+    vanishing = FeedSnapshot('', start, {'x': _trip('x', '20240501', [(stop_id, start + 60 * i) for i, stop_id in enumerate(STOPS)])}, {})
+    recorder.record('', vanishing, snapshot_diff.diff_snapshots(None, vanishing))
+    assert len(recorder._last_predictions) == len(STOPS)
+    later = FeedSnapshot('', start + arrival_history.PREDICTION_RETENTION_SECONDS + 3600, {}, {})
+    recorder.record('', later, snapshot_diff.diff_snapshots(later, later))
+    recorder.close()
+    assert not recorder._last_predictions
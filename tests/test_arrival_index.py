@@ -0,0 +1,50 @@
+import src.arrival_index as arrival_index
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.snapshot_diff as snapshot_diff
+from tests.feeds import make_subway_feed
+
+import pytest
+
+# TIMESTAMP -- The header timestamp of the first generated feed
+TIMESTAMP = 1714560000
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(mta_subway_fetcher, '_feed_cache', {})
+
+
+def _as_lists(index: dict) -> dict:
+    return {key: list(times) for key, times in index.items()}
+
+
+def test_next_arrivals_after_current_time():
+    snapshot = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(TIMESTAMP))
+    index = arrival_index.get_arrival_index(snapshot)
+    for (route_id, stop_id), times in index.items():
+        assert list(times) == sorted(times)
+        current_time = times[len(times) // 2]
+        expected = [t for t in times if t > current_time][:3]
+        assert arrival_index.next_arrivals(index, route_id, stop_id, current_time, 3) == expected
+    assert arrival_index.next_arrivals(index, '1', '999S', TIMESTAMP, 3) == []
+
+def test_published_index_equals_full_rebuild():
+    previous = None
+    # Repeated feeds reuse every record, other seeds change trips, and fewer trips per route remove some
+    for seed, trips_per_route in [(0, 20), (0, 20), (1, 20), (1, 15), (2, 20), (0, 20)]:
+        feed = make_subway_feed(TIMESTAMP, trips_per_route=trips_per_route, seed=seed)
+        snapshot = mta_subway_fetcher.bin_to_snapshot(feed, '', mta_subway_fetcher.get_cached_snapshot(''))
+        mta_subway_fetcher.publish_snapshot('', snapshot)
+        assert _as_lists(snapshot.arrival_index) == _as_lists(arrival_index.build_arrival_index(snapshot))
+        if previous is not None:
+            # The previous snapshot's index is still read by queries, so updating must not modify it
+            assert _as_lists(previous.arrival_index) == _as_lists(arrival_index.build_arrival_index(previous))
+        previous = snapshot
+
+def test_update_handles_removed_routes():
+    old = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(TIMESTAMP, routes=('1', '2')))
+    new = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(TIMESTAMP + 30, routes=('1',), seed=1))
+    changes = snapshot_diff.diff_snapshots(old, new)
+    updated = arrival_index.update_arrival_index(arrival_index.build_arrival_index(old), changes)
+    assert _as_lists(updated) == _as_lists(arrival_index.build_arrival_index(new))
+    assert not any(route_id == '2' for route_id, _ in updated)
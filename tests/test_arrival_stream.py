@@ -0,0 +1,96 @@
+import src.arrival_stream as arrival_stream
+import src.mta_subway_fetcher as mta_subway_fetcher
+from tests.feeds import make_subway_feed
+
+import json
+import time
+
+import pytest
+
+# KEYS -- Two stream keys on the numbered lines' feed group
+KEYS = [('1', '127', 'S', 3), ('2', '127N', 'N', 2)]
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    """
+    Start each test with no subscriptions, answering from published numbered-lines snapshots without fetching feeds.
+    Returns a function publishing a generated feed of a given seed.
+    """
+    monkeypatch.setattr(arrival_stream, '_subscriptions', {})
+    monkeypatch.setattr(arrival_stream, '_last_arrivals', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_feed_cache', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_polled_feed_groups', {''})
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', None)
+    # Trains arrive a minute or more from now, so none departs while a test runs
+    timestamp = int(time.time()) + 60
+
+    def publish(seed: int) -> None:
+        mta_subway_fetcher.publish_snapshot('', mta_subway_fetcher.bin_to_snapshot(make_subway_feed(timestamp, seed=seed), ''))
+
+    publish(0)
+    return publish
+
+def _events(subscription) -> list[dict]:
+    events = []
+    while not subscription.events.empty():
+        event = subscription.events.get_nowait()
+        assert event.startswith('id: ') and '\nevent: arrivals\n' in event
+        events.append(json.loads(event.split('data: ', 1)[1]))
+    return events
+
+
+def test_subscribe_sends_current_arrivals(feed):
+    subscription = arrival_stream.subscribe(KEYS + KEYS[:1])
+    events = _events(subscription)
+    assert [(event['line'], event['station_id'], event['direction'], event['count']) for event in events] == KEYS
+    assert all(event['arrivals'] and len(event['arrivals']) <= event['count'] for event in events)
+    assert set(arrival_stream._subscriptions) == set(KEYS)
+
+def test_only_changed_arrivals_are_sent(feed):
+    subscription = arrival_stream.subscribe(KEYS)
+    _events(subscription)
+    # The same trips again change nothing
+    feed(0)
+    assert _events(subscription) == []
+    feed(1)
+    assert len(_events(subscription)) == len(KEYS)
+
+def test_each_key_is_sent_to_every_subscriber(feed):
+    first = arrival_stream.subscribe(KEYS[:1])
+    second = arrival_stream.subscribe(KEYS)
+    _events(first)
+    _events(second)
+    feed(1)
+    assert _events(first) == _events(second)[:1]
+
+def test_unsubscribe_stops_tracking_unused_keys(feed):
+    first = arrival_stream.subscribe(KEYS[:1])
+    second = arrival_stream.subscribe(KEYS)
+    arrival_stream.unsubscribe(second)
+    assert second.closed
+    assert set(arrival_stream._subscriptions) == set(KEYS[:1])
+    assert set(arrival_stream._last_arrivals) == set(KEYS[:1])
+    _events(second)
+    feed(1)
+    assert _events(second) == []
+    arrival_stream.unsubscribe(first)
+    assert arrival_stream._subscriptions == {}
+    assert arrival_stream._last_arrivals == {}
+
+def test_closing_the_stream_unsubscribes(feed):
+    subscription = arrival_stream.subscribe(KEYS[:1])
+    stream = arrival_stream.event_stream(subscription, keepalive=0.01)
+    assert next(stream) == f"retry: {arrival_stream.STREAM_RETRY_MILLISECONDS}\n\n"
+    assert next(stream).startswith('id: ')
+    assert next(stream) == ": keepalive\n\n"
+    stream.close()
+    assert subscription.closed
+    assert arrival_stream._subscriptions == {}
+
+def test_slow_subscriber_is_closed(feed, monkeypatch):
+    monkeypatch.setattr(arrival_stream, 'STREAM_QUEUE_SIZE', 2)
+    subscription = arrival_stream.subscribe(KEYS)
+    feed(1)
+    assert subscription.closed
+    assert len(_events(subscription)) == 2
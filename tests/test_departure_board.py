@@ -0,0 +1,63 @@
+import src.arrival_index as arrival_index
+import src.departure_board as departure_board
+import src.mta_subway_fetcher as mta_subway_fetcher
+from tests.feeds import make_subway_feed
+
+import pytest
+
+# TIMESTAMP -- The header timestamp of the generated feed
+TIMESTAMP = 1714560000
+
+# BOARD_TIMES -- Times to compute boards at: before every arrival, while trains run, near the end of most trips, and after every arrival
+BOARD_TIMES = (TIMESTAMP - 60, TIMESTAMP + 600, TIMESTAMP + 3000, TIMESTAMP + 10000)
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return mta_subway_fetcher.bin_to_snapshot(make_subway_feed(TIMESTAMP, trips_per_route=60))
+
+def _expected_board(snapshot, current_time: int, count: int) -> dict:
+    """
+    Compute a board one key at a time with 'arrival_index.next_arrivals'.
+    """
+    index = arrival_index.get_arrival_index(snapshot)
+    board = {key: arrival_index.next_arrivals(index, key[0], key[1], current_time, count) for key in index}
+    return {key: times for key, times in board.items() if times}
+
+
+@pytest.mark.parametrize('current_time', BOARD_TIMES)
+@pytest.mark.parametrize('count', (1, 3, 5))
+def test_python_board_matches_next_arrivals(snapshot, monkeypatch, current_time, count):
+    monkeypatch.setattr(departure_board, 'np', None)
+    board = departure_board.build_departure_board(snapshot, current_time, count)
+    expected = _expected_board(snapshot, current_time, count)
+    assert board.keys == sorted(expected)
+    assert {key: board.get(*key) for key in board.keys} == expected
+
+@pytest.mark.parametrize('current_time', BOARD_TIMES)
+@pytest.mark.parametrize('count', (1, 3, 5))
+def test_numpy_board_matches_python_board(snapshot, monkeypatch, current_time, count):
+    if departure_board.np is None:
+        pytest.skip("numpy is not installed")
+    board = departure_board.build_departure_board(snapshot, current_time, count)
+    monkeypatch.setattr(departure_board, 'np', None)
+    python_board = departure_board.build_departure_board(snapshot, current_time, count)
+    assert board.keys == python_board.keys
+    assert list(board.offsets) == list(python_board.offsets)
+    assert list(board.times) == list(python_board.times)
+    assert board.to_dict() == python_board.to_dict()
+
+def test_empty_snapshot_board(monkeypatch):
+    snapshot = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(TIMESTAMP, routes=()))
+    assert len(departure_board.build_departure_board(snapshot, TIMESTAMP)) == 0
+    monkeypatch.setattr(departure_board, 'np', None)
+    assert len(departure_board.build_departure_board(snapshot, TIMESTAMP)) == 0
+
+def test_columns_are_built_once_per_snapshot(snapshot, monkeypatch):
+    if departure_board.np is None:
+        pytest.skip("numpy is not installed")
+    columns = departure_board.get_board_columns(snapshot)
+    monkeypatch.setattr(departure_board, 'BoardColumns', lambda index: pytest.fail("columns built again"))
+    for current_time in BOARD_TIMES:
+        assert departure_board.build_departure_board(snapshot, current_time).to_dict() == departure_board.build_departure_board(snapshot, current_time).to_dict()
+    assert snapshot.board_columns is columns
@@ -0,0 +1,68 @@
+import src.feed_recorder as feed_recorder
+from tests.feeds import make_subway_feed
+
+import os
+
+import pytest
+
+# TIMESTAMP -- The header timestamp of the first recorded feed
+TIMESTAMP = 1714560000
+
+
+class Clock:
+    """
+    Stands in for the time module in feed_recorder, so archives rotate without waiting.
+    """
+    now = TIMESTAMP
+
+    @classmethod
+    def time(cls) -> float:
+        return cls.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(Clock, 'now', TIMESTAMP)
+    monkeypatch.setattr(feed_recorder, 'time', Clock)
+    return Clock
+
+def _segments(directory) -> list[str]:
+    return sorted(name for name in os.listdir(directory / 'numbered') if name.endswith(feed_recorder.RECORDING_SUFFIX))
+
+
+def test_frames_round_trip(tmp_path, clock):
+    recorder = feed_recorder.FeedRecorder(str(tmp_path))
+    feeds = [(TIMESTAMP + 30 * i, make_subway_feed(TIMESTAMP + 30 * i, seed=i)) for i in range(5)]
+    for header_timestamp, data in feeds:
+        recorder.record('', header_timestamp, data)
+    recorder.record('-ace', TIMESTAMP, b'')
+    recorder.close()
+    assert list(feed_recorder.read_recording(str(tmp_path / 'numbered' / _segments(tmp_path)[0]))) == feeds
+    assert feed_recorder.load_recordings(str(tmp_path), ['', '-ace', '-g']) == {'': feeds, '-ace': [(TIMESTAMP, b'')]}
+
+def test_unclosed_archive_reads_complete_frames(tmp_path, clock):
+    recorder = feed_recorder.FeedRecorder(str(tmp_path))
+    feeds = [(TIMESTAMP + i, make_subway_feed(TIMESTAMP + i, seed=i)) for i in range(3)]
+    for header_timestamp, data in feeds:
+        recorder.record('', header_timestamp, data)
+    path = tmp_path / 'numbered' / _segments(tmp_path)[0]
+    # Without closing, every frame is readable after its sync flush
+    assert list(feed_recorder.read_recording(str(path))) == feeds
+    recorder.close()
+    # A file cut off mid-frame yields the frames before the cut
+    path.write_bytes(path.read_bytes()[:-40])
+    assert list(feed_recorder.read_recording(str(path))) == feeds[:2]
+
+def test_archives_rotate_and_oldest_are_deleted(tmp_path, clock):
+    recorder = feed_recorder.FeedRecorder(str(tmp_path), segment_seconds=60, max_segments=3)
+    for i in range(5):
+        clock.now = TIMESTAMP + 60 * i
+        recorder.record('', TIMESTAMP + 60 * i, b'feed %d' % i)
+        # Feeds within segment_seconds of the segment start are appended to it
+        clock.now += 30
+        recorder.record('', TIMESTAMP + 60 * i + 30, b'feed %d again' % i)
+    recorder.close()
+    segments = _segments(tmp_path)
+    assert len(segments) == 3
+    recordings = feed_recorder.load_recordings(str(tmp_path), [''])['']
+    assert [header_timestamp for header_timestamp, _ in recordings] == [TIMESTAMP + 60 * i + offset for i in (2, 3, 4) for offset in (0, 30)]
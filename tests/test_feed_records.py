@@ -0,0 +1,33 @@
+from src.feed_records import feedmessage_to_snapshot
+from src.gtfsproto import gtfs_realtime_pb2
+
+# TIMESTAMP -- The header timestamp of the built feed
+TIMESTAMP = 1714560000
+
+
+def _feed(skipped_stop: bool=True) -> gtfs_realtime_pb2.FeedMessage:
+    """
+    Build a feed of one trip whose middle stop, when 'skipped_stop' is set, has neither an arrival nor a departure time.
+    """
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '1.0'
+    feed.header.timestamp = TIMESTAMP
+    trip_update = feed.entity.add(id='1').trip_update
+    trip_update.trip.trip_id = '000100_1..S'
+    trip_update.trip.route_id = '1'
+    trip_update.stop_time_update.add(stop_id='101S').departure.time = TIMESTAMP + 60
+    if skipped_stop:
+        trip_update.stop_time_update.add(stop_id='102S')
+    trip_update.stop_time_update.add(stop_id='103S').arrival.time = TIMESTAMP + 180
+    return feed
+
+
+def test_stop_without_times_is_skipped():
+    trip = feedmessage_to_snapshot(_feed()).trips['000100_1..S']
+    assert [(stop.stop_id, stop.arrival, stop.departure) for stop in trip.stop_times] == [('101S', TIMESTAMP + 60, TIMESTAMP + 60), ('103S', TIMESTAMP + 180, TIMESTAMP + 180)]
+
+def test_unchanged_trip_with_stop_without_times_is_reused():
+    previous = feedmessage_to_snapshot(_feed())
+    assert feedmessage_to_snapshot(_feed(), previous=previous).trips['000100_1..S'] is previous.trips['000100_1..S']
+    # The same stop times without the empty stop are the same prediction
+    assert feedmessage_to_snapshot(_feed(skipped_stop=False), previous=previous).trips['000100_1..S'] is previous.trips['000100_1..S']
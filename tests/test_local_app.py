@@ -0,0 +1,57 @@
+import local_app
+import src.mta_subway_fetcher as mta_subway_fetcher
+from tests.feeds import make_subway_feed
+
+import time
+
+import pytest
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    A test client of the API answering from a published numbered-lines snapshot, without fetching feeds.
+    """
+    monkeypatch.setattr(mta_subway_fetcher, '_feed_cache', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_polled_feed_groups', {''})
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', None)
+    mta_subway_fetcher.publish_snapshot('', mta_subway_fetcher.bin_to_snapshot(make_subway_feed(int(time.time())), ''))
+    return local_app.app.test_client()
+
+
+def test_batch_post_counts_are_coerced_like_query_parameters(client):
+    queries = [{'line': '1', 'station': '127', 'direction': 'S', 'count': count} for count in (2, '2', True, '2.5', 2.5)]
+    results = client.post('/arrivals/batch', json=queries).get_json()['results']
+    assert results[0] == results[1]
+    assert 'error' not in results[0]
+    assert all('error' in result for result in results[2:])
+    get = client.get('/arrivals?line=1&station=127&direction=S&count=2').get_json()
+    assert get['arrivals'] == results[0]['arrivals']
+
+def test_bool_count_is_not_valid():
+    assert local_app.local_wip.validate_arrivals_query('1', '127', 'S', True) is not None
+    assert local_app.local_wip.validate_arrivals_query('1', '127', 'S', 1) is None
+
+class Timetable:
+    """
+    Stands in for the static timetable, scheduling a train every ten minutes.
+    """
+
+    def next_arrivals(self, route_id: str, stop_id: str, current_time: int, count: int) -> list[int]:
+        return [current_time + 600 * (i + 1) for i in range(count)]
+
+
+@pytest.mark.parametrize('path', ('/', '/arrivals?line=1&station=127&direction=S&count=3'))
+def test_scheduled_arrivals_without_real_time_data(path, monkeypatch):
+    monkeypatch.setattr(local_app, 'RESPONSE_CACHE', local_app.response_cache.ResponseCache())
+    monkeypatch.setattr(mta_subway_fetcher, 'get_realtime_data', lambda subway_line, as_dict=False: None)
+    monkeypatch.setattr(local_app.local_wip.static_timetable, 'get_static_timetable', Timetable)
+    response = local_app.app.test_client().get(path)
+    assert response.status_code == 200
+    assert "Real-time data for the 1 train is unavailable right now. Scheduled times:" in response.get_data(as_text=True)
+    assert "arriving in" in response.get_data(as_text=True)
+
+def test_home_page_without_real_time_data_or_timetable(monkeypatch):
+    monkeypatch.setattr(mta_subway_fetcher, 'get_realtime_data', lambda subway_line, as_dict=False: None)
+    monkeypatch.setattr(local_app.local_wip.static_timetable, 'get_static_timetable', lambda: None)
+    assert local_app.local_wip.catch_a_ride() == "Real-time data for the 1 train is unavailable right now."
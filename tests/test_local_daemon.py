@@ -0,0 +1,94 @@
+import local_client
+import local_daemon
+import src.mta_subway_fetcher as mta_subway_fetcher
+from tests.feeds import make_subway_feed
+
+import socket
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """
+    Answer requests from a published numbered-lines snapshot, without fetching feeds.
+    """
+    monkeypatch.setattr(mta_subway_fetcher, '_feed_cache', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_polled_feed_groups', {''})
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', None)
+    # Trains arrive a minute or more from now, so none departs while a test runs
+    mta_subway_fetcher.publish_snapshot('', mta_subway_fetcher.bin_to_snapshot(make_subway_feed(int(time.time()) + 60), ''))
+
+@pytest.fixture
+def socket_path(tmp_path, published):
+    """
+    Serve requests from a DaemonServer on a socket in a temporary directory, stopped after the test.
+    """
+    path = str(tmp_path / 'daemon.sock')
+    server = local_daemon.DaemonServer(path, local_daemon.DaemonRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('args, message', (
+    (['arrivals', '1', '127', 'S', '2'], {'command': 'arrivals', 'line': '1', 'station': '127', 'direction': 'S', 'count': 2}),
+    (['arrivals', '1', '127N'], {'command': 'arrivals', 'line': '1', 'station': '127N', 'direction': 'N', 'count': 3}),
+    (['stations', 'A', 'S'], {'command': 'stations', 'line': 'A', 'direction': 'S'}),
+    (['status'], {'command': 'status'}),
+))
+def test_parse_args(args, message):
+    assert local_client.parse_args(args) == message
+
+@pytest.mark.parametrize('args', ([], ['arrivals', '1'], ['arrivals', '1', '127', 'S', 'two'], ['arrivals', '1', '127', 'S', '3', 'x'],
+                                  ['stations', 'A'], ['status', 'now'], ['board']))
+def test_parse_args_rejects_unknown_commands(args):
+    assert local_client.parse_args(args) is None
+
+def test_arrivals_request(published):
+    response = local_daemon.handle_request(local_client.parse_args(['arrivals', '1', '127S', 'S', '2']))
+    assert 'error' not in response
+    result = response['result']
+    assert (result['line'], result['station_id'], result['direction'], result['count']) == ('1', '127S', 'S', 2)
+    assert result['arrivals'] == local_daemon.local_wip.get_arrivals('1', '127S', 'S', 2)['arrivals']
+    assert 0 < len(result['arrivals']) <= 2
+
+@pytest.mark.parametrize('message', (
+    {'command': 'arrivals', 'line': 'X', 'station': '127', 'direction': 'S', 'count': 3},
+    {'command': 'arrivals', 'line': '1', 'station': '127', 'direction': 'S', 'count': 9},
+    {'command': 'arrivals', 'line': '1', 'station': '127', 'direction': 'S', 'count': True},
+    {'command': 'stations', 'line': 'X', 'direction': 'S'},
+    {'command': 'stations', 'line': '1', 'direction': 'E'},
+    {'command': 'board'},
+    {},
+))
+def test_invalid_requests_are_answered_with_an_error(published, message):
+    response = local_daemon.handle_request(message)
+    assert set(response) == {'error'}
+
+def test_stations_and_status_requests(published):
+    stations = local_daemon.handle_request({'command': 'stations', 'line': '1', 'direction': 'S'})['result']
+    assert {'station_id': '127S', 'station_name': 'Times Sq-42 St'} in stations
+    ages = local_daemon.handle_request({'command': 'status'})['result']['snapshot_age_seconds']
+    assert 'numbered' in ages
+
+def test_requests_over_the_socket(socket_path):
+    response = local_client.send_request(local_client.parse_args(['arrivals', '1', '127', 'S']), socket_path)
+    assert response['result']['arrivals']
+    assert local_client.send_request({'command': 'board'}, socket_path) == {'error': "Unknown command 'board'."}
+    # Each line is answered on the same connection, including ones that are not requests
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(5)
+        client.connect(socket_path)
+        client.sendall(b'not json\n[1, 2]\n{"command": "status"}\n')
+        lines = b''
+        while lines.count(b'\n') < 3:
+            lines += client.recv(65536)
+    invalid, not_object, status = lines.decode('utf-8').splitlines()
+    assert invalid.startswith('{"error": "Invalid request')
+    assert not_object == '{"error": "Expected a JSON object."}'
+    assert '"result"' in status
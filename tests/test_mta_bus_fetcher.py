@@ -0,0 +1,145 @@
+import src.mta_bus_fetcher as mta_bus_fetcher
+from src.gtfsproto import gtfs_realtime_pb2
+from tests.feeds import make_bus_feed
+
+import collections
+import io
+import time
+
+import pytest
+from google.protobuf.message import DecodeError
+
+# TIMESTAMP -- The header timestamp of the generated feed
+TIMESTAMP = 1714560000
+
+# SUBSCRIPTIONS -- One route at a stop, every route at a stop, every stop of a route, and a stop the route does not serve
+SUBSCRIPTIONS = frozenset({('B5', '305010'), ('', '307020'), ('B9', ''), ('B1', '999')})
+
+
+class TrickleStream:
+    """
+    A stream returning at most a few bytes per read, like an HTTP response arriving in small pieces.
+    """
+
+    def __init__(self, data: bytes, chunk: int=7):
+        self._stream = io.BytesIO(data)
+        self._chunk = chunk
+
+    def read(self, size: int=-1) -> bytes:
+        return self._stream.read(min(size, self._chunk) if size >= 0 else self._chunk)
+
+
+@pytest.fixture(scope='module')
+def feed():
+    return make_bus_feed(TIMESTAMP)
+
+def _brute_force_index(data: bytes, subscriptions: frozenset, max_per_stop: int) -> dict:
+    """
+    Find the earliest arrivals of subscribed routes and stops by parsing the whole feed at once.
+    """
+    arrivals = {}
+    for entity in gtfs_realtime_pb2.FeedMessage.FromString(data).entity:
+        if not entity.HasField('trip_update'):
+            continue
+        route_id = entity.trip_update.trip.route_id
+        for update in entity.trip_update.stop_time_update:
+            if (route_id, update.stop_id) in subscriptions or ('', update.stop_id) in subscriptions or (route_id, '') in subscriptions:
+                arrivals.setdefault((route_id, update.stop_id), []).append(update.arrival.time)
+    return {key: sorted(times)[:max_per_stop] for key, times in arrivals.items()}
+
+
+@pytest.mark.parametrize('max_per_stop', (1, 3, mta_bus_fetcher.BUS_MAX_ARRIVALS_PER_STOP))
+def test_streamed_index_matches_brute_force(feed, max_per_stop):
+    snapshot = mta_bus_fetcher.stream_to_snapshot(TrickleStream(feed), SUBSCRIPTIONS, max_per_stop)
+    assert snapshot.timestamp == TIMESTAMP
+    assert snapshot.index_only
+    assert {key: list(times) for key, times in snapshot.arrival_index.items()} == _brute_force_index(feed, SUBSCRIPTIONS, max_per_stop)
+
+def test_no_subscriptions_keep_nothing(feed):
+    snapshot = mta_bus_fetcher.stream_to_snapshot(io.BytesIO(feed), frozenset())
+    assert snapshot.timestamp == TIMESTAMP
+    assert snapshot.arrival_index == {}
+
+def test_truncated_feed_is_an_error(feed):
+    with pytest.raises(DecodeError):
+        mta_bus_fetcher.stream_to_snapshot(io.BytesIO(feed[:-5]), SUBSCRIPTIONS)
+
+def test_next_bus_arrivals_across_routes(feed):
+    snapshot = mta_bus_fetcher.stream_to_snapshot(io.BytesIO(feed), SUBSCRIPTIONS)
+    arrivals = mta_bus_fetcher.next_bus_arrivals(snapshot, '307020', '', TIMESTAMP, 3)
+    assert arrivals == sorted(arrivals)
+    assert len(arrivals) == 3
+    assert all(arrival > TIMESTAMP and route_id == 'B7' for arrival, route_id in arrivals)
+
+
+@pytest.fixture
+def bus_fetcher(monkeypatch, feed):
+    """
+    Start each test with no subscriptions or cached feed, and decode the generated feed instead of fetching it, counting the fetches.
+    """
+    monkeypatch.setattr(mta_bus_fetcher, '_subscriptions', {})
+    monkeypatch.setattr(mta_bus_fetcher, '_new_subscription_times', collections.deque())
+    monkeypatch.setattr(mta_bus_fetcher, '_bus_cache', None)
+    monkeypatch.setattr(mta_bus_fetcher, '_bus_failed_at', 0)
+    fetches = []
+
+    def fetch_bus_snapshot(subscriptions=None, deadline=None):
+        fetches.append(deadline)
+        return mta_bus_fetcher.stream_to_snapshot(io.BytesIO(feed), subscriptions)
+
+    monkeypatch.setattr(mta_bus_fetcher, 'fetch_bus_snapshot', fetch_bus_snapshot)
+    return fetches
+
+def _age_cache(seconds: float) -> None:
+    fetched_at, snapshot, subscriptions = mta_bus_fetcher._bus_cache
+    mta_bus_fetcher._bus_cache = (fetched_at - seconds, snapshot, subscriptions)
+
+
+def test_new_stop_is_pending_until_next_refresh(bus_fetcher):
+    first = mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    assert len(first['arrivals']) == 3
+    assert not first['pending']
+    # A new stop does not refetch a young feed
+    pending = mta_bus_fetcher.get_bus_arrivals('307020', '', 3, TIMESTAMP)
+    assert pending['pending']
+    assert pending['arrivals'] is None
+    assert len(bus_fetcher) == 1
+    # Once the feed is BUS_NEW_STOP_REFETCH_SECONDS old, the new stop refreshes it early
+    _age_cache(mta_bus_fetcher.BUS_NEW_STOP_REFETCH_SECONDS)
+    refreshed = mta_bus_fetcher.get_bus_arrivals('307020', '', 3, TIMESTAMP)
+    assert not refreshed['pending']
+    assert len(refreshed['arrivals']) == 3
+    assert len(bus_fetcher) == 2
+
+def test_known_stop_is_served_until_ttl(bus_fetcher):
+    mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    _age_cache(mta_bus_fetcher.BUS_NEW_STOP_REFETCH_SECONDS)
+    mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    assert len(bus_fetcher) == 1
+
+def test_request_fetch_has_deadline(bus_fetcher):
+    mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    assert bus_fetcher == [mta_bus_fetcher.mta_subway_fetcher.FEED_REQUEST_DEADLINE_SECONDS]
+
+def test_new_subscriptions_are_rate_limited(bus_fetcher):
+    for i in range(mta_bus_fetcher.BUS_NEW_SUBSCRIPTIONS_PER_MINUTE):
+        assert mta_bus_fetcher.subscribe(str(400000 + i)) is True
+    assert mta_bus_fetcher.subscribe('499999') is None
+    assert mta_bus_fetcher.get_bus_arrivals('499999', '', 3, TIMESTAMP) is None
+    # Known stops are still answered
+    assert mta_bus_fetcher.subscribe('400000') is False
+    # The limit is per minute
+    mta_bus_fetcher._new_subscription_times[0] -= 60
+    assert mta_bus_fetcher.subscribe('499999') is True
+
+def test_failed_fetch_serves_stale_feed_without_refetching(bus_fetcher, monkeypatch):
+    mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    _age_cache(mta_bus_fetcher.BUS_CACHE_TTL_SECONDS)
+    failures = []
+    monkeypatch.setattr(mta_bus_fetcher, 'fetch_bus_snapshot', lambda subscriptions=None, deadline=None: failures.append(deadline))
+    stale = mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    assert stale['stale']
+    assert len(stale['arrivals']) == 3
+    mta_bus_fetcher.get_bus_arrivals('305010', 'B5', 3, TIMESTAMP)
+    assert len(failures) == 1
+    assert time.time() - mta_bus_fetcher._bus_failed_at < mta_bus_fetcher.mta_subway_fetcher.FEED_CACHE_MIN_REFETCH_SECONDS
@@ -0,0 +1,72 @@
+import src.mta_stops_to_stations as mta_stops_to_stations
+
+import random
+
+import pytest
+
+
+def _positions(sequence: list[str]) -> dict[str, int]:
+    return {stop_id: i for i, stop_id in enumerate(sequence)}
+
+
+def test_merge_inserts_after_previous_stop():
+    sequence = ['a', 'b', 'd']
+    positions = _positions(sequence)
+    assert mta_stops_to_stations.merge_stop_sequence(sequence, ['a', 'b', 'c', 'd'], positions)
+    assert sequence == ['a', 'b', 'c', 'd']
+    assert positions == _positions(sequence)
+
+def test_merge_inserts_leading_stops_before_first_known_stop():
+    sequence = ['c', 'd']
+    positions = _positions(sequence)
+    assert mta_stops_to_stations.merge_stop_sequence(sequence, ['a', 'b', 'c'], positions)
+    assert sequence == ['a', 'b', 'c', 'd']
+    assert positions == _positions(sequence)
+
+def test_merge_of_known_stops_adds_nothing():
+    sequence = ['a', 'b', 'c']
+    assert not mta_stops_to_stations.merge_stop_sequence(sequence, ['b', 'c'])
+    assert sequence == ['a', 'b', 'c']
+
+def test_merge_keeps_looping_trip_stops_unique():
+    sequence = []
+    positions = {}
+    mta_stops_to_stations.merge_stop_sequence(sequence, ['a', 'b', 'c', 'a', 'b'], positions)
+    assert sequence == ['a', 'b', 'c']
+    assert positions == _positions(sequence)
+
+def test_positions_stay_in_step_with_sequence():
+    rnd = random.Random(0)
+    sequence = []
+    positions = {}
+    for _ in range(200):
+        start = rnd.randrange(0, 40)
+        trip = [f"s{start + i}" for i in range(rnd.randrange(1, 20)) if rnd.random() < 0.8]
+        mta_stops_to_stations.merge_stop_sequence(sequence, trip, positions)
+        assert len(set(sequence)) == len(sequence)
+        assert positions == _positions(sequence)
+
+
+class Timetable:
+    """
+    Stands in for the static timetable, scheduling the 1 line's southbound stops against station ID order.
+    """
+
+    def stop_order(self, route_id: str, direction: str) -> list[str]:
+        return ['101S', '104S', '103S', '150S'] if (route_id, direction) == ('1', 'S') else []
+
+
+@pytest.fixture
+def no_live_stations(monkeypatch):
+    monkeypatch.setattr(mta_stops_to_stations, '_station_sequences', {})
+    monkeypatch.setattr(mta_stops_to_stations, '_station_positions', {})
+    monkeypatch.setattr(mta_stops_to_stations, '_static_stations', {'1': ['103', '101', '104', '105']})
+
+def test_fallback_station_list_follows_timetable_order(no_live_stations, monkeypatch):
+    monkeypatch.setattr(mta_stops_to_stations.static_timetable, 'get_static_timetable', Timetable)
+    # Scheduled stations come in travel order, then regular service stations the timetable does not schedule
+    assert mta_stops_to_stations.get_station_list('1', 'S', refresh=False) == ['101S', '104S', '103S', '105S']
+
+def test_fallback_station_list_without_timetable(no_live_stations, monkeypatch):
+    monkeypatch.setattr(mta_stops_to_stations.static_timetable, 'get_static_timetable', lambda: None)
+    assert mta_stops_to_stations.get_station_list('1', 'N', refresh=False) == ['105N', '104N', '103N', '101N']
@@ -0,0 +1,107 @@
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.feed_poller as feed_poller
+from tests.feeds import make_subway_feed
+
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    """
+    Start each test with no cached feeds or breaker state, and record the calls to 'api_to_bin' instead of making requests.
+    Set 'fetcher.responses' to the feed bytes (or None for a failed fetch) returned by each call in turn.
+    """
+    monkeypatch.setattr(mta_subway_fetcher, '_feed_cache', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_circuit_breakers', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_polled_feed_groups', set())
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', None)
+
+    class Fetcher:
+        calls = []
+        responses = []
+
+    def api_to_bin(api_url, attempts=mta_subway_fetcher.FEED_RETRY_ATTEMPTS, deadline=None):
+        Fetcher.calls.append((api_url, attempts, deadline))
+        return Fetcher.responses.pop(0) if Fetcher.responses else None
+
+    monkeypatch.setattr(mta_subway_fetcher, 'api_to_bin', api_to_bin)
+    return Fetcher
+
+def _publish_old_snapshot(feed_group: str, age: float):
+    """
+    Publish a snapshot of a feed group as if it had been fetched 'age' seconds ago.
+    """
+    snapshot = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(int(time.time() - age)), feed_group)
+    mta_subway_fetcher.publish_snapshot(feed_group, snapshot)
+    fetched_at, header_timestamp, _ = mta_subway_fetcher._feed_cache[feed_group]
+    mta_subway_fetcher._feed_cache[feed_group] = (fetched_at - age, header_timestamp, snapshot)
+    return snapshot
+
+
+def test_breaker_opens_after_threshold(fetcher):
+    for _ in range(mta_subway_fetcher.CIRCUIT_BREAKER_THRESHOLD):
+        assert mta_subway_fetcher.fetch_feed_group('') is None
+    assert len(fetcher.calls) == mta_subway_fetcher.CIRCUIT_BREAKER_THRESHOLD
+    # An open breaker answers without requesting the feed
+    assert mta_subway_fetcher.fetch_feed_group('') is None
+    assert len(fetcher.calls) == mta_subway_fetcher.CIRCUIT_BREAKER_THRESHOLD
+    assert mta_subway_fetcher._circuit_is_open('', time.time())
+
+def test_breaker_closes_after_success(fetcher):
+    fetcher.responses = [None, make_subway_feed(int(time.time()))]
+    assert mta_subway_fetcher.fetch_feed_group('') is None
+    assert '' in mta_subway_fetcher._circuit_breakers
+    assert mta_subway_fetcher.fetch_feed_group('') is not None
+    assert '' not in mta_subway_fetcher._circuit_breakers
+
+def test_failed_fetch_serves_stale_snapshot(fetcher):
+    cached = _publish_old_snapshot('', 600)
+    snapshot = mta_subway_fetcher.get_realtime_data('1')
+    assert snapshot is cached
+    assert snapshot.stale
+    assert len(fetcher.calls) == 1
+
+def test_request_fetch_is_tried_once_within_deadline(fetcher):
+    _publish_old_snapshot('', 600)
+    mta_subway_fetcher.get_realtime_data('1')
+    _, attempts, deadline = fetcher.calls[0]
+    assert attempts == 1
+    assert deadline == mta_subway_fetcher.FEED_REQUEST_DEADLINE_SECONDS
+
+def test_recent_failure_is_not_refetched(fetcher):
+    _publish_old_snapshot('', 600)
+    mta_subway_fetcher.get_realtime_data('1')
+    # Requests that waited on the failed fetch are answered from the stale snapshot
+    assert mta_subway_fetcher.get_realtime_data('2').stale
+    assert len(fetcher.calls) == 1
+
+def test_successful_fetch_replaces_stale_snapshot(fetcher):
+    cached = _publish_old_snapshot('', 600)
+    fetcher.responses = [make_subway_feed(int(time.time()), seed=1)]
+    snapshot = mta_subway_fetcher.get_realtime_data('1')
+    assert snapshot is not cached
+    assert not snapshot.stale
+    assert mta_subway_fetcher.get_cached_snapshot('') is snapshot
+
+def test_polled_group_is_served_from_cache(fetcher):
+    cached = _publish_old_snapshot('', 600)
+    mta_subway_fetcher.set_polled('', True)
+    assert mta_subway_fetcher.get_realtime_data('1') is cached
+    assert not fetcher.calls
+
+def test_poller_refresh_holds_feed_group_lock(fetcher, monkeypatch):
+    locked = []
+    fetch_feed_group = mta_subway_fetcher.fetch_feed_group
+
+    def fetch_while_checking_lock(feed_group, parallel=False, deadline=None):
+        locked.append(mta_subway_fetcher._get_feed_group_lock(feed_group).locked())
+        return fetch_feed_group(feed_group, parallel, deadline)
+
+    monkeypatch.setattr(mta_subway_fetcher, 'fetch_feed_group', fetch_while_checking_lock)
+    fetcher.responses = [None, make_subway_feed(int(time.time()))]
+    assert not feed_poller.FeedPoller(['']).refresh('')
+    assert feed_poller.FeedPoller(['']).refresh('')
+    assert locked == [True, True]
+    assert mta_subway_fetcher._feed_cache[''][2] is not None
@@ -0,0 +1,161 @@
+import local_app
+import src.alert_store as alert_store
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.response_cache as response_cache
+from src.feed_records import AlertRecord, FeedSnapshot
+from tests.feeds import make_subway_feed
+
+import time
+
+import pytest
+
+# TIMESTAMP -- A time at the start of a cache time bucket (a whole minute)
+TIMESTAMP = 1714560000
+
+
+class Renderer:
+    """
+    A render callable counting its calls.
+    """
+
+    def __init__(self, body: str='body'):
+        self.body = body
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        return self.body
+
+
+class FrozenTime:
+    """
+    Stands in for the time module in local_app, so a minute rolling over between two requests does not change the response.
+    """
+    now = time.time()
+    perf_counter = staticmethod(time.perf_counter)
+
+    @classmethod
+    def time(cls) -> float:
+        return cls.now
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    A test client of the API answering from a published numbered-lines snapshot, without fetching feeds, at a fixed time.
+    """
+    monkeypatch.setattr(local_app, 'time', FrozenTime)
+    monkeypatch.setattr(mta_subway_fetcher, '_feed_cache', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_polled_feed_groups', {''})
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', None)
+    monkeypatch.setattr(local_app, 'RESPONSE_CACHE', response_cache.ResponseCache())
+    mta_subway_fetcher.publish_snapshot('', mta_subway_fetcher.bin_to_snapshot(make_subway_feed(int(time.time())), ''))
+    return local_app.app.test_client()
+
+
+def test_hit_within_snapshot_and_bucket():
+    cache = response_cache.ResponseCache()
+    snapshot = FeedSnapshot('', TIMESTAMP, {}, {})
+    render = Renderer()
+    first = cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP, render)
+    second = cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP + response_cache.RESPONSE_CACHE_BUCKET_SECONDS - 1, render)
+    assert second is first
+    assert render.calls == 1
+
+def test_miss_on_new_snapshot_bucket_or_staleness():
+    cache = response_cache.ResponseCache()
+    snapshot = FeedSnapshot('', TIMESTAMP, {}, {})
+    render = Renderer()
+    cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP, render)
+    cache.get_or_render('arrivals', ('1',), FeedSnapshot('', TIMESTAMP + 30, {}, {}), TIMESTAMP, render)
+    cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP + response_cache.RESPONSE_CACHE_BUCKET_SECONDS, render)
+    snapshot.stale = True
+    cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP, render)
+    assert render.calls == 4
+
+def test_miss_when_alerts_change(monkeypatch):
+    for name in ('_alerts', '_alerts_by_route', '_alerts_by_station', '_short_texts'):
+        monkeypatch.setattr(alert_store, name, {})
+    monkeypatch.setattr(alert_store, '_version', 0)
+    cache = response_cache.ResponseCache()
+    snapshot = FeedSnapshot('', TIMESTAMP, {}, {})
+    render = Renderer()
+    alert = AlertRecord('alert-1', (), (('1', ''),), 'SIGNIFICANT_DELAYS', 'Delays on [1] trains', '')
+    cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP, render)
+    # Publishing the same alerts again does not change the version
+    for alerts in ({alert.alert_id: alert}, {alert.alert_id: alert}, {}):
+        alert_store.update_alerts('-ace', FeedSnapshot('-ace', TIMESTAMP, {}, {}, alerts))
+        cache.get_or_render('arrivals', ('1',), snapshot, TIMESTAMP, render)
+    assert render.calls == 3
+
+def test_minute_counts_end_the_response():
+    # Arriving in 2 minutes 5 seconds, shown as 2 minutes until 1 minute 59 seconds are left
+    assert response_cache.next_minute_change([TIMESTAMP + 125], TIMESTAMP) == TIMESTAMP + 6
+    assert response_cache.next_minute_change([TIMESTAMP + 125, TIMESTAMP + 240], TIMESTAMP + 3) == TIMESTAMP + 6
+    assert response_cache.next_minute_change([TIMESTAMP + 180], TIMESTAMP) == TIMESTAMP + 1
+    # Within its last minute an arrival only changes the response when it leaves it
+    assert response_cache.next_minute_change([TIMESTAMP + 20], TIMESTAMP) == TIMESTAMP + 20
+    assert response_cache.next_minute_change([], TIMESTAMP + 10) == TIMESTAMP + response_cache.RESPONSE_CACHE_BUCKET_SECONDS
+
+def test_expired_response_is_rendered_again():
+    cache = response_cache.ResponseCache()
+    calls = []
+
+    def render():
+        calls.append(None)
+        return f"body {len(calls)}", TIMESTAMP + 6
+
+    first = cache.get_or_render('arrivals', ('1',), None, TIMESTAMP, render)
+    assert cache.get_or_render('arrivals', ('1',), None, TIMESTAMP + 5, render) is first
+    assert first.max_age(TIMESTAMP + 5) == 1
+    second = cache.get_or_render('arrivals', ('1',), None, TIMESTAMP + 6, render)
+    assert second.body == b'body 2' and len(cache) == 1
+
+def test_least_recently_used_is_evicted():
+    cache = response_cache.ResponseCache(max_entries=2)
+    render = Renderer()
+    for query in (('a',), ('b',), ('a',), ('c',)):
+        cache.get_or_render('arrivals', query, None, TIMESTAMP, render)
+    assert len(cache) == 2
+    cache.get_or_render('arrivals', ('a',), None, TIMESTAMP, render)
+    assert render.calls == 3
+    cache.get_or_render('arrivals', ('b',), None, TIMESTAMP, render)
+    assert render.calls == 4
+
+def test_etag_follows_body_and_max_age_ends_with_bucket():
+    cache = response_cache.ResponseCache()
+    same = cache.get_or_render('arrivals', ('a',), None, TIMESTAMP, Renderer('x'))
+    other = cache.get_or_render('arrivals', ('b',), None, TIMESTAMP, Renderer('x'))
+    changed = cache.get_or_render('arrivals', ('c',), None, TIMESTAMP, Renderer('y'))
+    assert same.etag == other.etag != changed.etag
+    assert same.max_age(TIMESTAMP) == response_cache.RESPONSE_MAX_AGE_SECONDS
+    assert same.max_age(TIMESTAMP + response_cache.RESPONSE_CACHE_BUCKET_SECONDS - 5) == 5
+
+def test_arrivals_revalidate_with_304(client):
+    response = client.get('/arrivals?line=1&station=127&direction=S&count=3')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'].startswith('max-age=')
+    revalidated = client.get('/arrivals?line=1&station=127&direction=S&count=3', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert client.get('/arrivals?line=1&station=127&direction=S&count=2', headers={'If-None-Match': etag}).status_code == 200
+
+def test_new_snapshot_changes_etag(client):
+    etag = client.get('/arrivals?line=1&station=127&direction=S').headers['ETag']
+    mta_subway_fetcher.publish_snapshot('', mta_subway_fetcher.bin_to_snapshot(make_subway_feed(int(time.time()) + 1, seed=1), ''))
+    response = client.get('/arrivals?line=1&station=127&direction=S', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_cached_minutes_are_never_out_of_date(client, monkeypatch):
+    renders = []
+    get_arrivals = local_app.local_wip.get_arrivals
+    monkeypatch.setattr(local_app.local_wip, 'get_arrivals', lambda *args: renders.append(args) or get_arrivals(*args))
+    start = int(FrozenTime.now)
+    for now in range(start, start + 180):
+        monkeypatch.setattr(FrozenTime, 'now', now)
+        body = client.get('/arrivals?line=1&station=127&direction=S&count=3').get_json()
+        assert all(arrival > now for arrival in body['arrivals'])
+        assert body['minutes'] == [(arrival - now) // 60 for arrival in body['arrivals']]
+    assert len(renders) < 30
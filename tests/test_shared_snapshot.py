@@ -0,0 +1,78 @@
+import local_app
+import src.alert_store as alert_store
+import src.arrival_index as arrival_index
+import src.mta_stops_to_stations as mta_stops_to_stations
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.shared_snapshot as shared_snapshot
+from src.feed_records import AlertRecord
+from tests.feeds import make_subway_feed
+
+import time
+
+import pytest
+
+# ALERT -- An alert on the whole 1 line, published with the snapshot
+ALERT = AlertRecord('alert-1', (), (('1', ''),), 'SIGNIFICANT_DELAYS', 'Delays on [1] trains', '')
+
+# REROUTED_STATION -- A station off the 1 line's regular route, only in the publisher's merged station sequences
+REROUTED_STATION = 'A27'
+
+
+@pytest.fixture
+def published(tmp_path, monkeypatch):
+    """
+    Publish a numbered-lines snapshot with an alert and merged station sequences, then serve it to this process as a worker would:
+    from a SharedSnapshotReader, with no station sequences or alerts of its own.
+    """
+    for module, name in ((mta_stops_to_stations, '_station_sequences'), (mta_stops_to_stations, '_station_positions'), (mta_stops_to_stations, '_source_snapshots'),
+                         (alert_store, '_alerts'), (alert_store, '_alerts_by_route'), (alert_store, '_alerts_by_station'), (alert_store, '_short_texts'),
+                         (alert_store, '_source_snapshots'), (mta_subway_fetcher, '_feed_cache')):
+        monkeypatch.setattr(module, name, {})
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', None)
+    snapshot = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(int(time.time()) + 60), '')
+    snapshot.alerts = {ALERT.alert_id: ALERT}
+    mta_stops_to_stations._station_sequences[('1', 'S')] = ['101S', f'{REROUTED_STATION}S']
+    shared_snapshot.SharedSnapshotWriter(str(tmp_path)).publish('', snapshot)
+    monkeypatch.setattr(mta_stops_to_stations, '_station_sequences', {})
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_source', shared_snapshot.SharedSnapshotReader(str(tmp_path), check_seconds=0))
+    return snapshot
+
+
+def test_arrival_index_is_served_from_the_mapping(published):
+    shared = mta_subway_fetcher.get_realtime_data('1')
+    assert isinstance(shared, shared_snapshot.SharedFeedSnapshot)
+    assert shared.feed_group == '' and shared.timestamp == published.timestamp
+    index = arrival_index.get_arrival_index(published)
+    assert sorted(shared.arrival_index) == sorted(index)
+    assert all(list(shared.arrival_index[key]) == list(times) for key, times in index.items())
+
+def test_records_are_loaded_only_when_used(published):
+    response = local_app.app.test_client().get('/arrivals?line=1&station=127&direction=S&count=3')
+    assert response.status_code == 200
+    assert response.get_json()['arrivals']
+    # Alerts are part of every answer, but trips and vehicles are not needed for it
+    shared = mta_subway_fetcher.get_realtime_data('1')
+    assert set(shared._records) == {'alerts'}
+    assert {trip_id: trip.stop_times[-1].arrival for trip_id, trip in shared.trips.items()} == {trip_id: trip.stop_times[-1].arrival for trip_id, trip in published.trips.items()}
+    assert set(shared.vehicles) == set(published.vehicles)
+
+def test_workers_do_not_run_snapshot_listeners(published, monkeypatch):
+    calls = []
+    monkeypatch.setattr(mta_subway_fetcher, '_snapshot_listeners', [lambda feed_group, snapshot, changes: calls.append(feed_group)])
+    assert mta_subway_fetcher.get_realtime_data('1') is not None
+    assert mta_subway_fetcher.get_cached_snapshot('') is mta_subway_fetcher.get_realtime_data('2')
+    assert calls == []
+
+def test_alerts_and_station_lists_come_from_the_publisher(published):
+    assert [alert['id'] for alert in alert_store.get_alert_summaries('1', '127S')] == [ALERT.alert_id]
+    assert mta_stops_to_stations.is_station_on_line('1', REROUTED_STATION)
+    assert not mta_stops_to_stations.is_station_on_line('1', 'A28')
+
+def test_new_version_replaces_the_served_snapshot(published, tmp_path):
+    first = mta_subway_fetcher.get_realtime_data('1')
+    newer = mta_subway_fetcher.bin_to_snapshot(make_subway_feed(published.timestamp + 30, seed=1), '')
+    shared_snapshot.SharedSnapshotWriter(str(tmp_path)).publish('', newer)
+    second = mta_subway_fetcher.get_realtime_data('1')
+    assert second is not first
+    assert second.timestamp == newer.timestamp
+    assert alert_store.get_alert_summaries('1') == []
@@ -0,0 +1,51 @@
+import src.static_index as static_index
+
+import csv
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def stops():
+    with open('data/stops.csv', 'r') as f:
+        return list(csv.DictReader(f))
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    output_path = tmp_path_factory.mktemp('static_index') / 'static_index.bin'
+    static_index.compile_static_index(output_path=str(output_path))
+    return static_index.StaticIndex(str(output_path))
+
+
+def test_stops_round_trip(index, stops):
+    assert len(index.stop_ids) == len(stops)
+    for row in stops:
+        assert row['stop_id'] in index
+        assert index.stop_name(row['stop_id']) == row['stop_name']
+        assert index.parent_station(row['stop_id']) == (row['parent_station'] or None)
+        assert index.stop_location(row['stop_id']) == (float(row['stop_lat']), float(row['stop_lon']))
+        assert row['stop_id'] in index.stop_ids_for_name(row['stop_name'])
+
+def test_routes_round_trip(index):
+    with open('data/routes.csv', 'r') as f:
+        routes = list(csv.DictReader(f))
+    for row in routes:
+        assert index.route(row['route_id']) == {'route_id': row['route_id'], 'short_name': row['route_short_name'], 'long_name': row['route_long_name'],
+                                                'color': row['route_color'], 'text_color': row['route_text_color'], 'sort_order': int(row['route_sort_order'] or 0)}
+
+@pytest.mark.parametrize('stop_id', ('', '000', '127X', 'ZZZ', '\uffff'))
+def test_unknown_stop_ids(index, stop_id):
+    assert stop_id not in index
+    assert index.stop_name(stop_id) is None
+    assert index.parent_station(stop_id) is None
+    assert index.stop_location(stop_id) is None
+
+def test_unknown_names_and_routes(index):
+    assert index.stop_ids_for_name('Nowhere') == []
+    assert index.route('ZZ') is None
+
+def test_wrong_file_is_refused(tmp_path):
+    path = tmp_path / 'not_an_index.bin'
+    path.write_bytes(b'CARTTBL1' + b'\0' * 64)
+    with pytest.raises(ValueError):
+        static_index.StaticIndex(str(path))
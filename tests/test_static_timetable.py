@@ -0,0 +1,131 @@
+import src.static_timetable as static_timetable
+
+import shutil
+import zipfile
+from datetime import datetime
+
+import pytest
+
+# CALENDAR -- Weekday service, and Saturday service with one cancelled Saturday
+CALENDAR = """service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+WKD,1,1,1,1,1,0,0,20240101,20241231
+SAT,0,0,0,0,0,1,0,20240101,20241231
+SUN,0,0,0,0,0,0,1,20240101,20241231
+"""
+CALENDAR_DATES = """service_id,date,exception_type
+SAT,20240518,2
+"""
+TRIPS = """route_id,service_id,trip_id
+1,WKD,wkd_late
+1,WKD,wkd_noon
+1,SAT,sat_morning
+1,SUN,sun_early
+1,SUN,sun_noon
+A,WKD,a_far
+A,WKD,a_lefferts
+A,WKD,a_short
+"""
+# STOP_TIMES -- The weekday late trip runs past midnight into Saturday, with times over 24 hours. The A trips split into two branches after A03S,
+# and one of them is listed out of stop_sequence order.
+STOP_TIMES = """trip_id,arrival_time,departure_time,stop_id,stop_sequence
+wkd_late,24:50:00,24:50:00,127S,1
+wkd_late,25:10:00,25:10:00,128S,2
+wkd_noon,12:00:00,12:00:00,127S,1
+sat_morning,06:00:00,06:00:00,127S,1
+sun_early,03:00:00,03:00:00,127S,1
+sun_noon,12:00:00,12:00:00,127S,1
+a_far,08:00:00,08:00:00,A01S,1
+a_far,08:02:00,08:02:00,A02S,2
+a_far,08:10:00,08:10:00,H02S,5
+a_far,08:04:00,08:04:00,A03S,3
+a_far,08:06:00,08:06:00,H01S,4
+a_lefferts,09:00:00,09:00:00,A01S,1
+a_lefferts,09:02:00,09:02:00,A02S,2
+a_lefferts,09:04:00,09:04:00,A03S,3
+a_lefferts,09:06:00,09:06:00,A04S,4
+a_lefferts,09:08:00,09:08:00,A05S,5
+a_short,10:02:00,10:02:00,A02S,1
+a_short,10:04:00,10:04:00,A03S,2
+a_short,10:06:00,10:06:00,A04S,3
+"""
+
+
+class Clock:
+    """
+    Stands in for the time module in static_timetable, so a failed load is tried again without waiting.
+    """
+    now = 1000.0
+
+    @classmethod
+    def monotonic(cls) -> float:
+        return cls.now
+
+
+@pytest.fixture(scope='module')
+def timetable_path(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('timetable')
+    zip_path = directory / 'gtfs_subway.zip'
+    with zipfile.ZipFile(zip_path, 'w') as archive:
+        archive.writestr('calendar.txt', CALENDAR)
+        archive.writestr('calendar_dates.txt', CALENDAR_DATES)
+        archive.writestr('trips.txt', TRIPS)
+        archive.writestr('stop_times.txt', STOP_TIMES)
+    output_path = directory / 'timetable_index.bin'
+    static_timetable.compile_timetable(str(zip_path), str(output_path))
+    return output_path
+
+@pytest.fixture(scope='module')
+def timetable(timetable_path):
+    return static_timetable.StaticTimetable(str(timetable_path))
+
+def _epoch(*args) -> int:
+    return int(datetime(*args, tzinfo=static_timetable.TIMETABLE_TIMEZONE).timestamp())
+
+
+def test_weekday_arrival(timetable):
+    # Friday, May 3, 2024
+    assert timetable.next_arrivals('1', '127S', _epoch(2024, 5, 3, 11, 0), 1) == [_epoch(2024, 5, 3, 12, 0)]
+
+def test_previous_day_trip_runs_past_midnight(timetable):
+    # Early Saturday, the Friday trip's 25:10 arrival comes before Saturday's own trips
+    saturday = _epoch(2024, 5, 4, 0, 30)
+    assert timetable.next_arrivals('1', '128S', saturday, 3) == [_epoch(2024, 5, 4, 1, 10)]
+    assert timetable.next_arrivals('1', '127S', saturday, 3) == [_epoch(2024, 5, 4, 0, 50), _epoch(2024, 5, 4, 6, 0)]
+
+def test_cancelled_service_date(timetable):
+    # Saturday, May 18, 2024 has its Saturday service removed in calendar_dates.txt
+    assert timetable.next_arrivals('1', '127S', _epoch(2024, 5, 18, 1, 0), 3) == []
+
+def test_times_count_from_noon_on_daylight_saving_days(timetable):
+    # Clocks go from 2 am to 3 am on Sunday, March 10, 2024, so the day starts at noon minus 12 hours: 11 pm on Saturday
+    sunday = _epoch(2024, 3, 10, 0, 0)
+    noon = _epoch(2024, 3, 10, 12, 0)
+    assert timetable.next_arrivals('1', '127S', sunday, 2) == [noon - 9 * 3600, noon]
+    assert noon - 9 * 3600 == _epoch(2024, 3, 10, 3, 0)
+
+def test_unknown_stop(timetable):
+    assert timetable.next_arrivals('1', '999S', _epoch(2024, 5, 3, 11, 0), 3) == []
+
+def test_stop_order_keeps_branches_together(timetable):
+    assert timetable.stop_order('1', 'S') == ['127S', '128S']
+    assert timetable.stop_order('A', 'S') == ['A01S', 'A02S', 'A03S', 'A04S', 'A05S', 'H01S', 'H02S']
+    assert timetable.stop_order('A', 'N') == []
+
+def test_travel_order_of_looping_trip():
+    assert static_timetable._travel_order({('a', 'b', 'c', 'a'), ('b', 'c')}) == ['a', 'b', 'c']
+
+def test_failed_load_is_tried_again_after_a_wait(timetable_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(static_timetable, '_static_timetable', None)
+    monkeypatch.setattr(static_timetable, '_static_timetable_retry_at', 0.0)
+    monkeypatch.setattr(static_timetable, 'time', Clock)
+    monkeypatch.setattr(Clock, 'now', 1000.0)
+    path = tmp_path / 'timetable_index.bin'
+    assert static_timetable.get_static_timetable(str(path)) is None
+    # Once the timetable is built, it is loaded after the wait, and then kept
+    shutil.copy(timetable_path, path)
+    Clock.now += static_timetable.TIMETABLE_RETRY_SECONDS - 1
+    assert static_timetable.get_static_timetable(str(path)) is None
+    Clock.now += 1
+    loaded = static_timetable.get_static_timetable(str(path))
+    assert loaded is not None
+    assert static_timetable.get_static_timetable(str(tmp_path / 'missing.bin')) is loaded
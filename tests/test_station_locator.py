@@ -0,0 +1,56 @@
+import src.station_locator as station_locator
+import src.static_index as static_index
+from src.station_locator import METERS_PER_DEGREE
+
+import math
+import random
+
+import pytest
+
+# TIMES_SQUARE -- A point at Times Sq-42 St, within 100 meters of the stations of the 7, the 1/2/3 and the shuttle
+TIMES_SQUARE = (40.7557, -73.9871)
+
+
+@pytest.fixture(scope='module')
+def static():
+    return static_index.StaticIndex()
+
+def _brute_force(static: static_index.StaticIndex, lat: float, lon: float, radius_meters: float, count: int) -> list[tuple[str, float]]:
+    scale = math.cos(math.radians(lat))
+    stations = []
+    for i in range(len(static.stop_ids)):
+        if static.location_type[i] == 1:
+            distance = METERS_PER_DEGREE * math.hypot(static.lat[i] - lat, (static.lon[i] - lon) * scale)
+            if distance <= radius_meters:
+                stations.append((distance, static.stop_ids[i]))
+    return [(station_id, distance) for distance, station_id in sorted(stations)[:count]]
+
+
+@pytest.mark.parametrize('cell_degrees', (station_locator.STATION_GRID_CELL_DEGREES, 0.001, 0.05))
+def test_nearest_matches_a_scan_of_every_station(static, cell_degrees):
+    locator = station_locator.StationLocator(static, cell_degrees)
+    points = random.Random(0)
+    for _ in range(200):
+        lat, lon = points.uniform(40.55, 40.90), points.uniform(-74.05, -73.75)
+        radius, count = points.choice((100, 800, 2500)), points.randint(1, 10)
+        nearest = locator.nearest(lat, lon, radius, count)
+        expected = _brute_force(static, lat, lon, radius, count)
+        assert [station_id for station_id, _ in nearest] == [station_id for station_id, _ in expected]
+        assert [distance for _, distance in nearest] == pytest.approx([distance for _, distance in expected])
+
+def test_only_parent_stations_are_found(static):
+    locator = station_locator.StationLocator(static)
+    nearest = locator.nearest(*TIMES_SQUARE, 400, 10)
+    assert [station_id for station_id, distance in nearest if distance < 100] == ['725', '127', '902']
+    assert all(not station_id.endswith(('N', 'S')) for station_id, _ in nearest)
+    assert [distance for _, distance in nearest] == sorted(distance for _, distance in nearest)
+
+def test_nothing_is_found_far_from_every_station(static):
+    locator = station_locator.StationLocator(static)
+    assert locator.nearest(0.0, 0.0, 2000, 5) == []
+    assert locator.nearest(40.6, -73.5, 2000, 5) == []
+
+def test_lines_at_a_station(static):
+    locator = station_locator.StationLocator(static)
+    assert {'1', '2', '3'} <= set(locator.lines_at('127'))
+    assert locator.lines_at('ZZZ') == []
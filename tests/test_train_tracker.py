@@ -0,0 +1,77 @@
+import src.arrival_index as arrival_index
+import src.mta_subway_fetcher as mta_subway_fetcher
+import src.train_tracker as train_tracker
+from src.feed_records import FeedSnapshot, StopTimeRecord, TripRecord, VehicleRecord
+from tests.feeds import make_subway_feed
+
+import pytest
+
+# TIMESTAMP -- The header timestamp of the generated feed
+TIMESTAMP = 1714560000
+
+# TRAIN_ID -- A train running a southbound trip, with its next, northbound trip already in the feed
+TRAIN_ID = '01 1000 242/SFT'
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return mta_subway_fetcher.bin_to_snapshot(make_subway_feed(TIMESTAMP, trips_per_route=30))
+
+def _trip(trip_id: str, direction: str, first_arrival: int, stop_ids: list[str]) -> TripRecord:
+    stop_times = tuple(StopTimeRecord('1', trip_id, stop_id + direction, direction, first_arrival + 90 * i, first_arrival + 90 * i + 30, '1', '1' if i else '')
+                       for i, stop_id in enumerate(stop_ids))
+    return TripRecord(trip_id, '1', direction, '20240501', stop_times, TRAIN_ID)
+
+
+def test_next_trains_follow_the_arrival_index(snapshot):
+    trains = train_tracker.get_train_index(snapshot)
+    index = arrival_index.get_arrival_index(snapshot)
+    current_time = TIMESTAMP + 900
+    for (route_id, stop_id), times in index.items():
+        expected = arrival_index.next_arrivals(index, route_id, stop_id, current_time, 3)
+        found = trains.next_trains(route_id, stop_id, current_time, 3)
+        assert len(found) == len(expected)
+        for train_id, arrival in zip(found, expected):
+            trip = trains.get(train_id)
+            assert trip.route_id == route_id
+            assert arrival in [stop.arrival for stop in trip.stop_times if stop.stop_id == stop_id]
+
+def test_assigned_only_skips_unassigned_trips(snapshot):
+    trains = train_tracker.get_train_index(snapshot)
+    assigned = FeedSnapshot('', TIMESTAMP, {trip_id: trip for trip_id, trip in snapshot.trips.items() if trip.is_assigned}, {})
+    assert trains.assigned_arrival_index == arrival_index.build_arrival_index(assigned)
+    assert train_tracker.get_assigned_arrival_index(snapshot) is trains.assigned_arrival_index
+    for route_id, stop_id in trains.assigned_arrival_index:
+        found = trains.next_trains(route_id, stop_id, TIMESTAMP - 1, 5, assigned_only=True)
+        assert found and all(trains.get(train_id).is_assigned for train_id in found)
+
+def test_index_is_built_once_per_snapshot(snapshot):
+    assert train_tracker.get_train_index(snapshot) is train_tracker.get_train_index(snapshot)
+    assert len(train_tracker.get_train_index(snapshot)) == len(snapshot.trips)
+
+def test_train_position_covers_its_current_and_next_trip():
+    # The next trip comes first in the feed, but the train is running the trip starting earlier
+    next_trip = _trip('next', 'N', TIMESTAMP + 600, ['103', '102', '101'])
+    current_trip = _trip('current', 'S', TIMESTAMP - 100, ['101', '102', '103'])
+    vehicle = VehicleRecord('current', '1', '102S', 1, TIMESTAMP - 5)
+    trains = train_tracker.TrainIndex(FeedSnapshot('', TIMESTAMP, {'next': next_trip, 'current': current_trip}, {'current': vehicle}))
+    assert TRAIN_ID in trains and len(trains) == 1
+    assert trains.get(TRAIN_ID) is current_trip
+    position = trains.position(TRAIN_ID, TIMESTAMP)
+    assert (position['trip_id'], position['direction'], position['stop_id'], position['status']) == ('current', 'S', '102S', 'stopped')
+    # Stops the train has departed are left out
+    assert [(stop['trip_id'], stop['stop_id']) for stop in position['upcoming']] == [('current', '102S'), ('current', '103S'), ('next', '103N'), ('next', '102N'), ('next', '101N')]
+    assert position['upcoming'][0]['actual_track'] == '1'
+    assert trains.next_trains('1', '103S', TIMESTAMP) == [TRAIN_ID]
+
+def test_unknown_train_and_stop():
+    trains = train_tracker.TrainIndex(FeedSnapshot('', TIMESTAMP, {}, {}))
+    assert trains.get(TRAIN_ID) is None
+    assert trains.position(TRAIN_ID, TIMESTAMP) is None
+    assert trains.next_trains('1', '127S', TIMESTAMP) == []
+
+def test_index_only_snapshot_has_no_assigned_index():
+    snapshot = FeedSnapshot('', TIMESTAMP, {}, {})
+    snapshot.index_only = True
+    with pytest.raises(ValueError):
+        train_tracker.get_assigned_arrival_index(snapshot)